@@ -11,6 +11,7 @@ urlpatterns = [
     # Product management
     path('products/', views.product_list, name='product_list'),
     path('products/create/', views.product_create, name='product_create'),
+    path('products/export/', views.product_export, name='product_export'),
     path('products/<int:product_id>/edit/', views.product_edit, name='product_edit'),
     path('products/<int:product_id>/delete/', views.product_delete, name='product_delete'),
     path('products/delete-image/', views.delete_product_image, name='delete_product_image'),
@@ -21,6 +22,7 @@ urlpatterns = [
     
     # Order management
     path('orders/', views.order_list, name='order_list'),
+    path('orders/export/', views.order_export, name='order_export'),
     path('orders/<int:order_id>/', views.order_detail_ajax, name='order_detail_ajax'),
     
     # Customer management
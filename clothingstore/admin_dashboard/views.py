@@ -3,7 +3,7 @@ from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib import messages
-from django.http import JsonResponse, HttpResponseRedirect
+from django.http import JsonResponse, HttpResponseRedirect, HttpResponseBadRequest
 from django.core.paginator import Paginator
 from django.db.models import Q, Count, Sum
 from django.views.decorators.http import require_POST
@@ -12,6 +12,11 @@ from datetime import datetime, timedelta
 import json
 
 from products.models import Product, Category, ProductImage, Size, ProductSize
+from products.search import search_products
+from products.exports import ProductExport
+from orders.exports import OrderExport
+from orders import inventory
+from core.exports import export_response
 from orders.models import Order, OrderItem
 from django.contrib.auth.models import User
 from cart.models import Cart, CartItem, Coupon, AppliedCoupon
@@ -52,7 +57,7 @@ def dashboard_home(request):
     ).aggregate(total=Sum('total_amount'))['total'] or 0
     
     # Low stock products
-    low_stock_products = Product.objects.filter(stock__lte=10, is_active=True)[:5]
+    low_stock_products = Product.objects.filter(stock__lte=10, is_active=True).order_by('stock', 'id')[:5]
     
     # Recent orders
     recent_orders_list = Order.objects.select_related('user').order_by('-created_at')[:10]
@@ -87,14 +92,10 @@ def product_list(request):
     category_filter = request.GET.get('category', '')
     status_filter = request.GET.get('status', '')
     
-    products = Product.objects.select_related('category').prefetch_related('images')
+    products = Product.objects.select_related('category')
     
     if search_query:
-        products = products.filter(
-            Q(name__icontains=search_query) |
-            Q(description__icontains=search_query) |
-            Q(category__name__icontains=search_query)
-        )
+        products = search_products(products, search_query)
     
     if category_filter:
         products = products.filter(category_id=category_filter)
@@ -216,7 +217,10 @@ def product_edit(request, product_id):
             product.description = request.POST.get('description')
             product.price = request.POST.get('price')
             product.discount_price = request.POST.get('discount_price') or None
-            product.stock = request.POST.get('stock', 0)
+            # With sizes, stock is their sum and follows the size quantities
+            has_sizes = product.productsizes.exists()
+            if not has_sizes:
+                product.stock = request.POST.get('stock', 0)
             selected_sizes = request.POST.getlist('available_sizes')
             product.available_colors = request.POST.getlist('available_colors')
             product.is_active = request.POST.get('is_active') == 'on'
@@ -225,7 +229,7 @@ def product_edit(request, product_id):
             
             # Sync ProductSize relations based on selected sizes
             try:
-                stock_int = int(product.stock or 0)
+                stock_int = int(request.POST.get('stock') or 0)
             except (TypeError, ValueError):
                 stock_int = 0
             current_ps = {ps.size.name: ps for ps in product.productsizes.select_related('size')}
@@ -242,6 +246,10 @@ def product_edit(request, product_id):
                 per_size_qty = max(1, (stock_int // max(1, len(active_sizes))) if stock_int > 0 else 1)
                 for s in Size.objects.filter(name__in=missing):
                     ProductSize.objects.create(product=product, size=s, quantity=per_size_qty)
+            if has_sizes and not active_sizes:
+                # The last size went; the figure entered is the stock again
+                product.stock = stock_int
+                product.save(update_fields=['stock', 'updated_at'])
             
             # Handle new images
             images = request.FILES.getlist('images')
@@ -272,6 +280,7 @@ def product_edit(request, product_id):
     
     context = {
         'product': product,
+        'has_sizes': product.productsizes.exists(),
         'categories': categories,
         'size_choices': size_choices,
         'color_choices': color_choices,
@@ -387,6 +396,8 @@ def order_list(request):
                 if tracking_number:
                     order.tracking_number = tracking_number
                 order.save()
+                if new_status == 'cancelled':
+                    inventory.release(order, include_committed=True)
                 messages.success(request, f'Order #{order_id} status updated to {new_status.title()}.')
             except Exception as e:
                 messages.error(request, f'Error updating order status: {str(e)}')
@@ -436,14 +447,14 @@ def order_detail_ajax(request, order_id):
         
         # Get order items
         items_data = []
-        for item in order.items.all():
+        for item in order.items.select_related('product'):
             items_data.append({
                 'product_name': item.product.name,
                 'quantity': item.quantity,
                 'size': item.size,
                 'price': float(item.price),
                 'total': float(item.price * item.quantity),
-                'image_url': item.product.images.first().image.url if item.product.images.exists() else None
+                'image_url': item.product.primary_image_url or None
             })
         
         data = {
@@ -996,3 +1007,21 @@ class CouponForm(forms.ModelForm):
             cleaned_data['valid_to'] = timezone.make_aware(valid_to, tz)
         
         return cleaned_data
+
+@login_required
+@user_passes_test(is_staff_or_superuser)
+def product_export(request):
+    """Stream the catalog as CSV or JSONL"""
+    try:
+        return export_response(request, ProductExport())
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+
+@login_required
+@user_passes_test(is_staff_or_superuser)
+def order_export(request):
+    """Stream orders and their items as CSV or JSONL"""
+    try:
+        return export_response(request, OrderExport())
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
@@ -0,0 +1,63 @@
+# api/catalog_serializers.py
+"""
+Serializers for the public, read-only catalog API.
+
+Every field reads something the view has already loaded (columns picked
+with ``only()``, the category through ``select_related``, sizes and images
+through prefetches), so serializing a page never queries per product. See
+``CATALOG_FIELDS`` in api/catalog_views.py for what each field needs.
+"""
+from rest_framework import serializers
+
+
+class SparseFieldsetMixin:
+    """Keep only the fields named in the ``fields`` context entry, when it is set."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        wanted = self.context.get('fields')
+        if wanted is not None:
+            for name in set(self.fields) - set(wanted):
+                self.fields.pop(name)
+
+
+class CatalogCategoryRefSerializer(serializers.Serializer):
+    slug = serializers.CharField()
+    name = serializers.CharField()
+
+
+class CatalogProductSerializer(SparseFieldsetMixin, serializers.Serializer):
+    id = serializers.IntegerField()
+    slug = serializers.CharField()
+    name = serializers.CharField()
+    url = serializers.CharField(source='get_absolute_url')
+    category = CatalogCategoryRefSerializer()
+    description = serializers.CharField()
+    price = serializers.DecimalField(source='effective_price', max_digits=10, decimal_places=2)
+    regular_price = serializers.DecimalField(source='price', max_digits=10, decimal_places=2)
+    on_sale = serializers.BooleanField(source='has_discount')
+    in_stock = serializers.SerializerMethodField()
+    sizes = serializers.ListField(source='available_sizes', child=serializers.CharField())
+    colors = serializers.ListField(source='available_colors', child=serializers.CharField())
+    image = serializers.CharField(source='primary_image_url')
+    hover_image = serializers.CharField(source='secondary_image_url')
+    images = serializers.SerializerMethodField()
+    created_at = serializers.DateTimeField()
+
+    def get_in_stock(self, product):
+        return product.stock > 0
+
+    def get_images(self, product):
+        # Prefetched by the view, primary image first
+        return [image.image.url for image in product.images.all()]
+
+
+class CatalogCategorySerializer(SparseFieldsetMixin, serializers.Serializer):
+    slug = serializers.CharField()
+    name = serializers.CharField()
+    description = serializers.CharField()
+    url = serializers.CharField(source='get_absolute_url')
+    image = serializers.SerializerMethodField()
+
+    def get_image(self, category):
+        return category.image.url if category.image else ''
@@ -0,0 +1,207 @@
+# api/catalog_views.py
+"""
+Public, read-only catalog API for the headless storefront.
+
+``GET catalog/products/`` lists active products with the storefront's
+filters (``category``, ``price_range`` or ``min_price``/``max_price``,
+``sizes``, ``colors``), sort options and keyset cursors (``cursor``,
+``limit``); ``?fields=`` picks the fields of each product. The columns,
+joins and prefetches are chosen from the requested fields, so a page costs
+the same few queries whatever its size and no COUNT is run.
+
+Responses carry catalog ETags (see products.caching.conditional_catalog).
+"""
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import Prefetch
+from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
+from rest_framework import status
+from rest_framework.permissions import AllowAny
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from products.caching import conditional_catalog
+from products.facets import price_bucket_filter
+from products.models import Product, ProductImage
+from products.navigation import active_categories
+from products.pagination import KeysetPaginator, SORT_ORDERINGS, cursor_url
+
+from .catalog_serializers import CatalogCategorySerializer, CatalogProductSerializer
+
+# What each product field needs loaded: columns for only(), and whether it
+# needs the category join or a prefetch
+CATALOG_FIELDS = {
+    'id': {'columns': ('id',)},
+    'slug': {'columns': ('slug',)},
+    'name': {'columns': ('name',)},
+    'url': {'columns': ('slug',)},
+    'category': {'columns': ('category__slug', 'category__name'), 'join': True},
+    'description': {'columns': ('description',)},
+    'price': {'columns': ('effective_price',)},
+    'regular_price': {'columns': ('price',)},
+    'on_sale': {'columns': ('price', 'discount_price')},
+    'in_stock': {'columns': ('stock',)},
+    'sizes': {'prefetch': 'sizes'},
+    'colors': {'columns': ('available_colors',)},
+    'image': {'columns': ('primary_image_file',)},
+    'hover_image': {'columns': ('secondary_image_file',)},
+    'images': {'prefetch': 'images'},
+    'created_at': {'columns': ('created_at',)},
+}
+# Listings leave out the heavy fields unless asked for them
+DEFAULT_LIST_FIELDS = tuple(name for name in CATALOG_FIELDS if name not in ('description', 'images'))
+CATEGORY_FIELDS = ('slug', 'name', 'description', 'url', 'image')
+
+DEFAULT_PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+
+
+class CatalogQueryError(ValueError):
+    pass
+
+
+def requested_fields(request, allowed, default):
+    """The fields named in ``?fields=``, in the serializer's order, or ``default``."""
+    param = request.query_params.get('fields')
+    if not param:
+        return tuple(default)
+    wanted = {name.strip() for name in param.split(',') if name.strip()}
+    unknown = wanted.difference(allowed)
+    if unknown:
+        raise CatalogQueryError(f'Unknown fields: {", ".join(sorted(unknown))}')
+    return tuple(name for name in allowed if name in wanted)
+
+
+def catalog_queryset(fields, ordering=()):
+    """Active products with exactly what ``fields`` (and the ordering) need loaded."""
+    columns = {'id'}
+    columns.update(name.lstrip('-') for name in ordering)
+    join = False
+    prefetches = set()
+    for name in fields:
+        spec = CATALOG_FIELDS[name]
+        columns.update(spec.get('columns', ()))
+        join = join or spec.get('join', False)
+        if 'prefetch' in spec:
+            prefetches.add(spec['prefetch'])
+
+    products = Product.objects.filter(is_active=True)
+    if join:
+        products = products.select_related('category')
+    products = products.only(*columns)
+    if 'sizes' in prefetches:
+        products = products.with_available_sizes()
+    if 'images' in prefetches:
+        products = products.prefetch_related(
+            Prefetch('images', queryset=ProductImage.objects.order_by('-is_primary', 'id').only('product_id', 'image'))
+        )
+    return products
+
+
+def _decimal_param(request, name):
+    value = request.query_params.get(name)
+    if not value:
+        return None
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        raise CatalogQueryError(f'{name} is not a number: {value!r}')
+
+
+def filter_catalog(products, request):
+    params = request.query_params
+    category_slugs = [slug for slug in params.get('category', '').split(',') if slug]
+    if category_slugs:
+        products = products.filter(category__slug__in=category_slugs)
+    price_range = params.get('price_range')
+    if price_range:
+        condition = price_bucket_filter(price_range)
+        if condition is None:
+            raise CatalogQueryError(f'Unknown price_range: {price_range!r}')
+        products = products.filter(condition)
+    min_price = _decimal_param(request, 'min_price')
+    if min_price is not None:
+        products = products.filter(effective_price__gte=min_price)
+    max_price = _decimal_param(request, 'max_price')
+    if max_price is not None:
+        products = products.filter(effective_price__lte=max_price)
+    sizes = [size for size in params.get('sizes', '').split(',') if size]
+    if sizes:
+        products = products.with_sizes(sizes)
+    colors = [color.lower() for color in params.get('colors', '').split(',') if color]
+    if colors:
+        products = products.with_colors(colors)
+    return products
+
+
+def _page_size(request):
+    value = request.query_params.get('limit')
+    if not value:
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(value)
+    except ValueError:
+        raise CatalogQueryError(f'limit is not a whole number: {value!r}')
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def _bad_request(exc):
+    return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class PublicCatalogView(APIView):
+    # No session or token needed, and none looked at
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+
+@method_decorator(conditional_catalog(), name='get')
+class CatalogProductListAPIView(PublicCatalogView):
+    def get(self, request):
+        try:
+            fields = requested_fields(request, CATALOG_FIELDS, DEFAULT_LIST_FIELDS)
+            sort = request.query_params.get('sort', '-created_at')
+            if sort not in SORT_ORDERINGS:
+                raise CatalogQueryError(f'sort must be one of {", ".join(SORT_ORDERINGS)}')
+            ordering = SORT_ORDERINGS[sort]
+            products = filter_catalog(catalog_queryset(fields, ordering), request)
+            paginator = KeysetPaginator(products, ordering, _page_size(request))
+        except CatalogQueryError as exc:
+            return _bad_request(exc)
+
+        page = paginator.get_page(request.query_params.get('cursor'))
+        serializer = CatalogProductSerializer(page.object_list, many=True, context={'fields': fields})
+        return Response({
+            'results': serializer.data,
+            'next': self._link(request, page.next_cursor),
+            'previous': self._link(request, page.previous_cursor),
+        })
+
+    def _link(self, request, cursor):
+        if not cursor:
+            return None
+        return request.build_absolute_uri(request.path + cursor_url(request, cursor))
+
+
+@method_decorator(conditional_catalog(), name='get')
+class CatalogProductDetailAPIView(PublicCatalogView):
+    def get(self, request, slug):
+        try:
+            fields = requested_fields(request, CATALOG_FIELDS, CATALOG_FIELDS)
+        except CatalogQueryError as exc:
+            return _bad_request(exc)
+        product = get_object_or_404(catalog_queryset(fields), slug=slug)
+        return Response(CatalogProductSerializer(product, context={'fields': fields}).data)
+
+
+@method_decorator(conditional_catalog(), name='get')
+class CatalogCategoryListAPIView(PublicCatalogView):
+    def get(self, request):
+        try:
+            fields = requested_fields(request, CATEGORY_FIELDS, CATEGORY_FIELDS)
+        except CatalogQueryError as exc:
+            return _bad_request(exc)
+        # The process-wide navigation cache; no query
+        serializer = CatalogCategorySerializer(active_categories(), many=True, context={'fields': fields})
+        return Response({'results': serializer.data})
@@ -0,0 +1,177 @@
+import json
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api import fastpath
+from api.serializers import CouponSerializer, ProductSerializer
+from cart.models import Coupon
+from orders.models import Order, OrderItem
+from products.models import Category, Color, Product, ProductColor, ProductImage, ProductSize, Size
+
+
+class Command(BaseCommand):
+    help = (
+        'Times the API listings built with serializers against the row-based fast path '
+        '(api/fastpath.py) on a generated fixture, and checks that both give the same output. '
+        'The fixture is rolled back afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000, help='Products, coupons and orders to generate')
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per measurement; the best is reported')
+
+    def handle(self, *args, **options):
+        if options['rows'] < 1 or options['repeat'] < 1:
+            raise CommandError('--rows and --repeat must be at least 1')
+        self.repeat = options['repeat']
+        with transaction.atomic():
+            user = self.build_fixture(options['rows'])
+            # Serializers build absolute image URLs, which validates the host
+            host = self.allowed_host()
+            request = Request(APIRequestFactory().get('/api/', SERVER_NAME=host, HTTP_HOST=host))
+            request.user = user
+            self.stdout.write(f'{options["rows"]} rows, best of {self.repeat}; fast path renderer: '
+                              f'{fastpath.fast_renderer_classes()[0].__name__}')
+            self.compare('products', *self.products(request))
+            self.compare('coupons', *self.coupons(request))
+            self.compare('orders', *self.orders(user))
+            transaction.set_rollback(True)
+
+    def allowed_host(self):
+        for host in settings.ALLOWED_HOSTS:
+            if host != '*':
+                # '.example.com' also matches example.com itself
+                return host.lstrip('.')
+        return 'localhost'
+
+    def build_fixture(self, count):
+        now = timezone.now()
+        user = User.objects.create_user('benchmark-api-rendering', is_staff=True)
+        category = Category.objects.create(name='Benchmark', slug='benchmark-api-rendering')
+        products = Product.objects.bulk_create([
+            Product(
+                name=f'Benchmark product {i}', slug=f'benchmark-product-{i}', category=category,
+                description='Generated for benchmark_api_rendering', price=Decimal('999.00'),
+                discount_price=Decimal('799.00') if i % 3 == 0 else None, stock=10,
+                available_colors=['black', 'white'], primary_image_file=f'products/benchmark-{i}.jpg',
+            )
+            for i in range(count)
+        ], batch_size=1000)
+        ProductImage.objects.bulk_create([
+            ProductImage(product=product, image=f'products/benchmark-{product.pk}.jpg', is_primary=True)
+            for product in products
+        ], batch_size=1000)
+        sizes = list(Size.objects.all()[:3])
+        ProductSize.objects.bulk_create([
+            ProductSize(product=product, size=size, quantity=5) for product in products for size in sizes
+        ], batch_size=1000)
+        colors = list(Color.objects.all()[:2])
+        ProductColor.objects.bulk_create([
+            ProductColor(product=product, color=color) for product in products for color in colors
+        ], batch_size=1000)
+        Coupon.objects.bulk_create([
+            Coupon(
+                code=f'BENCH{i}', description='Benchmark', discount_value=Decimal('10.00'),
+                valid_from=now - timedelta(days=1), valid_to=now + timedelta(days=30),
+                usage_limit=5, created_at=now, updated_at=now,
+            )
+            for i in range(count)
+        ], batch_size=1000)
+        orders = Order.objects.bulk_create([
+            Order(
+                user=user, order_number=f'BENCH-{i}', total_amount=Decimal('1598.00'),
+                shipping_name='Benchmark', shipping_email='benchmark@example.com', shipping_phone='0',
+                shipping_address='-', shipping_city='-', shipping_state='-', shipping_zip_code='0',
+                shipping_country='-',
+            )
+            for i in range(count)
+        ], batch_size=1000)
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=products[i % count], quantity=2, price=Decimal('799.00'))
+            for i, order in enumerate(orders)
+        ], batch_size=1000)
+        self.product_ids = [product.pk for product in products]
+        return user
+
+    # Each listing returns (serializer path, fast path); both return rendered bytes
+
+    def products(self, request):
+        products = Product.objects.filter(pk__in=self.product_ids).order_by('id')
+
+        def serializers():
+            # Prefetched, so this measures serializing rather than N+1 queries
+            queryset = products.select_related('category').prefetch_related('images', 'sizes', 'colors')
+            return JSONRenderer().render(ProductSerializer(queryset, many=True, context={'request': request}).data)
+
+        def fast():
+            return self.render(fastpath.product_rows(fastpath.product_values(products, request), request))
+        return serializers, fast
+
+    def coupons(self, request):
+        coupons = Coupon.objects.filter(code__startswith='BENCH').order_by('id')
+
+        def serializers():
+            return JSONRenderer().render(CouponSerializer(coupons, many=True, context={'request': request}).data)
+
+        def fast():
+            return self.render(fastpath.coupon_rows(fastpath.coupon_values(coupons), request.user))
+        return serializers, fast
+
+    def orders(self, user):
+        orders = Order.objects.filter(user=user).order_by('-created_at', '-id')
+
+        def serializers():
+            # What api.views.order_list did before the fast path
+            data = []
+            for order in orders:
+                data.append({
+                    'id': order.id,
+                    'order_number': order.order_number,
+                    'user': order.user.username,
+                    'status': order.status,
+                    'total_amount': str(order.total_amount),
+                    'created_at': order.created_at,
+                    'items_count': order.items.count(),
+                })
+            return JSONRenderer().render(data)
+
+        def fast():
+            return self.render(fastpath.order_rows(fastpath.order_values(orders)))
+        return serializers, fast
+
+    def render(self, data):
+        return fastpath.fast_renderer_classes()[0]().render(data)
+
+    def measure(self, build):
+        best = None
+        for _ in range(self.repeat):
+            # Counted directly: the debug query log stops at 9000 queries
+            queries = []
+            with connection.execute_wrapper(lambda execute, *args: queries.append(1) or execute(*args)):
+                started = time.perf_counter()
+                output = build()
+                elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best, len(queries), output
+
+    def compare(self, name, serializers, fast):
+        slow_time, slow_queries, slow_output = self.measure(serializers)
+        fast_time, fast_queries, fast_output = self.measure(fast)
+        same = json.loads(slow_output) == json.loads(fast_output)
+        self.stdout.write(
+            f'{name:<10} serializers {slow_time:8.3f}s {slow_queries:6} queries {len(slow_output):>10} bytes | '
+            f'fast path {fast_time:8.3f}s {fast_queries:6} queries {len(fast_output):>10} bytes | '
+            f'{slow_time / fast_time:5.1f}x'
+        )
+        if not same:
+            self.stderr.write(self.style.ERROR(f'{name}: the fast path output differs from the serializers'))
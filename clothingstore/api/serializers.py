@@ -72,11 +72,7 @@ class CartItemSerializer(serializers.ModelSerializer):
 
     def get_image(self, obj):
         # Return primary product image or first image path if available
-        primary = obj.product.images.filter(is_primary=True).first()
-        if primary and primary.image:
-            return primary.image.url
-        first = obj.product.images.first()
-        return first.image.url if first and first.image else None
+        return obj.product.primary_image_url or None
 
 
 class CartSerializer(serializers.ModelSerializer):
@@ -0,0 +1,88 @@
+import io
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from products.models import Color, Size
+from products.testing import make_product
+
+
+class BenchmarkApiRenderingTests(TestCase):
+    def setUp(self):
+        for name in ('S', 'M'):
+            Size.objects.get_or_create(name=name, defaults={'display_name': name})
+        for name in ('black', 'white'):
+            Color.objects.get_or_create(name=name, defaults={'display_name': name.title()})
+
+    @override_settings(ALLOWED_HOSTS=['.shop.example.com'])
+    def test_fast_path_matches_the_serializers(self):
+        out, err = io.StringIO(), io.StringIO()
+        call_command('benchmark_api_rendering', rows=4, repeat=1, stdout=out, stderr=err)
+        self.assertEqual(err.getvalue(), '')
+        for name in ('products', 'coupons', 'orders'):
+            self.assertIn(name, out.getvalue())
+
+
+class ExportApiTests(TestCase):
+    def setUp(self):
+        make_product('shirt')
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('admin', is_staff=True))
+        self.url = reverse('api:export-products')
+
+    def body(self, response):
+        return b''.join(response.streaming_content).decode()
+
+    def test_accept_header_picks_the_format(self):
+        response = self.client.get(self.url, HTTP_ACCEPT='text/csv')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/csv'))
+        self.assertTrue(self.body(response).startswith('slug,name,'))
+
+        response = self.client.get(self.url, HTTP_ACCEPT='application/x-ndjson')
+        self.assertTrue(response['Content-Type'].startswith('application/x-ndjson'))
+        self.assertIn('"slug": "shirt"', self.body(response))
+
+    def test_file_format_parameter_wins(self):
+        response = self.client.get(self.url, {'file_format': 'jsonl'}, HTTP_ACCEPT='text/csv')
+        self.assertTrue(response['Content-Type'].startswith('application/x-ndjson'))
+
+    def test_bad_range_is_a_400(self):
+        response = self.client.get(self.url, {'since': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('yesterday', response.json()['error'])
+        response = self.client.get(self.url, {'since': 'yesterday'}, HTTP_ACCEPT='text/csv')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(b'yesterday', response.content)
+
+
+class CatalogApiTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        make_product('shirt')
+        make_product('cap', '50.00')
+        self.client = APIClient()
+        self.url = reverse('api:catalog-product-list')
+
+    def test_fields_picks_the_product_fields(self):
+        response = self.client.get(self.url, {'fields': 'slug,price', 'sort': 'price'})
+        self.assertEqual(response.json()['results'], [{'slug': 'cap', 'price': '50.00'}, {'slug': 'shirt', 'price': '100.00'}])
+        self.assertEqual(self.client.get(self.url, {'fields': 'slug,secret'}).status_code, 400)
+
+    def test_bad_limit_is_a_400_without_validators(self):
+        response = self.client.get(self.url, {'limit': 'ten'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('limit', response.json()['error'])
+        self.assertFalse(response.has_header('ETag'))
+        self.assertFalse(response.has_header('Last-Modified'))
+
+    def test_unchanged_catalog_answers_304(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        revalidated = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated['ETag'], response['ETag'])
@@ -3,7 +3,7 @@ from rest_framework_simplejwt.views import (
     TokenRefreshView,
 )
 
-from . import views
+from . import catalog_views, views
 from .views import (
     CouponListCreateAPIView, 
     CouponDetailAPIView,
@@ -35,12 +35,18 @@ urlpatterns = [
     path('auth/password-reset/', PasswordResetRequestAPIView.as_view(), name='api_password_reset_request'),
     path('auth/password-reset/confirm/', PasswordResetConfirmAPIView.as_view(), name='api_password_reset_confirm'),
     
+    # Public catalog (read-only)
+    path('catalog/products/', catalog_views.CatalogProductListAPIView.as_view(), name='catalog-product-list'),
+    path('catalog/products/<slug:slug>/', catalog_views.CatalogProductDetailAPIView.as_view(), name='catalog-product-detail'),
+    path('catalog/categories/', catalog_views.CatalogCategoryListAPIView.as_view(), name='catalog-category-list'),
+    
     # Product Management
     path('products/', views.ProductListCreateAPIView.as_view(), name='product-list-create'),
     path('products/<slug:slug>/', views.ProductDetailAPIView.as_view(), name='product-detail'),
     path('products/<slug:product_slug>/images/', views.upload_product_images, name='upload-images'),
     path('products/<slug:product_slug>/stock/', views.update_product_stock, name='update-stock'),
     path('images/<int:image_id>/', views.delete_product_image, name='delete-image'),
+    path('inventory/', views.bulk_update_stock, name='bulk-update-stock'),
     
     # Category Management
     path('categories/', views.CategoryListCreateAPIView.as_view(), name='category-list-create'),
@@ -50,6 +56,10 @@ urlpatterns = [
     path('orders/', views.order_list, name='order-list'),
     path('orders/<int:order_id>/status/', views.update_order_status, name='update-order-status'),
     
+    # Exports
+    path('exports/products/', views.export_products, name='export-products'),
+    path('exports/orders/', views.export_orders, name='export-orders'),
+    
     # Address Management (user)
     path('addresses/', views.AddressListCreateAPIView.as_view(), name='address-list-create'),
     path('addresses/<int:pk>/', views.AddressDetailAPIView.as_view(), name='address-detail'),
@@ -64,5 +74,6 @@ urlpatterns = [
     path('coupons/remove/', RemoveCouponAPIView.as_view(), name='remove-coupon'),
     path('coupons/validate/', ValidateCouponAPIView.as_view(), name='validate-coupon'),
 
-    # Cart APIs temporarily removed
+    # Cart
+    path('cart/batch/', views.cart_batch, name='cart-batch'),
 ]
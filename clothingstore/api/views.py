@@ -1,13 +1,22 @@
 # api/views.py
 from rest_framework import generics, status
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, renderer_classes
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.renderers import JSONRenderer
 from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
 from products.models import Product, Category, ProductImage
 from orders.models import Order
+from orders.exports import OrderExport
+from orders import inventory
+from products.caching import conditional_catalog
+from products.exports import ProductExport
+from products.stock_sync import MAX_RECORDS, apply_stock_updates
+from core.exports import EXPORT_RENDERERS, export_response
 from accounts.models import Address
+from . import fastpath
 from .serializers import (
     ProductSerializer, 
     ProductCreateUpdateSerializer,
@@ -18,7 +27,9 @@ from .serializers import (
 from rest_framework import status, generics, permissions
 from rest_framework.response import Response
 from django.utils import timezone
+from cart.batch import MAX_OPERATIONS, CartBatch
 from cart.models import Coupon, AppliedCoupon, Cart
+from cart.storage import cart_storage
 from .serializers import (
     CouponSerializer, 
     ApplyCouponSerializer, 
@@ -26,16 +37,29 @@ from .serializers import (
 )
 # Cart APIs temporarily removed; corresponding imports cleaned up
 
+def _product_updated_at(request, slug):
+    return Product.objects.filter(slug=slug).values_list('updated_at', flat=True).first()
+
 # Product Management APIs
+@method_decorator(conditional_catalog(), name='get')
 class ProductListCreateAPIView(generics.ListCreateAPIView):
     queryset = Product.objects.all()
     permission_classes = [IsAuthenticated, IsAdminUser]
+    renderer_classes = fastpath.fast_renderer_classes()
     
     def get_serializer_class(self):
         if self.request.method == 'POST':
             return ProductCreateUpdateSerializer
         return ProductSerializer
     
+    def list(self, request, *args, **kwargs):
+        # Same records as ProductSerializer, built from rows (api/fastpath.py)
+        rows = fastpath.product_values(self.filter_queryset(self.get_queryset()), request)
+        page = self.paginate_queryset(rows)
+        if page is None:
+            return Response(fastpath.product_rows(rows, request))
+        return self.get_paginated_response(fastpath.product_rows(page, request))
+    
     def get_queryset(self):
         queryset = Product.objects.all()
         category = self.request.query_params.get('category', None)
@@ -43,6 +67,7 @@ class ProductListCreateAPIView(generics.ListCreateAPIView):
             queryset = queryset.filter(category__slug=category)
         return queryset
 
+@method_decorator(conditional_catalog(_product_updated_at), name='get')
 class ProductDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
     queryset = Product.objects.all()
     permission_classes = [IsAuthenticated, IsAdminUser]
@@ -54,11 +79,13 @@ class ProductDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
         return ProductSerializer
 
 # Category Management APIs
+@method_decorator(conditional_catalog(), name='get')
 class CategoryListCreateAPIView(generics.ListCreateAPIView):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [IsAuthenticated, IsAdminUser]
 
+@method_decorator(conditional_catalog(), name='get')
 class CategoryDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
@@ -99,6 +126,11 @@ def update_product_stock(request, product_slug):
     product = get_object_or_404(Product, slug=product_slug)
     new_stock = request.data.get('stock')
     
+    if product.productsizes.exists():
+        return Response(
+            {'error': 'Stock of a product with sizes is the sum of its size quantities; update those instead'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
     if new_stock is not None:
         product.stock = new_stock
         product.save()
@@ -111,6 +143,30 @@ def update_product_stock(request, product_slug):
         status=status.HTTP_400_BAD_REQUEST
     )
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated, IsAdminUser])
+def bulk_update_stock(request):
+    """
+    Apply a batch of stock records, ``{"records": [{"slug" or "id", "size",
+    "quantity" or "delta"}, ...]}``, in one transaction. The response lists
+    ``{"quantity": new level}`` or ``{"error": ...}`` per record, in order.
+    """
+    records = request.data.get('records') if isinstance(request.data, dict) else request.data
+    if not isinstance(records, list) or not records:
+        return Response({'error': 'records must be a non-empty list'}, status=status.HTTP_400_BAD_REQUEST)
+    if len(records) > MAX_RECORDS:
+        return Response(
+            {'error': f'At most {MAX_RECORDS} records per request'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    results = apply_stock_updates(records)
+    errors = sum(1 for result in results if 'error' in result)
+    return Response({
+        'updated': len(results) - errors,
+        'errors': errors,
+        'results': results,
+    })
+
 def _sync_default_shipping_profile(user):
     """Mirror the user's default shipping address into their UserProfile."""
     try:
@@ -175,6 +231,7 @@ class AddressDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
 # Order Management APIs
 @api_view(['GET'])
 @permission_classes([IsAuthenticated, IsAdminUser])
+@renderer_classes(fastpath.fast_renderer_classes())
 def order_list(request):
     orders = Order.objects.all().order_by('-created_at')
     
@@ -183,19 +240,28 @@ def order_list(request):
     if status_filter:
         orders = orders.filter(status=status_filter)
     
-    data = []
-    for order in orders:
-        data.append({
-            'id': order.id,
-            'order_number': order.order_number,
-            'user': order.user.username,
-            'status': order.status,
-            'total_amount': str(order.total_amount),
-            'created_at': order.created_at,
-            'items_count': order.items.count(),
-        })
-    
-    return Response(data)
+    # One query for usernames and item counts alike
+    return Response(fastpath.order_rows(fastpath.order_values(orders)))
+
+# Exports: streamed CSV/JSONL, ?file_format=csv|jsonl (or Accept: text/csv,
+# application/x-ndjson)&since=&until=
+def _export(request, export):
+    try:
+        return export_response(request, export)
+    except ValueError as exc:
+        return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, IsAdminUser])
+@renderer_classes([JSONRenderer, *EXPORT_RENDERERS])
+def export_products(request):
+    return _export(request, ProductExport())
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, IsAdminUser])
+@renderer_classes([JSONRenderer, *EXPORT_RENDERERS])
+def export_orders(request):
+    return _export(request, OrderExport())
 
 @api_view(['PATCH'])
 @permission_classes([IsAuthenticated, IsAdminUser])
@@ -206,6 +272,8 @@ def update_order_status(request, order_id):
     if new_status in dict(Order.STATUS_CHOICES):
         order.status = new_status
         order.save()
+        if new_status == 'cancelled':
+            inventory.release(order, include_committed=True)
         
         return Response({
             'order_number': order.order_number,
@@ -253,11 +321,20 @@ class CouponListCreateAPIView(generics.ListCreateAPIView):
     queryset = Coupon.objects.all()
     serializer_class = CouponSerializer
     permission_classes = [IsAuthenticated, IsAdminUser]
+    renderer_classes = fastpath.fast_renderer_classes()
     
     def get_serializer_context(self):
         context = super().get_serializer_context()
         context['request'] = self.request
         return context
+    
+    def list(self, request, *args, **kwargs):
+        # Same records as CouponSerializer, built from rows (api/fastpath.py)
+        rows = fastpath.coupon_values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(rows)
+        if page is None:
+            return Response(fastpath.coupon_rows(rows, request.user))
+        return self.get_paginated_response(fastpath.coupon_rows(page, request.user))
 
 
 class CouponDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
@@ -377,3 +454,27 @@ class ValidateCouponAPIView(generics.GenericAPIView):
             ).data,
             "discount_amount": str(discount_amount)
         })
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def cart_batch(request):
+    """
+    Several cart changes in one transaction (cart/batch.py), for JWT
+    clients: ``{"operations": [...]}`` or the list itself. Answers as the
+    site's cart:batch does for non-htmx clients.
+    """
+    operations = request.data.get('operations') if isinstance(request.data, dict) else request.data
+    if not isinstance(operations, list):
+        return Response(
+            {'success': False, 'message': 'Invalid operations: operations must be a list'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if len(operations) > MAX_OPERATIONS:
+        return Response(
+            {'success': False, 'message': f'At most {MAX_OPERATIONS} operations per request'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    batch = CartBatch(cart_storage(request), request.user, operations)
+    batch.run()
+    return Response(batch.summary())
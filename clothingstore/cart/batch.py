@@ -0,0 +1,215 @@
+# cart/batch.py
+"""
+Several cart changes in one request.
+
+A batch is a list of operations, applied in order::
+
+    {"op": "add", "product_id": 12, "quantity": 2, "size": "M"}
+    {"op": "update", "item_id": "41", "quantity": 3}
+    {"op": "remove", "item_id": "41"}
+    {"op": "apply_coupon", "code": "WELCOME10"}
+
+``item_id`` is the id the cart partials render for a line. An update to 0
+removes the line. The line operations are worked out in memory against the
+cart's current lines, so several operations on one line compose. They are
+then written in one transaction with one statement of each kind: a bulk
+UPDATE for changed lines, a DELETE for removed ones and one upsert for new
+ones (cart.storage.add_lines). Coupons are applied after that, against the
+new subtotal.
+
+Operations that cannot be applied (an unknown line or product, a missing
+or unavailable size, a bad quantity, a coupon that is not valid or a
+coupon without an account) are reported and skipped. The rest of the
+batch still goes through.
+"""
+from django.db import transaction
+from django.db.models import F
+
+from products.models import Product
+
+from .models import AppliedCoupon, Coupon
+from .pricing import drop_invalid_coupon
+from .storage import get_or_create_cart
+
+MAX_OPERATIONS = 100
+OPERATIONS = ('add', 'update', 'remove', 'apply_coupon')
+
+
+class CartOperationError(ValueError):
+    pass
+
+
+def _integer(operation, name, minimum):
+    value = operation.get(name)
+    if value is None:
+        raise CartOperationError(f'{name} is required')
+    if isinstance(value, bool):
+        raise CartOperationError(f'{name} is not a whole number: {value!r}')
+    try:
+        number = int(str(value).strip())
+    except ValueError:
+        raise CartOperationError(f'{name} is not a whole number: {value!r}')
+    if number < minimum:
+        raise CartOperationError(f'{name} must be at least {minimum}')
+    return number
+
+
+def parse_operation(operation):
+    """The operation with its values checked and normalised, or raise CartOperationError."""
+    if not isinstance(operation, dict):
+        raise CartOperationError('Not an object')
+    kind = operation.get('op')
+    if kind not in OPERATIONS:
+        raise CartOperationError(f'op must be one of {", ".join(OPERATIONS)}')
+    if kind == 'add':
+        return {
+            'op': kind,
+            'product_id': _integer(operation, 'product_id', 1),
+            'quantity': _integer(operation, 'quantity', 1) if 'quantity' in operation else 1,
+            'size': str(operation.get('size') or '').strip(),
+            'color': str(operation.get('color') or '').strip(),
+        }
+    if kind == 'apply_coupon':
+        code = str(operation.get('code') or '').strip().upper()
+        if not code:
+            raise CartOperationError('code is required')
+        return {'op': kind, 'code': code}
+    if operation.get('item_id') in (None, ''):
+        raise CartOperationError('item_id is required')
+    quantity = 0 if kind == 'remove' else _integer(operation, 'quantity', 0)
+    return {'op': kind, 'item_id': str(operation['item_id']), 'quantity': quantity}
+
+
+class CartBatch:
+    def __init__(self, storage, user, operations):
+        self.storage = storage
+        self.user = user
+        self.operations = list(operations)
+        self.results = [None] * len(self.operations)
+        # The cart's lines before the batch: item id -> (product id, size, color, quantity)
+        self.before = {}
+
+    def error(self, index, message):
+        self.results[index] = {'error': message}
+
+    def _products(self, parsed):
+        product_ids = {operation['product_id'] for operation in parsed.values() if operation['op'] == 'add'}
+        if not product_ids:
+            return {}
+        return {product.pk: product for product in Product.objects.filter(pk__in=product_ids, is_active=True).with_available_sizes()}
+
+    def _check_add(self, index, operation, products):
+        product = products.get(operation['product_id'])
+        if product is None:
+            self.error(index, f'No product with id {operation["product_id"]}')
+            return False
+        # As add_to_cart: products with sizes need an available one
+        sizes = product.available_sizes
+        if sizes and not operation['size']:
+            self.error(index, f'Select a size for {product.name}')
+            return False
+        if sizes and operation['size'] not in sizes:
+            self.error(index, f'Size {operation["size"]} of {product.name} is not available')
+            return False
+        return True
+
+    def run(self):
+        parsed = {}
+        for index, operation in enumerate(self.operations):
+            try:
+                parsed[index] = parse_operation(operation)
+            except CartOperationError as exc:
+                self.error(index, str(exc))
+        products = self._products(parsed)
+
+        with transaction.atomic(), self.storage.locked():
+            self.before = self.storage.current_lines()
+            item_ids = {line[:3]: item_id for item_id, line in self.before.items()}
+            quantities = {item_id: line[3] for item_id, line in self.before.items()}
+            added = {}
+            coupons = []
+            for index in sorted(parsed):
+                operation = parsed[index]
+                if operation['op'] == 'add':
+                    if not self._check_add(index, operation, products):
+                        continue
+                    key = (operation['product_id'], operation['size'], operation['color'])
+                    if key in item_ids:
+                        quantities[item_ids[key]] += operation['quantity']
+                    else:
+                        added[key] = added.get(key, 0) + operation['quantity']
+                elif operation['op'] == 'apply_coupon':
+                    coupons.append(index)
+                    continue
+                elif operation['item_id'] not in quantities:
+                    self.error(index, 'No such line in the cart')
+                    continue
+                else:
+                    quantities[operation['item_id']] = operation['quantity']
+                self.results[index] = {'ok': True}
+
+            changed = {item_id: quantity for item_id, quantity in quantities.items() if quantity != self.before[item_id][3]}
+            if changed or added:
+                self.storage.write_batch(changed, [key + (quantity,) for key, quantity in added.items()])
+            for index in coupons:
+                self.apply_coupon(index, parsed[index]['code'])
+            drop_invalid_coupon(self.storage.cart)
+        return self.results
+
+    def apply_coupon(self, index, code):
+        if not self.user.is_authenticated:
+            self.error(index, 'Log in to use a coupon')
+            return
+        coupon = Coupon.objects.filter(code__iexact=code, is_active=True).first()
+        if coupon is None:
+            self.error(index, 'Invalid coupon code. Please check and try again.')
+            return
+        pricing = self.storage.cart.pricing
+        is_valid, message = coupon.is_valid(self.user, pricing.subtotal)
+        if not is_valid:
+            self.error(index, message)
+            return
+        discount = pricing.discount_for(coupon)
+        # As cart.views.apply_coupon: the new coupon replaces any applied one
+        cart = get_or_create_cart(self.user)
+        AppliedCoupon.objects.filter(cart=cart).delete()
+        AppliedCoupon.objects.create(coupon=coupon, user=self.user, cart=cart, discount_amount=discount)
+        Coupon.objects.filter(pk=coupon.pk).update(times_used=F('times_used') + 1)
+        self.storage.changed()
+        self.results[index] = {'ok': True, 'discount': str(discount)}
+
+    def diff(self):
+        """The lines added or changed and the ids of the lines removed, after ``run``."""
+        lines = {}
+        current = set()
+        for item in self.storage.cart.items.all():
+            item_id = str(item.pk)
+            current.add(item_id)
+            before = self.before.get(item_id)
+            if before is None or before[3] != item.quantity:
+                lines[item_id] = {
+                    'product_id': item.product_id,
+                    'size': item.size,
+                    'color': item.color,
+                    'quantity': item.quantity,
+                    'line_total': str(item.get_total_price()),
+                }
+        return lines, sorted(set(self.before) - current)
+
+    def summary(self):
+        """What JSON clients get back after ``run``: each operation's result, what changed and the totals."""
+        lines, removed = self.diff()
+        pricing = self.storage.cart.pricing
+        return {
+            'success': all('error' not in result for result in self.results),
+            'results': self.results,
+            'lines': lines,
+            'removed': removed,
+            'totals': {
+                'subtotal': str(pricing.subtotal),
+                'discount': str(pricing.discount),
+                'total': str(pricing.total),
+                'item_count': pricing.item_count,
+            },
+            'coupon': pricing.applied_coupon.coupon.code if pricing.applied_coupon else None,
+        }
@@ -1,7 +1,8 @@
-from .models import Cart
+from django.utils.functional import SimpleLazyObject
+
+from .storage import cart_storage
 
 def cart(request):
-    if request.user.is_authenticated:
-        cart, created = Cart.objects.get_or_create(user=request.user)
-        return {'cart': cart}
-    return {'cart': None}
\ No newline at end of file
+    # The same cart the cart views use, guests' included, so the badge
+    # matches their partials; loaded only by templates that show it
+    return {'cart': SimpleLazyObject(lambda: cart_storage(request).cart)}
@@ -19,7 +19,7 @@ class Command(BaseCommand):
             coupon = Coupon.objects.get(code__iexact=coupon_code, is_active=True)
             
             # Validate the coupon
-            is_valid, message = coupon.is_valid(cart.user, float(cart.subtotal_price))
+            is_valid, message = coupon.is_valid(cart.user, cart.subtotal_price)
             if not is_valid:
                 raise CommandError(f'Cannot apply coupon: {message}')
             
@@ -27,7 +27,7 @@ class Command(BaseCommand):
             AppliedCoupon.objects.filter(cart=cart).delete()
             
             # Calculate and apply the discount
-            discount = coupon.calculate_discount(cart.subtotal_price)
+            discount = cart.pricing.discount_for(coupon)
             AppliedCoupon.objects.create(
                 coupon=coupon,
                 user=cart.user,
@@ -38,6 +38,7 @@ class Command(BaseCommand):
             # Update coupon usage
             coupon.times_used += 1
             coupon.save()
+            cart.reprice()
             
             self.stdout.write(
                 self.style.SUCCESS(
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from cart.storage import flush_dirty_carts
+
+
+class Command(BaseCommand):
+    help = 'Writes write-behind carts with changes older than CART_WRITE_BEHIND_SECONDS back to the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Write back every unsaved cart, however recent')
+        parser.add_argument(
+            '--every',
+            type=int,
+            default=0,
+            metavar='SECONDS',
+            help='Keep running and flush every SECONDS seconds',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            flushed = flush_dirty_carts(everything=options['all'])
+            if flushed or options['verbosity'] > 1:
+                self.stdout.write(self.style.SUCCESS(f'Wrote back {flushed} carts.'))
+            if not options['every']:
+                break
+            time.sleep(options['every'])
@@ -1,12 +1,19 @@
+import logging
+
 from django.db import models
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils import timezone
+from django.utils.functional import cached_property
 from datetime import datetime, timezone as datetime_timezone
 from products.models import Product
+from .pricing import PricedCartMixin, coupon_discount, price_cart
 import uuid
+from decimal import Decimal
+
+logger = logging.getLogger(__name__)
 
-class Cart(models.Model):
+class Cart(PricedCartMixin, models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='carts')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -14,46 +21,16 @@ class Cart(models.Model):
     def __str__(self):
         return f"Cart for {self.user.username}"
     
-    @property
-    def total_price(self):
-        subtotal = sum(float(item.get_total_price()) for item in self.items.all())
-        
-        # Check for applied coupon
-        try:
-            applied_coupon = self.applied_coupon
-            if applied_coupon:
-                discount = float(applied_coupon.discount_amount)
-                total = max(0, subtotal - discount)
-                return total
-        except AppliedCoupon.DoesNotExist:
-            pass
-            
-        return subtotal
-        
-    @property
-    def subtotal_price(self):
-        """Returns the price before any discounts"""
-        return sum(item.get_total_price() for item in self.items.all())
-        
-    @property
-    def discount_amount(self):
-        """Returns the total discount amount"""
-        try:
-            return float(self.applied_coupon.discount_amount)
-        except (AppliedCoupon.DoesNotExist, AttributeError):
-            return 0
+    @cached_property
+    def pricing(self):
+        """Lines, subtotal, discount, total and item count, worked out once (see cart/pricing.py)."""
+        return price_cart(self)
     
-    @property
-    def total_items(self):
-        return sum(item.quantity for item in self.items.all())
-        
-    @property
-    def get_total_after_discount(self):
-        """
-        Returns the total price after applying any discounts.
-        This is an alias for total_price for template compatibility.
-        """
-        return self.total_price
+    def reprice(self):
+        """Forget the computed pricing, loaded lines and coupon after the cart has changed."""
+        self.__dict__.pop('pricing', None)
+        getattr(self, '_prefetched_objects_cache', {}).pop('items', None)
+        self._state.fields_cache.pop('applied_coupon', None)
 
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
@@ -101,7 +78,7 @@ class Coupon(models.Model):
     def __str__(self):
         return f"{self.code} ({self.get_discount_type_display()}: {self.discount_value})"
         
-    def is_valid(self, user=None, cart_total=0, return_reason=True):
+    def is_valid(self, user=None, cart_total=0, return_reason=True, user_usage=None):
         """
         Check if the coupon is currently valid
         
@@ -109,6 +86,7 @@ class Coupon(models.Model):
             user: Optional user to check usage against
             cart_total: Optional cart total to validate against minimum order amount
             return_reason: If True, returns a tuple of (is_valid, reason)
+            user_usage: How often ``user`` has used the coupon, when already counted
             
         Returns:
             bool or tuple: If return_reason is False, returns a boolean indicating validity.
@@ -159,7 +137,8 @@ class Coupon(models.Model):
             
         # Check user-specific usage if user is provided
         if user is not None and user.is_authenticated:
-            user_usage = self.applications.filter(user=user).count()
+            if user_usage is None:
+                user_usage = self.applications.filter(user=user).count()
             if self.usage_limit and user_usage >= self.usage_limit:
                 return (False, 'You have already used this coupon the maximum number of times') if return_reason else False
         
@@ -182,38 +161,16 @@ class Coupon(models.Model):
         Calculate the discount amount based on the coupon type and value.
         
         Args:
-            amount (float): The base amount to calculate discount from
+            amount (Decimal, float or str): The base amount to calculate discount from
             
         Returns:
-            float: The calculated discount amount
+            Decimal: The calculated discount amount, in paise precision
         """
         try:
-            amount = float(amount)
-            discount_value = float(self.discount_value)
-            
-            if amount <= 0:
-                return 0.0
-                
-            if self.discount_type == self.PERCENTAGE:
-                # Calculate percentage discount
-                discount = (discount_value / 100.0) * amount
-                
-                # Apply max discount if set
-                if self.max_discount is not None:
-                    max_discount = float(self.max_discount)
-                    discount = min(discount, max_discount)
-                
-                # Ensure discount doesn't exceed order total
-                final_discount = min(discount, amount)
-                return round(final_discount, 2)
-                
-            else:  # FIXED discount
-                # For fixed amount, just return the value (capped at order total)
-                return min(discount_value, amount)
-                
-        except (TypeError, ValueError) as e:
-            print(f"[ERROR] Error calculating discount: {e}")
-            return 0.0
+            return coupon_discount(self, amount)
+        except (TypeError, ValueError, ArithmeticError):
+            logger.exception('Could not calculate the discount of coupon %s', self.code)
+            return Decimal('0.00')
 
 
 class AppliedCoupon(models.Model):
@@ -0,0 +1,154 @@
+# cart/pricing.py
+"""
+Cart pricing.
+
+``price_cart(cart)`` loads the cart's lines with their products in one
+query and works out the subtotal, discount, total and item count in one
+pass, in Decimal. The applied coupon comes with the cart when it was
+fetched with ``select_related('applied_coupon__coupon')`` (as
+``cart.storage.get_or_create_cart`` does). The lines are left in the cart's
+prefetch cache, so ``cart.items.all()`` in templates reads them too.
+
+The discount is worked out again from the coupon and the current subtotal,
+so a percentage coupon follows the quantities. A coupon that no longer
+holds for the cart (deactivated, expired, or the subtotal has fallen below
+its minimum order amount) gives no discount and comes back as
+``invalid_coupon``. Pricing never writes, so reading a cart in a GET or a
+template stays read-only; the views that change the cart and checkout call
+``drop_invalid_coupon`` to take it off the way ``remove_coupon`` does.
+
+``Cart.pricing`` memoises the result on the cart instance, and the cart
+properties (``subtotal_price``, ``total_price``, ...) read from it. A view
+fetches its cart once, so the view, its templates, ``apply_coupon`` and
+``checkout`` all use one computed summary. ``Cart.reprice()`` forgets it
+after the cart has been changed.
+"""
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import transaction
+from django.db.models import F, Prefetch, prefetch_related_objects
+from django.utils import timezone
+
+CENTS = Decimal('0.01')
+ZERO = Decimal('0.00')
+
+
+def to_money(value):
+    """``value`` as a Decimal rounded to paise; floats go through str() so 0.1 stays 0.10."""
+    if isinstance(value, float):
+        value = str(value)
+    return Decimal(value).quantize(CENTS, rounding=ROUND_HALF_UP)
+
+
+def coupon_discount(coupon, amount):
+    """What ``coupon`` takes off ``amount``: never more than max_discount or the amount itself."""
+    amount = to_money(amount)
+    if amount <= 0:
+        return ZERO
+    if coupon.discount_type == coupon.PERCENTAGE:
+        discount = amount * Decimal(coupon.discount_value) / 100
+        if coupon.max_discount is not None:
+            discount = min(discount, Decimal(coupon.max_discount))
+    else:
+        discount = Decimal(coupon.discount_value)
+    return to_money(min(discount, amount))
+
+
+def coupon_applies(coupon, amount):
+    """
+    Whether an applied ``coupon`` still holds for ``amount``. Usage limits
+    are left out: they were checked when it was applied, and that use counts.
+    """
+    now = timezone.now()
+    return (
+        coupon.is_active
+        and coupon.valid_from <= now <= coupon.valid_to
+        and to_money(amount) >= to_money(coupon.min_order_amount)
+    )
+
+
+class CartPricing:
+    def __init__(self, lines, applied_coupon=None):
+        self.lines = lines
+        subtotal = ZERO
+        item_count = 0
+        for line in lines:
+            subtotal += line.quantity * line.product.get_price
+            item_count += line.quantity
+        self.subtotal = to_money(subtotal)
+        self.item_count = item_count
+        # A coupon that no longer holds is set aside rather than priced
+        self.invalid_coupon = None
+        if applied_coupon and not coupon_applies(applied_coupon.coupon, self.subtotal):
+            self.invalid_coupon, applied_coupon = applied_coupon, None
+        self.applied_coupon = applied_coupon
+        self.discount = self.discount_for(applied_coupon.coupon) if applied_coupon else ZERO
+        self.total = self.subtotal - self.discount
+
+    def discount_for(self, coupon):
+        """The discount ``coupon`` would give on this cart's subtotal."""
+        return coupon_discount(coupon, self.subtotal)
+
+
+class PricedCartMixin:
+    """The cart totals templates use, read from ``self.pricing``."""
+
+    @property
+    def total_price(self):
+        return self.pricing.total
+
+    @property
+    def subtotal_price(self):
+        """Returns the price before any discounts"""
+        return self.pricing.subtotal
+
+    @property
+    def discount_amount(self):
+        """Returns the total discount amount"""
+        return self.pricing.discount
+
+    @property
+    def total_items(self):
+        return self.pricing.item_count
+
+    @property
+    def get_total_after_discount(self):
+        """
+        Returns the total price after applying any discounts.
+        This is an alias for total_price for template compatibility.
+        """
+        return self.total_price
+
+
+def price_cart(cart):
+    from .models import AppliedCoupon, CartItem
+
+    # Does nothing when the caller has prefetched the lines already
+    prefetch_related_objects([cart], Prefetch('items', queryset=CartItem.objects.select_related('product')))
+    try:
+        applied_coupon = cart.applied_coupon
+    except AppliedCoupon.DoesNotExist:
+        applied_coupon = None
+    pricing = CartPricing(list(cart.items.all()), applied_coupon)
+    if pricing.invalid_coupon:
+        # Templates read cart.applied_coupon; show the cart as priced
+        type(cart).applied_coupon.related.set_cached_value(cart, None)
+    return pricing
+
+
+def drop_coupon(applied_coupon):
+    """Take ``applied_coupon`` off its cart and give back its use of the coupon."""
+    from .models import AppliedCoupon, Coupon
+
+    with transaction.atomic():
+        deleted, _ = AppliedCoupon.objects.filter(pk=applied_coupon.pk).delete()
+        if deleted:
+            Coupon.objects.filter(pk=applied_coupon.coupon_id, times_used__gt=0).update(times_used=F('times_used') - 1)
+
+
+def drop_invalid_coupon(cart):
+    """For views that change the cart: drop the coupon its pricing found no longer holds."""
+    pricing = cart.pricing
+    if pricing.invalid_coupon:
+        drop_coupon(pricing.invalid_coupon)
+        pricing.invalid_coupon = None
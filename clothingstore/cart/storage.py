@@ -0,0 +1,559 @@
+# cart/storage.py
+"""
+Where carts are kept.
+
+The cart views get a storage with ``cart_storage(request)`` and make the
+same calls whatever backs it: ``cart`` (the object templates and
+cart/partials/* render), ``add``, ``add_many``, ``set_quantity`` and
+``remove``, and for batches (cart/batch.py) ``current_lines`` and
+``write_batch``. Database carts add lines with ``add_lines``, one
+``INSERT ... ON CONFLICT DO UPDATE`` for any number of them.
+
+* ``DatabaseCartStorage``: the Cart and CartItem rows of a logged-in user.
+* ``GuestCartStorage``: shoppers who have not logged in. Lines are kept in
+  the cache under a token stored in their (signed) session, so browsing
+  and filling a cart needs no login and writes no rows. Logging in adds
+  them to the user's Cart with one upsert (``merge_guest_cart``).
+* ``WriteBehindCartStorage``: logged-in users when ``CART_WRITE_BEHIND`` is
+  on. The cart is read from the database once and then changed in the
+  cache. The changes are written back in one go by the next change made
+  ``CART_WRITE_BEHIND_SECONDS`` after the first unsaved one, by the
+  flush_cart_writes command (``flush_dirty_carts``), which should run every
+  minute or so, and before anything works on the Cart rows directly
+  (``sync_cart``: checkout and coupons).
+
+Cache-backed carts are changed under a lock held in the cache
+(``cache_lock``), so concurrent requests for one cart do not overwrite each
+other's lines. The cache must be shared by all processes (settings.CACHES);
+write-behind stays off when it is not. Lines still waiting there are lost if
+the cache is flushed.
+
+Cache-backed carts keep lines as ``{"<product id>:<size>:<color>": quantity}``
+and render them as unsaved CartItem instances whose id is that key, so the
+``item_id`` the partials post back works for every storage.
+"""
+import time
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import contextmanager, nullcontext
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import F
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from products.caching import cache_is_shared
+from products.models import Product
+
+from .models import AppliedCoupon, Cart, CartItem
+from .pricing import CartPricing, PricedCartMixin
+
+GUEST_CART_SESSION_KEY = 'cart_token'
+GUEST_CART_KEY = 'cart:guest:{}'
+USER_CART_KEY = 'cart:user:{}'
+# Ids of users whose write-behind cart has unsaved changes
+DIRTY_CARTS_KEY = 'cart:user:dirty'
+LOCK_KEY = '{}:lock'
+# Seconds a lock outlives a holder that died, and how long others wait for it
+LOCK_TIMEOUT = 10
+LOCK_WAIT = 15
+LOCK_POLL = 0.02
+# Unique key of a cart line, for the bulk upserts
+LINE_FIELDS = ['cart', 'product', 'size', 'color']
+CARTITEM_TABLE = CartItem._meta.db_table
+UPSERT_COLUMNS = ('cart_id', 'product_id', 'size', 'color', 'quantity', 'added_at')
+# Databases with INSERT ... ON CONFLICT DO UPDATE; others add line by line
+UPSERT_VENDORS = ('sqlite', 'postgresql')
+
+DEFAULT_WRITE_BEHIND_SECONDS = 60
+
+
+def write_behind_enabled():
+    # Unsaved lines in a cache local to one process would be lost to the others
+    return getattr(settings, 'CART_WRITE_BEHIND', False) and cache_is_shared()
+
+
+def line_key(product_id, size='', color=''):
+    return f'{product_id}:{size}:{color}'
+
+
+def parse_line_key(key):
+    """``(product id, size, color)`` for a line key; raises ValueError for anything else."""
+    product_id, size, color = str(key).split(':', 2)
+    return int(product_id), size, color
+
+
+def get_or_create_cart(user):
+    # The applied coupon comes along, for the cart's pricing (cart/pricing.py)
+    cart, created = Cart.objects.select_related('applied_coupon__coupon').get_or_create(user=user)
+    return cart
+
+
+def add_lines(cart, lines):
+    """
+    Add ``(product id, size, color, quantity)`` lines to ``cart``. Each batch
+    is one ``INSERT ... ON CONFLICT DO UPDATE SET quantity = quantity +
+    excluded.quantity``: lines the cart already has get the quantity added
+    in the same statement, without being read first, so a double-clicked
+    add cannot trip over the unique key. Returns the number of lines.
+    """
+    totals = {}
+    for product_id, size, color, quantity in lines:
+        if quantity > 0:
+            # One row per key: a statement may not update the same row twice
+            key = (product_id, size or '', color or '')
+            totals[key] = totals.get(key, 0) + quantity
+    if not totals:
+        return 0
+    if connection.vendor not in UPSERT_VENDORS:
+        with transaction.atomic():
+            for (product_id, size, color), quantity in totals.items():
+                updated = CartItem.objects.filter(cart=cart, product_id=product_id, size=size, color=color).update(
+                    quantity=F('quantity') + quantity
+                )
+                if not updated:
+                    CartItem.objects.create(cart=cart, product_id=product_id, size=size, color=color, quantity=quantity)
+        return len(totals)
+
+    added_at = connection.ops.adapt_datetimefield_value(timezone.now())
+    rows = [(cart.pk, product_id, size, color, quantity, added_at) for (product_id, size, color), quantity in totals.items()]
+    batch_size = (connection.features.max_query_params or 6000) // len(UPSERT_COLUMNS)
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            values = ', '.join(['(' + ', '.join(['%s'] * len(UPSERT_COLUMNS)) + ')'] * len(batch))
+            cursor.execute(
+                f'INSERT INTO {CARTITEM_TABLE} ({", ".join(UPSERT_COLUMNS)}) VALUES {values} '
+                f'ON CONFLICT (cart_id, product_id, size, color) '
+                f'DO UPDATE SET quantity = {CARTITEM_TABLE}.quantity + excluded.quantity',
+                [value for row in batch for value in row],
+            )
+    return len(rows)
+
+
+def write_lines(cart, lines):
+    """
+    Make the cart's rows for ``{line key: quantity}`` have exactly those
+    quantities, with one bulk INSERT ... ON CONFLICT. Lines of products
+    that no longer exist are dropped.
+    """
+    parsed = {}
+    for key, quantity in lines.items():
+        if quantity > 0:
+            parsed[parse_line_key(key)] = quantity
+    product_ids = set(Product.objects.filter(pk__in={key[0] for key in parsed}).values_list('pk', flat=True))
+    CartItem.objects.bulk_create(
+        [
+            CartItem(cart=cart, product_id=product_id, size=size, color=color, quantity=quantity)
+            for (product_id, size, color), quantity in parsed.items()
+            if product_id in product_ids
+        ],
+        update_conflicts=True,
+        unique_fields=LINE_FIELDS,
+        update_fields=['quantity'],
+    )
+
+
+class StoredLines(list):
+    """``cart.items`` of a StoredCart: the manager calls the templates make."""
+
+    def all(self):
+        return self
+
+    def count(self):
+        return len(self)
+
+    def exists(self):
+        return bool(self)
+
+
+class StoredCart(PricedCartMixin):
+    """A cart kept outside the database, shaped like Cart for the templates."""
+
+    def __init__(self, lines, applied_coupon=None):
+        self.items = StoredLines(lines)
+        self._applied_coupon = applied_coupon
+
+    @cached_property
+    def pricing(self):
+        return CartPricing(list(self.items), self._applied_coupon)
+
+    @property
+    def applied_coupon(self):
+        # None once the coupon stops holding for the cart's subtotal
+        return self.pricing.applied_coupon
+
+
+class CartStorage(ABC):
+    """What the cart views need from wherever a cart is kept."""
+
+    @property
+    @abstractmethod
+    def cart(self):
+        """The cart being shown; subclasses cache it until ``changed()``."""
+
+    def add(self, product, quantity, size='', color=''):
+        self.add_many([(product.pk, size, color, quantity)])
+
+    @abstractmethod
+    def add_many(self, lines):
+        """Add ``(product id, size, color, quantity)`` lines, to the quantities of lines already there."""
+
+    @abstractmethod
+    def set_quantity(self, item_id, quantity):
+        """Change a line's quantity (0 removes it); raises Http404 for a line the cart does not have."""
+
+    def remove(self, item_id):
+        self.set_quantity(item_id, 0)
+
+    @abstractmethod
+    def current_lines(self):
+        """``{item id: (product id, size, color, quantity)}``, locked where that means anything."""
+
+    @abstractmethod
+    def write_batch(self, quantities, added):
+        """Set ``{item id: quantity}`` (0 removes the line) and add ``(product id, size, color, quantity)`` lines."""
+
+    def locked(self):
+        """Context keeping other requests from changing the lines between ``current_lines`` and ``write_batch``."""
+        return nullcontext()
+
+    def changed(self):
+        self.__dict__.pop('cart', None)
+
+
+class DatabaseCartStorage(CartStorage):
+    def __init__(self, user):
+        self.user = user
+
+    @cached_property
+    def cart(self):
+        return get_or_create_cart(self.user)
+
+    def add_many(self, lines):
+        added = add_lines(self.cart, lines)
+        self.cart.reprice()
+        return added
+
+    def current_lines(self):
+        rows = CartItem.objects.select_for_update().filter(cart=self.cart).order_by('pk').values_list(
+            'pk', 'product_id', 'size', 'color', 'quantity'
+        )
+        return {str(row[0]): row[1:] for row in rows}
+
+    def write_batch(self, quantities, added):
+        removed = [int(item_id) for item_id, quantity in quantities.items() if not quantity]
+        if removed:
+            CartItem.objects.filter(cart=self.cart, pk__in=removed).delete()
+        updated = [CartItem(pk=int(item_id), quantity=quantity) for item_id, quantity in quantities.items() if quantity]
+        if updated:
+            CartItem.objects.bulk_update(updated, ['quantity'])
+        add_lines(self.cart, added)
+        self.cart.reprice()
+
+    def set_quantity(self, item_id, quantity):
+        cart_item = get_object_or_404(CartItem, id=item_id, cart__user=self.user)
+        if quantity > 0:
+            cart_item.quantity = quantity
+            cart_item.save()
+        else:
+            cart_item.delete()
+        self.changed()
+
+
+class CartBusy(Exception):
+    """A cached cart stayed locked for longer than LOCK_WAIT seconds."""
+
+
+@contextmanager
+def cache_lock(key):
+    """
+    Hold ``key`` in the shared cache. Only one process's ``cache.add``
+    succeeds, so this excludes other workers too; a holder that dies frees
+    the lock after LOCK_TIMEOUT seconds.
+    """
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + LOCK_WAIT
+    while not cache.add(key, token, LOCK_TIMEOUT):
+        if time.monotonic() > deadline:
+            raise CartBusy(key)
+        time.sleep(LOCK_POLL)
+    try:
+        yield
+    finally:
+        if cache.get(key) == token:
+            cache.delete(key)
+
+
+class CachedCartStorage(CartStorage):
+    """
+    Lines kept as ``{line key: quantity}`` by a subclass's ``load`` and
+    ``save``. Changes re-read and save the lines under the cart's lock, so
+    two tabs changing one cart do not lose each other's changes.
+    """
+
+    _lock_depth = 0
+
+    @cached_property
+    def lines(self):
+        return self.load()
+
+    @abstractmethod
+    def lock_key(self):
+        """The cache key locking this cart, or None if nothing is stored yet."""
+
+    @abstractmethod
+    def load(self):
+        """The stored ``{line key: quantity}`` lines."""
+
+    @abstractmethod
+    def save(self):
+        """Store ``self.lines``."""
+
+    def applied_coupon(self):
+        return None
+
+    @contextmanager
+    def locked(self):
+        # Re-entrant, so a batch can hold the lock around its own writes
+        key = self.lock_key()
+        if self._lock_depth or key is None:
+            yield
+            return
+        with cache_lock(key):
+            self.__dict__.pop('lines', None)
+            self._lock_depth = 1
+            try:
+                yield
+            finally:
+                self._lock_depth = 0
+
+    @cached_property
+    def cart(self):
+        parsed = {}
+        for key, quantity in self.lines.items():
+            parsed[key] = (parse_line_key(key), quantity)
+        products = Product.objects.in_bulk({product_id for (product_id, _, _), _ in parsed.values()})
+        items = [
+            CartItem(pk=key, product=products[product_id], quantity=quantity, size=size, color=color)
+            for key, ((product_id, size, color), quantity) in parsed.items()
+            if product_id in products
+        ]
+        return StoredCart(items, self.applied_coupon())
+
+    def add_many(self, lines):
+        lines = [line for line in lines if line[3] > 0]
+        if not lines:
+            return 0
+        with self.locked():
+            for product_id, size, color, quantity in lines:
+                key = line_key(product_id, size, color)
+                self.lines[key] = self.lines.get(key, 0) + quantity
+            self.save()
+        self.changed()
+        return len(lines)
+
+    def current_lines(self):
+        return {key: parse_line_key(key) + (quantity,) for key, quantity in self.lines.items()}
+
+    def write_batch(self, quantities, added):
+        with self.locked():
+            for key, quantity in quantities.items():
+                if quantity:
+                    self.lines[key] = quantity
+                else:
+                    self.lines.pop(key, None)
+            for product_id, size, color, quantity in added:
+                key = line_key(product_id, size, color)
+                self.lines[key] = self.lines.get(key, 0) + quantity
+            self.save()
+        self.changed()
+
+    def set_quantity(self, item_id, quantity):
+        with self.locked():
+            if item_id not in self.lines:
+                raise Http404('No such cart line')
+            if quantity > 0:
+                self.lines[item_id] = quantity
+            else:
+                del self.lines[item_id]
+            self.save()
+        self.changed()
+
+
+class GuestCartStorage(CachedCartStorage):
+    def __init__(self, request):
+        self.request = request
+
+    def timeout(self):
+        return settings.SESSION_COOKIE_AGE
+
+    def lock_key(self):
+        token = self.request.session.get(GUEST_CART_SESSION_KEY)
+        return LOCK_KEY.format(GUEST_CART_KEY.format(token)) if token else None
+
+    def load(self):
+        token = self.request.session.get(GUEST_CART_SESSION_KEY)
+        return cache.get(GUEST_CART_KEY.format(token), {}) if token else {}
+
+    def save(self):
+        token = self.request.session.get(GUEST_CART_SESSION_KEY)
+        if not token:
+            # The only session write a guest cart makes
+            token = self.request.session[GUEST_CART_SESSION_KEY] = uuid.uuid4().hex
+        cache.set(GUEST_CART_KEY.format(token), self.lines, self.timeout())
+
+    def take(self):
+        """The guest's lines, removing them from the cache and the session."""
+        with self.locked():
+            lines = self.lines
+            token = self.request.session.pop(GUEST_CART_SESSION_KEY, None)
+            if token:
+                cache.delete(GUEST_CART_KEY.format(token))
+        self.__dict__.pop('lines', None)
+        self.changed()
+        return lines
+
+
+class WriteBehindCartStorage(CachedCartStorage):
+    def __init__(self, user):
+        self.user = user
+        self.key = USER_CART_KEY.format(user.pk)
+        self.dirty_since = None
+
+    def delay(self):
+        return getattr(settings, 'CART_WRITE_BEHIND_SECONDS', DEFAULT_WRITE_BEHIND_SECONDS)
+
+    def lock_key(self):
+        return LOCK_KEY.format(self.key)
+
+    def load(self):
+        entry = cache.get(self.key)
+        if entry is None:
+            rows = CartItem.objects.filter(cart__user=self.user).values_list('product_id', 'size', 'color', 'quantity')
+            entry = {'lines': {line_key(*row[:3]): row[3] for row in rows}, 'dirty_since': None}
+            cache.set(self.key, entry, None)
+        self.dirty_since = entry['dirty_since']
+        return entry['lines']
+
+    def save(self):
+        newly_dirty = self.dirty_since is None
+        self.dirty_since = self.dirty_since or time.time()
+        if time.time() - self.dirty_since >= self.delay():
+            self.flush()
+        else:
+            cache.set(self.key, {'lines': self.lines, 'dirty_since': self.dirty_since}, None)
+            if newly_dirty:
+                _mark_dirty(self.user.pk)
+
+    def applied_coupon(self):
+        return AppliedCoupon.objects.select_related('coupon').filter(cart__user=self.user).first()
+
+    def flush(self):
+        """Write the cached lines back to the user's Cart rows, if any are unsaved."""
+        with self.locked():
+            lines = self.lines
+            if self.dirty_since is not None:
+                with transaction.atomic():
+                    cart = get_or_create_cart(self.user)
+                    # Lock the cart against anything writing its rows directly
+                    Cart.objects.select_for_update().filter(pk=cart.pk).exists()
+                    kept = {parse_line_key(key) for key, quantity in lines.items() if quantity > 0}
+                    gone = [
+                        pk for pk, product_id, size, color in cart.items.values_list('pk', 'product_id', 'size', 'color')
+                        if (product_id, size, color) not in kept
+                    ]
+                    if gone:
+                        CartItem.objects.filter(pk__in=gone).delete()
+                    write_lines(cart, lines)
+                self.dirty_since = None
+            cache.set(self.key, {'lines': lines, 'dirty_since': None}, None)
+
+
+def _mark_dirty(user_id):
+    """Note a write-behind cart with unsaved changes, for ``flush_dirty_carts``."""
+    with cache_lock(LOCK_KEY.format(DIRTY_CARTS_KEY)):
+        dirty = cache.get(DIRTY_CARTS_KEY, set())
+        dirty.add(user_id)
+        cache.set(DIRTY_CARTS_KEY, dirty, None)
+
+
+def flush_dirty_carts(everything=False):
+    """
+    Write back the write-behind carts whose oldest unsaved change is
+    CART_WRITE_BEHIND_SECONDS old (every unsaved cart with ``everything``).
+    Returns how many were written. Run by the flush_cart_writes command, so
+    carts nobody touches again still reach the database.
+    """
+    dirty = cache.get(DIRTY_CARTS_KEY, set())
+    if not dirty:
+        return 0
+    users = get_user_model().objects.in_bulk(dirty)
+    flushed = 0
+    for user_id in dirty:
+        user = users.get(user_id)
+        if user is None:
+            # The account is gone, and with it the Cart
+            cache.delete(USER_CART_KEY.format(user_id))
+            continue
+        storage = WriteBehindCartStorage(user)
+        with storage.locked():
+            entry = cache.get(storage.key)
+            dirty_since = entry and entry['dirty_since']
+            if dirty_since is not None and (everything or time.time() - dirty_since >= storage.delay()):
+                storage.flush()
+                flushed += 1
+    # Forget the carts that are clean now; one changed again meanwhile stays
+    with cache_lock(LOCK_KEY.format(DIRTY_CARTS_KEY)):
+        dirty = cache.get(DIRTY_CARTS_KEY, set())
+        entries = cache.get_many([USER_CART_KEY.format(user_id) for user_id in dirty])
+        cache.set(DIRTY_CARTS_KEY, {
+            user_id for user_id in dirty
+            if (entries.get(USER_CART_KEY.format(user_id)) or {}).get('dirty_since') is not None
+        }, None)
+    return flushed
+
+
+def cart_storage(request):
+    """The storage of this request's cart, created once per request."""
+    storage = getattr(request, '_cart_storage', None)
+    if storage is None:
+        if not request.user.is_authenticated:
+            storage = GuestCartStorage(request)
+        elif write_behind_enabled():
+            storage = WriteBehindCartStorage(request.user)
+        else:
+            storage = DatabaseCartStorage(request.user)
+        request._cart_storage = storage
+    return storage
+
+
+def sync_cart(user):
+    """
+    Write ``user``'s unsaved write-behind changes to the database and drop
+    the cached copy, before code that reads or writes the Cart rows
+    directly. Does nothing unless CART_WRITE_BEHIND is on.
+    """
+    if write_behind_enabled() and user.is_authenticated:
+        storage = WriteBehindCartStorage(user)
+        with storage.locked():
+            if cache.get(storage.key) is not None:
+                storage.flush()
+                cache.delete(storage.key)
+
+
+def merge_guest_cart(request, user):
+    """Add the guest cart of this session to ``user``'s Cart in one bulk upsert."""
+    lines = GuestCartStorage(request).take()
+    if not lines:
+        return 0
+    sync_cart(user)
+    parsed = [parse_line_key(key) + (quantity,) for key, quantity in lines.items()]
+    # Products deleted meanwhile are left out
+    product_ids = set(Product.objects.filter(pk__in={line[0] for line in parsed}).values_list('pk', flat=True))
+    return add_lines(get_or_create_cart(user), [line for line in parsed if line[0] in product_ids])
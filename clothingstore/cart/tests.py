@@ -1,3 +1,250 @@
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from products.testing import make_product
+
+from .batch import CartBatch
+from .models import AppliedCoupon, Cart, CartItem, Coupon
+from .storage import (
+    USER_CART_KEY, DatabaseCartStorage, WriteBehindCartStorage, add_lines, flush_dirty_carts, get_or_create_cart,
+    sync_cart, write_behind_enabled, write_lines,
+)
+
+
+def stored_lines(user):
+    return {
+        (product_id, size, color): quantity
+        for product_id, size, color, quantity in CartItem.objects.filter(cart__user=user).values_list(
+            'product_id', 'size', 'color', 'quantity'
+        )
+    }
+
+
+class CartLineUpsertTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('shopper')
+        self.cart = get_or_create_cart(self.user)
+        self.shirt = make_product('shirt')
+        self.cap = make_product('cap')
+        CartItem.objects.create(cart=self.cart, product=self.shirt, size='M', quantity=2)
+
+    def check_add_lines(self):
+        added = add_lines(self.cart, [
+            (self.shirt.pk, 'M', None, 1),
+            (self.cap.pk, '', '', 2),
+            (self.cap.pk, None, '', 3),
+            (self.shirt.pk, 'L', '', 0),
+        ])
+        self.assertEqual(added, 2)
+        self.assertEqual(stored_lines(self.user), {(self.shirt.pk, 'M', ''): 3, (self.cap.pk, '', ''): 5})
+
+    def test_add_lines_adds_to_existing_rows_and_sums_duplicates(self):
+        self.check_add_lines()
+
+    def test_add_lines_without_upsert_support(self):
+        with mock.patch('cart.storage.UPSERT_VENDORS', ()):
+            self.check_add_lines()
+
+    def test_write_lines_sets_quantities(self):
+        write_lines(self.cart, {f'{self.shirt.pk}:M:': 7, f'{self.cap.pk}::': 1, '999::': 4})
+        self.assertEqual(stored_lines(self.user), {(self.shirt.pk, 'M', ''): 7, (self.cap.pk, '', ''): 1})
+
+
+class CartBatchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('shopper')
+        self.shirt = make_product('shirt')
+        self.cap = make_product('cap', '50.00')
+        self.line = CartItem.objects.create(cart=get_or_create_cart(self.user), product=self.shirt, quantity=1)
+
+    def run_batch(self, operations):
+        batch = CartBatch(DatabaseCartStorage(self.user), self.user, operations)
+        return batch, batch.run()
+
+    def test_operations_on_one_line_compose(self):
+        item_id = str(self.line.pk)
+        _, results = self.run_batch([
+            {'op': 'add', 'product_id': self.shirt.pk, 'quantity': 2},
+            {'op': 'update', 'item_id': item_id, 'quantity': 5},
+            {'op': 'add', 'product_id': self.cap.pk, 'quantity': 1},
+            {'op': 'add', 'product_id': self.cap.pk, 'quantity': 2},
+        ])
+        self.assertEqual(results, [{'ok': True}] * 4)
+        self.assertEqual(stored_lines(self.user), {(self.shirt.pk, '', ''): 5, (self.cap.pk, '', ''): 3})
+
+    def test_bad_operations_are_skipped(self):
+        batch, results = self.run_batch([
+            {'op': 'remove', 'item_id': str(self.line.pk)},
+            {'op': 'update', 'item_id': '999', 'quantity': 1},
+            {'op': 'add', 'product_id': 999, 'quantity': 1},
+            {'op': 'add', 'product_id': self.cap.pk, 'quantity': 'two'},
+            {'op': 'apply_coupon', 'code': 'NOPE'},
+        ])
+        self.assertEqual(results[0], {'ok': True})
+        self.assertEqual([set(result) for result in results[1:]], [{'error'}] * 4)
+        self.assertEqual(stored_lines(self.user), {})
+        summary = batch.summary()
+        self.assertFalse(summary['success'])
+        self.assertEqual(summary['removed'], [str(self.line.pk)])
+        self.assertEqual(summary['totals']['item_count'], 0)
+
+    def test_htmx_response_swaps_the_navigation_badge(self):
+        self.client.force_login(self.user)
+        page = self.client.get(reverse('cart:detail')).content.decode()
+        self.assertIn('id="cart-count"', page)
+        response = self.client.post(
+            reverse('cart:batch'), {'operations': f'[{{"op": "add", "product_id": {self.cap.pk}, "quantity": 3}}]'},
+            HTTP_HX_REQUEST='true',
+        )
+        badge = response.content.decode().split('id="cart-count"')[1].split('</span>')[0]
+        self.assertIn('hx-swap-oob="true"', badge)
+        self.assertIn('bg-purple-500', badge)
+        # Lines, as base.html counts them, not units
+        self.assertTrue(badge.endswith('>2'))
+
+    def test_api_clients_with_a_token(self):
+        client = APIClient()
+        url = reverse('api:cart-batch')
+        operations = [{'op': 'add', 'product_id': self.cap.pk, 'quantity': 2}]
+        self.assertEqual(client.post(url, operations, format='json').status_code, 401)
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+        response = client.post(url, {'operations': operations}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['success'])
+        self.assertEqual(response.data['totals']['subtotal'], '200.00')
+        self.assertEqual(stored_lines(self.user), {(self.shirt.pk, '', ''): 1, (self.cap.pk, '', ''): 2})
+
+
+class GuestCartTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.shirt = make_product('shirt')
+
+    def badge(self, response):
+        return response.content.decode().split('id="cart-count"')[1].split('</span>')[0]
+
+    def test_guest_adds_an_item_and_sees_the_count(self):
+        page = self.client.get(self.shirt.get_absolute_url())
+        self.assertContains(page, reverse('cart:add'))
+        self.assertIn('hidden', self.badge(page))
+        response = self.client.post(
+            reverse('cart:add'), {'product_id': self.shirt.pk, 'quantity': 2}, HTTP_HX_REQUEST='true'
+        )
+        self.assertTrue(self.badge(response).endswith('>1'))
+        page = self.client.get(self.shirt.get_absolute_url())
+        self.assertNotIn('hidden', self.badge(page))
+        self.assertTrue(self.badge(page).endswith('>1'))
+        self.assertEqual(self.client.get(reverse('cart:detail')).context['cart'].total_items, 2)
+
+
+class CouponPricingTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('shopper')
+        self.shirt = make_product('shirt')
+        now = timezone.now()
+        self.coupon = Coupon.objects.create(
+            code='TEN', discount_value=Decimal('10'), min_order_amount=Decimal('150.00'), times_used=1,
+            valid_from=now - timedelta(days=1), valid_to=now + timedelta(days=1), created_at=now, updated_at=now,
+        )
+        cart = get_or_create_cart(self.user)
+        self.line = CartItem.objects.create(cart=cart, product=self.shirt, quantity=2)
+        AppliedCoupon.objects.create(coupon=self.coupon, user=self.user, cart=cart, discount_amount=Decimal('20.00'))
+
+    def cart(self):
+        return get_or_create_cart(self.user)
+
+    def test_percentage_discount_follows_the_subtotal(self):
+        self.line.quantity = 3
+        self.line.save()
+        cart = self.cart()
+        self.assertEqual((cart.subtotal_price, cart.discount_amount, cart.total_price), (300, 30, 270))
+
+    def test_coupon_below_its_minimum_order_is_priced_out_without_a_write(self):
+        self.line.quantity = 1
+        self.line.save()
+        cart = self.cart()
+        self.assertEqual((cart.discount_amount, cart.total_price), (0, 100))
+        self.assertIsNone(cart.pricing.applied_coupon)
+        self.assertFalse(hasattr(cart, 'applied_coupon'))
+        self.assertEqual(cart.pricing.invalid_coupon.coupon, self.coupon)
+        self.assertTrue(AppliedCoupon.objects.exists())
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('cart:detail'))
+        self.assertNotContains(response, 'Discount (TEN)')
+        self.assertTrue(AppliedCoupon.objects.exists())
+
+    def test_changing_the_cart_drops_the_coupon_that_no_longer_holds(self):
+        self.client.force_login(self.user)
+        self.client.post(reverse('cart:update'), {'item_id': self.line.pk, 'quantity': 1})
+        self.assertFalse(AppliedCoupon.objects.exists())
+        self.coupon.refresh_from_db()
+        self.assertEqual(self.coupon.times_used, 0)
+        self.assertEqual(Cart.objects.get(pk=self.line.cart_id).discount_amount, 0)
+
+
+@override_settings(CART_WRITE_BEHIND=True, CART_WRITE_BEHIND_SECONDS=60)
+class WriteBehindCartTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        # The memory cache the tests run on is shared within this one process
+        self.shared_cache = mock.patch('cart.storage.cache_is_shared', return_value=True)
+        self.shared_cache.start()
+        self.addCleanup(self.shared_cache.stop)
+        self.user = User.objects.create_user('shopper')
+        self.shirt = make_product('shirt')
+        self.cap = make_product('cap')
+
+    def test_changes_stay_in_the_cache_until_flushed(self):
+        WriteBehindCartStorage(self.user).add(self.shirt, 2, 'M')
+        self.assertEqual(stored_lines(self.user), {})
+        self.assertEqual(flush_dirty_carts(), 0)
+        self.assertEqual(flush_dirty_carts(everything=True), 1)
+        self.assertEqual(stored_lines(self.user), {(self.shirt.pk, 'M', ''): 2})
+        self.assertEqual(flush_dirty_carts(everything=True), 0)
+
+    def test_flush_writes_carts_past_the_delay(self):
+        storage = WriteBehindCartStorage(self.user)
+        storage.add(self.shirt, 1)
+        entry = cache.get(storage.key)
+        entry['dirty_since'] -= 61
+        cache.set(storage.key, entry, None)
+        self.assertEqual(flush_dirty_carts(), 1)
+        self.assertEqual(stored_lines(self.user), {(self.shirt.pk, '', ''): 1})
+
+    def test_concurrent_storages_keep_each_others_lines(self):
+        first, second = WriteBehindCartStorage(self.user), WriteBehindCartStorage(self.user)
+        # Both read the cart before either changes it
+        self.assertEqual(first.lines, second.lines)
+        first.add(self.shirt, 1)
+        second.add(self.cap, 2)
+        first.add(self.shirt, 1)
+        sync_cart(self.user)
+        self.assertEqual(stored_lines(self.user), {(self.shirt.pk, '', ''): 2, (self.cap.pk, '', ''): 2})
+        self.assertIsNone(cache.get(USER_CART_KEY.format(self.user.pk)))
+
+    def test_flush_removes_lines_gone_from_the_cache(self):
+        CartItem.objects.create(cart=get_or_create_cart(self.user), product=self.cap, quantity=1)
+        storage = WriteBehindCartStorage(self.user)
+        storage.set_quantity(f'{self.cap.pk}::', 0)
+        storage.add(self.shirt, 3)
+        sync_cart(self.user)
+        self.assertEqual(stored_lines(self.user), {(self.shirt.pk, '', ''): 3})
+
+    def test_off_without_a_shared_cache(self):
+        self.assertTrue(write_behind_enabled())
+        self.shared_cache.stop()
+        self.assertFalse(write_behind_enabled())
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache'}}):
+            self.assertFalse(write_behind_enabled())
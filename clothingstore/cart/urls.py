@@ -8,6 +8,7 @@ urlpatterns = [
     path('add/', views.add_to_cart, name='add'),
     path('update/', views.update_cart_item, name='update'),
     path('remove/', views.remove_from_cart, name='remove'),
+    path('batch/', views.batch_update, name='batch'),
     
     # Coupon URLs
     path('coupon/apply/', views.apply_coupon, name='apply_coupon'),
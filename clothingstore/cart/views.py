@@ -1,4 +1,7 @@
 # cart/views.py
+import json
+import logging
+
 from django.shortcuts import render, get_object_or_404, redirect, reverse
 from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse
@@ -9,13 +12,16 @@ from django.utils import timezone
 from django.db import transaction
 from django.db.models import F
 from products.models import Product
-from .models import Cart, CartItem, Coupon, AppliedCoupon
+from .models import Cart, Coupon, AppliedCoupon
+from .batch import MAX_OPERATIONS, CartBatch
+from .pricing import drop_invalid_coupon
+from .storage import cart_storage, get_or_create_cart, sync_cart
 
-def get_or_create_cart(user):
-    cart, created = Cart.objects.get_or_create(user=user)
-    return cart
+logger = logging.getLogger(__name__)
+
+# The cart itself works for guests too (cart/storage.py); coupons and
+# checkout need an account
 
-@login_required
 @require_POST
 def add_to_cart(request):
     product_id = request.POST.get('product_id')
@@ -24,7 +30,7 @@ def add_to_cart(request):
     color = request.POST.get('color', '')
     
     product = get_object_or_404(Product, id=product_id)
-    cart = get_or_create_cart(request.user)
+    storage = cart_storage(request)
     
     # Validate size selection if the product has size-specific inventory
     try:
@@ -47,95 +53,110 @@ def add_to_cart(request):
             messages.error(request, error_msg)
             return redirect('products:detail', slug=product.slug)
     
-    # Check if item with same product, size and color already exists
-    cart_item = CartItem.objects.filter(
-        cart=cart,
-        product=product,
-        size=size,
-        color=color
-    ).first()
-    
-    if cart_item:
-        # Update existing item
-        cart_item.quantity += quantity
-        cart_item.save()
-        created = False
-    else:
-        # Create new item
-        cart_item = CartItem.objects.create(
-            cart=cart,
-            product=product,
-            quantity=quantity,
-            size=size,
-            color=color
-        )
-        created = True
+    # Adds to the line with the same product, size and color, if there is one
+    storage.add(product, quantity, size, color)
     
     if request.headers.get('HX-Request'):
-        return render(request, 'cart/partials/cart_count.html', {'cart': cart})
+        return render(request, 'cart/partials/cart_count.html', {'cart': storage.cart})
     
     messages.success(request, f'{product.name} added to cart!')
     return redirect('products:detail', slug=product.slug)
 
-@login_required
 def cart_detail(request):
-    # Get or create cart and force refresh from database
-    cart = get_or_create_cart(request.user)
-    cart.refresh_from_db()
-    
-    # Get applied coupon if exists
-    try:
-        applied_coupon = AppliedCoupon.objects.select_related('coupon').get(cart=cart)
-        # Debug output
-        print(f"Found applied coupon: {applied_coupon.coupon.code} with discount: {applied_coupon.discount_amount}")
-    except AppliedCoupon.DoesNotExist:
-        applied_coupon = None
-        print("No coupon applied to this cart")
-    
-    # Debug output
-    print(f"Cart total: {cart.total_price}")
-    print(f"Cart subtotal: {cart.subtotal_price}")
-    print(f"Cart discount: {cart.discount_amount}")
+    cart = cart_storage(request).cart
+    # Lines, products and totals are loaded once here; the templates read
+    # the same summary through the cart
+    pricing = cart.pricing
     
     context = {
         'cart': cart,
-        'applied_coupon': applied_coupon
+        'applied_coupon': pricing.applied_coupon
     }
     return render(request, 'cart/detail.html', context)
 
-@login_required
 @require_POST
 def update_cart_item(request):
     item_id = request.POST.get('item_id')
     quantity = int(request.POST.get('quantity', 1))
     
-    cart_item = get_object_or_404(CartItem, id=item_id, cart__user=request.user)
-    
-    if quantity > 0:
-        cart_item.quantity = quantity
-        cart_item.save()
-    else:
-        cart_item.delete()
+    storage = cart_storage(request)
+    storage.set_quantity(item_id, quantity)
+    drop_invalid_coupon(storage.cart)
     
     if request.headers.get('HX-Request'):
-        cart = cart_item.cart
-        return render(request, 'cart/partials/cart_items.html', {'cart': cart})
+        return render(request, 'cart/partials/cart_items.html', {'cart': storage.cart})
     
     return redirect('cart:detail')
 
-@login_required
 @require_POST
 def remove_from_cart(request):
     item_id = request.POST.get('item_id')
-    item = get_object_or_404(CartItem, id=item_id, cart__user=request.user)
-    item.delete()
+    storage = cart_storage(request)
+    storage.remove(item_id)
+    drop_invalid_coupon(storage.cart)
     
     if request.headers.get('HX-Request'):
-        cart = get_or_create_cart(request.user)
-        return render(request, 'cart/partials/cart_items.html', {'cart': cart})
+        return render(request, 'cart/partials/cart_items.html', {'cart': storage.cart})
     
     return redirect('cart:detail')
 
+def _batch_operations(request):
+    """
+    The operations of a batch request: a JSON body (``{"operations": [...]}``
+    or the list itself), or form fields (``operations`` as JSON,
+    ``quantity:<item id>``, ``remove`` and ``coupon_code``).
+    """
+    if request.content_type == 'application/json':
+        data = json.loads(request.body or b'null')
+        operations = data.get('operations') if isinstance(data, dict) else data
+    elif 'operations' in request.POST:
+        operations = json.loads(request.POST['operations'])
+    else:
+        operations = []
+        for name, value in request.POST.items():
+            if name.startswith('quantity:'):
+                operations.append({'op': 'update', 'item_id': name[len('quantity:'):], 'quantity': value})
+        for item_id in request.POST.getlist('remove'):
+            operations.append({'op': 'remove', 'item_id': item_id})
+        if request.POST.get('coupon_code', '').strip():
+            operations.append({'op': 'apply_coupon', 'code': request.POST['coupon_code']})
+    if not isinstance(operations, list):
+        raise ValueError('operations must be a list')
+    return operations
+
+@require_POST
+def batch_update(request):
+    """
+    Several cart changes in one request and one transaction (cart/batch.py).
+    htmx gets the cart lines back with the order summary and cart count
+    swapped out of band; other clients get JSON with each operation's
+    result and what changed. API clients with a JWT use api/cart/batch/.
+    """
+    try:
+        operations = _batch_operations(request)
+    except ValueError as exc:
+        # json.JSONDecodeError is a ValueError too
+        return JsonResponse({'success': False, 'message': f'Invalid operations: {exc}'}, status=400)
+    if len(operations) > MAX_OPERATIONS:
+        return JsonResponse(
+            {'success': False, 'message': f'At most {MAX_OPERATIONS} operations per request'}, status=400
+        )
+    
+    storage = cart_storage(request)
+    batch = CartBatch(storage, request.user, operations)
+    results = batch.run()
+    cart = storage.cart
+    pricing = cart.pricing
+    
+    if request.headers.get('HX-Request'):
+        return render(request, 'cart/partials/batch.html', {
+            'cart': cart,
+            'applied_coupon': pricing.applied_coupon,
+            'errors': [result['error'] for result in results if 'error' in result],
+        })
+    
+    return JsonResponse(batch.summary())
+
 @login_required
 @require_http_methods(['POST'])
 def apply_coupon(request):
@@ -152,17 +173,19 @@ def apply_coupon(request):
         messages.error(request, 'Please enter a coupon code')
         return redirect('cart:detail')
     
+    # Coupons work on the Cart rows
+    sync_cart(request.user)
     cart = get_or_create_cart(request.user)
     
     try:
-        print(f"[DEBUG] Attempting to apply coupon: {code}")
-        print(f"[DEBUG] Cart subtotal before coupon: {cart.subtotal_price}")
+        logger.debug(f"Attempting to apply coupon: {code}")
+        logger.debug(f"Cart subtotal before coupon: {cart.subtotal_price}")
         
         # Get the coupon (case-insensitive match)
         try:
             coupon = Coupon.objects.get(code__iexact=code, is_active=True)
-            print(f"[DEBUG] Found coupon: {coupon.code} (ID: {coupon.id})")
-            print(f"[DEBUG] Coupon details: {coupon.discount_type}, {coupon.discount_value}, Min: {coupon.min_order_amount}")
+            logger.debug(f"Found coupon: {coupon.code} (ID: {coupon.id})")
+            logger.debug(f"Coupon details: {coupon.discount_type}, {coupon.discount_value}, Min: {coupon.min_order_amount}")
         except Coupon.DoesNotExist:
             message = 'Invalid coupon code. Please check and try again.'
             if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
@@ -170,9 +193,10 @@ def apply_coupon(request):
             messages.error(request, message)
             return redirect('cart:detail')
         
-        # Validate coupon using subtotal_price to avoid recursion
-        is_valid, message = coupon.is_valid(request.user, float(cart.subtotal_price), return_reason=True)
-        print(f"[DEBUG] Coupon validation - Valid: {is_valid}, Message: {message}")
+        # Validate against the subtotal, before any discount
+        pricing = cart.pricing
+        is_valid, message = coupon.is_valid(request.user, pricing.subtotal, return_reason=True)
+        logger.debug(f"Coupon validation - Valid: {is_valid}, Message: {message}")
         
         if not is_valid:
             if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
@@ -181,8 +205,8 @@ def apply_coupon(request):
             return redirect('cart:detail')
         
         # Calculate discount using subtotal (before any discounts)
-        discount_amount = float(coupon.calculate_discount(float(cart.subtotal_price)))
-        print(f"[DEBUG] Calculated discount: {discount_amount} for cart subtotal: {cart.subtotal_price}")
+        discount_amount = pricing.discount_for(coupon)
+        logger.debug(f"Calculated discount: {discount_amount} for cart subtotal: {pricing.subtotal}")
         
         # Start transaction
         with transaction.atomic():
@@ -196,7 +220,7 @@ def apply_coupon(request):
                 cart=cart,
                 discount_amount=discount_amount
             )
-            print(f"[DEBUG] Created AppliedCoupon: {applied_coupon.id}")
+            logger.debug(f"Created AppliedCoupon: {applied_coupon.id}")
             
             # Update coupon usage
             coupon.times_used = F('times_used') + 1
@@ -207,10 +231,10 @@ def apply_coupon(request):
             
             # Force refresh cart and related data
             cart = Cart.objects.select_related('applied_coupon__coupon').get(id=cart.id)
-            print(f"[DEBUG] Cart after coupon - "
-                  f"Subtotal: {cart.subtotal_price}, "
-                  f"Discount: {discount_amount}, "
-                  f"Total: {cart.total_price}")
+            logger.debug(f"Cart after coupon - "
+                         f"Subtotal: {cart.subtotal_price}, "
+                         f"Discount: {discount_amount}, "
+                         f"Total: {cart.total_price}")
             
             success_message = f'Coupon {code} applied successfully! Discount: ₹{discount_amount:,.2f} applied to your order.'
             
@@ -235,9 +259,7 @@ def apply_coupon(request):
         messages.success(request, success_message)
         
     except Exception as e:
-        print(f"[ERROR] Error applying coupon: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"Error applying coupon: {str(e)}")
         error_message = 'An error occurred while applying the coupon. Please try again or contact support.'
         
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
@@ -253,6 +275,8 @@ def apply_coupon(request):
 @login_required
 @require_http_methods(['POST'])
 def remove_coupon(request):
+    # Coupons work on the Cart rows
+    sync_cart(request.user)
     cart = get_or_create_cart(request.user)
     
     try:
@@ -302,9 +326,7 @@ def remove_coupon(request):
             }, status=400)
             
     except Exception as e:
-        print(f"[ERROR] Error removing coupon: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"Error removing coupon: {str(e)}")
         
         error_message = 'An error occurred while removing the coupon. Please try again.'
         messages.error(request, error_message)
@@ -331,17 +353,20 @@ def validate_coupon_ajax(request):
     if not code:
         return JsonResponse({'valid': False, 'message': 'Please enter a coupon code'})
         
+    # Coupons work on the Cart rows
+    sync_cart(request.user)
     cart = get_or_create_cart(request.user)
     
     try:
         # Get the coupon (case-insensitive match)
         coupon = Coupon.objects.get(code__iexact=code, is_active=True)
         
-        # Use subtotal_price for validation to avoid recursion
-        is_valid, message = coupon.is_valid(request.user, float(cart.subtotal_price))
+        # Validate against the subtotal, before any discount
+        pricing = cart.pricing
+        is_valid, message = coupon.is_valid(request.user, pricing.subtotal)
         
         if is_valid:
-            discount_amount = float(coupon.calculate_discount(cart.subtotal_price))
+            discount_amount = float(pricing.discount_for(coupon))
             return JsonResponse({
                 'valid': True,
                 'message': 'Coupon applied successfully!',
@@ -364,9 +389,7 @@ def validate_coupon_ajax(request):
             'message': 'Invalid coupon code. Please check and try again.'
         })
     except Exception as e:
-        print(f"[ERROR] Error validating coupon: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"Error validating coupon: {str(e)}")
         return JsonResponse({
             'valid': False,
             'message': 'An error occurred while validating the coupon. Please try again.'
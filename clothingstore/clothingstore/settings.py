@@ -82,6 +82,7 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
                 'wishlist.context_processors.wishlist_context',
+                'cart.context_processors.cart',
             ],
         },
     },
@@ -202,6 +203,40 @@ SIMPLE_JWT = {
 
 
 
+# Cache
+# Shared by every worker process: the catalog's cache generations
+# (products/caching.py and the navigation, facet and autocomplete caches)
+# and the guest and write-behind carts (cart/storage.py) rely on a change
+# made in one process being seen by all the others, and on cache reads not
+# costing a query. That takes Redis (REDIS_URL); the database cache will not
+# do, as it culls the first keys in key order once full, whatever their
+# timeouts, which would drop unsaved carts. Without REDIS_URL each process
+# has its own memory cache, which is only fit for a single development
+# server (products.W001; ``check --deploy`` fails). Unsaved write-behind
+# carts and generations have no timeout and must never be evicted: give
+# Redis a volatile-* maxmemory-policy.
+REDIS_URL = config('REDIS_URL', default='')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Carts (cart/storage.py): with write-behind on, logged-in carts are
+# changed in the cache and written back once their oldest change is this
+# many seconds old, by the flush_cart_writes command (run it every minute,
+# e.g. ``flush_cart_writes --every 30``). Needs the Redis cache above.
+CART_WRITE_BEHIND = config('CART_WRITE_BEHIND', cast=bool, default=False)
+CART_WRITE_BEHIND_SECONDS = 60
+
 # Razorpay
 RAZORPAY_KEY_ID = 'rzp_test_t3dbQtsUI9wNjh'
 RAZORPAY_KEY_SECRET = config('RAZORPAY_KEY_SECRET', default='YOUR_SECRET_KEY')
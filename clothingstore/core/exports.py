@@ -0,0 +1,236 @@
+# core/exports.py
+"""
+Streaming CSV and JSON Lines exports.
+
+An ``Export`` describes one dataset: its queryset, the CSV columns and the
+JSON record for an object. Rows are read with ``QuerySet.iterator()`` in
+chunks (prefetches run per chunk) and written out as they are produced, so
+an export of any size runs in constant memory, over HTTP through
+``StreamingHttpResponse`` or to a file from a management command. Output
+can be gzip compressed on the fly. Both formats write timestamps with
+``format_timestamp``, so a CSV and a JSONL export of the same rows agree.
+"""
+import csv
+import datetime
+from abc import ABC, abstractmethod
+import sys
+import zlib
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.renderers import BaseRenderer
+
+FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+CHUNK_SIZE = 2000
+# Lines are joined into blocks of about this many characters before they
+# are encoded, compressed and sent
+BUFFER_SIZE = 64 * 1024
+
+
+def format_timestamp(value):
+    """ISO 8601 with microseconds and the UTC offset, which parse_datetime reads back."""
+    return value.isoformat()
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime.datetime):
+        return format_timestamp(value)
+    return value
+
+
+class ExportJSONEncoder(DjangoJSONEncoder):
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return format_timestamp(o)
+        return super().default(o)
+
+
+class _Echo:
+    """File-like object for csv.writer that hands back each formatted line."""
+
+    def write(self, value):
+        return value
+
+
+def parse_bound(value, end=False):
+    """
+    Parse an ISO date or datetime from a query string or command line. A
+    bare date as the ``end`` bound covers that whole day.
+    """
+    if not value:
+        return None
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f'Not a date or datetime: {value!r}')
+        if end:
+            day += datetime.timedelta(days=1)
+        moment = datetime.datetime.combine(day, datetime.time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+class Export(ABC):
+    name = None
+    # Field the date range applies to
+    date_field = 'created_at'
+    header = ()
+
+    @abstractmethod
+    def get_queryset(self):
+        pass
+
+    @abstractmethod
+    def csv_rows(self, obj):
+        """CSV rows for one object; most exports have exactly one."""
+
+    @abstractmethod
+    def record(self, obj):
+        pass
+
+    def objects(self, since=None, until=None):
+        queryset = self.get_queryset()
+        if since is not None:
+            queryset = queryset.filter(**{f'{self.date_field}__gte': since})
+        if until is not None:
+            # Exclusive, so consecutive ranges never export a row twice
+            queryset = queryset.filter(**{f'{self.date_field}__lt': until})
+        return queryset.iterator(chunk_size=CHUNK_SIZE)
+
+    def lines(self, fmt, since=None, until=None):
+        if fmt == 'csv':
+            writer = csv.writer(_Echo())
+            yield writer.writerow(self.header)
+            for obj in self.objects(since, until):
+                for row in self.csv_rows(obj):
+                    yield writer.writerow([_csv_value(value) for value in row])
+        else:
+            encoder = ExportJSONEncoder(ensure_ascii=False)
+            for obj in self.objects(since, until):
+                yield encoder.encode(self.record(obj)) + '\n'
+
+    def stream(self, fmt, since=None, until=None, compress=False):
+        """Yield the export as bytes in blocks of about BUFFER_SIZE."""
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compress else None
+        buffer, size = [], 0
+        for line in self.lines(fmt, since, until):
+            buffer.append(line)
+            size += len(line)
+            if size >= BUFFER_SIZE:
+                data = ''.join(buffer).encode()
+                buffer, size = [], 0
+                if compressor is not None:
+                    data = compressor.compress(data)
+                if data:
+                    yield data
+        data = ''.join(buffer).encode()
+        if compressor is not None:
+            data = compressor.compress(data) + compressor.flush()
+        if data:
+            yield data
+
+    def filename(self, fmt, compress=False):
+        stamp = timezone.localdate().isoformat()
+        return f'{self.name}-{stamp}.{fmt}' + ('.gz' if compress else '')
+
+
+class ExportRenderer(BaseRenderer):
+    """
+    Lets a DRF view that streams an export accept the export's media type.
+    The export itself bypasses rendering; only error details come through
+    here, as plain text.
+    """
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            data = data.get('error') or data.get('detail') or data
+        return str(data).encode(self.charset)
+
+
+class CSVRenderer(ExportRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class JSONLinesRenderer(ExportRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'jsonl'
+
+
+EXPORT_RENDERERS = (CSVRenderer, JSONLinesRenderer)
+
+
+def export_response(request, export):
+    """
+    Stream ``export`` in the format asked for with ``?file_format=``, or by
+    the Accept header in DRF views (csv by default), for the
+    ``?since=``/``?until=`` range, compressed with gzip when the client
+    accepts it. Raises ValueError for bad parameters.
+    """
+    negotiated = getattr(getattr(request, 'accepted_renderer', None), 'format', None)
+    fmt = request.GET.get('file_format') or (negotiated if negotiated in FORMATS else 'csv')
+    if fmt not in FORMATS:
+        raise ValueError(f'file_format must be one of {", ".join(FORMATS)}')
+    since = parse_bound(request.GET.get('since'))
+    until = parse_bound(request.GET.get('until'), end=True)
+
+    compress = 'gzip' in request.headers.get('Accept-Encoding', '')
+    response = StreamingHttpResponse(
+        export.stream(fmt, since, until, compress=compress),
+        content_type=f'{FORMATS[fmt]}; charset=utf-8',
+    )
+    response['Content-Disposition'] = f'attachment; filename="{export.filename(fmt)}"'
+    response['Vary'] = 'Accept-Encoding'
+    if compress:
+        response['Content-Encoding'] = 'gzip'
+    return response
+
+
+class ExportCommand(BaseCommand):
+    """Base for the export_* management commands; subclasses set ``export_class``."""
+    export_class = None
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=tuple(FORMATS), default='csv')
+        parser.add_argument('--since', help='Start of the date range (ISO date or datetime)')
+        parser.add_argument('--until', help='End of the date range; a bare date includes that day')
+        parser.add_argument(
+            '--output', '-o',
+            help='File to write (default: a dated file name in the current directory, "-" for stdout)',
+        )
+        parser.add_argument('--gzip', action='store_true', help='Compress the output')
+
+    def handle(self, *args, **options):
+        export = self.export_class()
+        fmt = options['format']
+        try:
+            since = parse_bound(options['since'])
+            until = parse_bound(options['until'], end=True)
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        output = options['output'] or export.filename(fmt, options['gzip'])
+        compress = options['gzip'] or output.endswith('.gz')
+
+        written = 0
+        if output == '-':
+            fh = sys.stdout.buffer
+            for block in export.stream(fmt, since, until, compress=compress):
+                fh.write(block)
+            fh.flush()
+            return
+        with open(output, 'wb') as fh:
+            for block in export.stream(fmt, since, until, compress=compress):
+                fh.write(block)
+                written += len(block)
+        self.stderr.write(self.style.SUCCESS(f'Wrote {written} bytes to {output}.'))
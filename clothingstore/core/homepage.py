@@ -0,0 +1,37 @@
+# core/homepage.py
+"""
+Cached data for the home page.
+
+Featured products (with their category and denormalized images) and the
+ordered banners are loaded together and stored in the cache as one pickled
+blob; the categories come from the shared navigation cache. The key carries the catalog page generation from
+products.caching, which product, category and banner changes all replace,
+so an edit in the dashboard shows up on the next request.
+"""
+from django.core.cache import cache
+
+from products.caching import page_generation
+from products.models import Product
+
+from .models import Banner
+
+HOME_DATA_KEY = 'core:home:{}'
+HOME_DATA_TIMEOUT = 60 * 60
+
+
+def build_home_data():
+    return {
+        'featured_products': list(
+            Product.objects.filter(is_featured=True, is_active=True).select_related('category')[:8]
+        ),
+        'banners': list(Banner.objects.filter(is_active=True).order_by('order', '-created_at')),
+    }
+
+
+def get_home_data():
+    key = HOME_DATA_KEY.format(page_generation())
+    data = cache.get(key)
+    if data is None:
+        data = build_home_data()
+        cache.set(key, data, HOME_DATA_TIMEOUT)
+    return data
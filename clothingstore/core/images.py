@@ -0,0 +1,227 @@
+# core/images.py
+"""
+Responsive image derivatives.
+
+Uploaded images (product photos, category and banner images, profile
+pictures) are resized to a few fixed widths in WebP and JPEG by a process
+pool, off the request path. Variants are stored content-addressed under
+``MEDIA_ROOT/derivatives/<digest[:2]>/<digest>/<width>.<ext>``, so the same
+photo uploaded twice is processed and stored once.
+
+A small JSON manifest per upload maps its storage name to the digest and the
+widths that exist; the ``srcset`` template tag reads it through the cache.
+Pages fall back to the original image until the variants are ready.
+"""
+import functools
+import hashlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.dispatch import Signal
+
+logger = logging.getLogger(__name__)
+
+WIDTHS = (200, 400, 800, 1600)
+# extension -> (Pillow format, save options)
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+DERIVATIVE_DIR = 'derivatives'
+MANIFEST_DIR = 'derivatives/sources'
+MANIFEST_CACHE_KEY = 'images:manifest:{}'
+MANIFEST_CACHE_TIMEOUT = 60 * 60 * 24
+# Images still being processed are looked up again after this long
+PENDING_CACHE_TIMEOUT = 60
+# Images finished within this many seconds of each other are announced together
+READY_BATCH_SECONDS = 2
+
+
+# Sent with ``names`` (the sources' storage names) when their variants are
+# ready, so caches holding HTML without a srcset can be dropped. A bulk upload
+# or a command run sends it once, not once per image.
+derivatives_ready = Signal()
+
+
+def manifest_name(source_name):
+    return f'{MANIFEST_DIR}/{hashlib.sha1(source_name.encode()).hexdigest()}.json'
+
+
+def variant_name(digest, width, ext):
+    return f'{DERIVATIVE_DIR}/{digest[:2]}/{digest}/{width}.{ext}'
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'wb') as fh:
+        fh.write(data)
+    os.replace(temp_path, path)
+
+
+def render_variants(source_path, media_root, source_name):
+    """
+    Resize one image and write its variants and manifest. Runs in a pool
+    worker, so it only touches Pillow and the filesystem, never Django.
+    """
+    from PIL import Image, ImageOps
+
+    with open(source_path, 'rb') as fh:
+        data = fh.read()
+    digest = hashlib.sha256(data).hexdigest()
+
+    with Image.open(io.BytesIO(data)) as original:
+        image = ImageOps.exif_transpose(original)
+        width, height = image.size
+        widths = [w for w in WIDTHS if w <= width] or [width]
+
+        for target in widths:
+            paths = {
+                ext: os.path.join(media_root, variant_name(digest, target, ext))
+                for ext in FORMATS
+            }
+            if all(os.path.exists(path) for path in paths.values()):
+                continue
+            resized = image if target == width else image.resize(
+                (target, max(1, round(height * target / width))), Image.LANCZOS
+            )
+            for ext, (pillow_format, options) in FORMATS.items():
+                if os.path.exists(paths[ext]):
+                    continue
+                output = resized
+                if pillow_format == 'JPEG' and resized.mode != 'RGB':
+                    # JPEG has no alpha channel; flatten onto white
+                    rgb = Image.new('RGB', resized.size, (255, 255, 255))
+                    rgba = resized.convert('RGBA')
+                    rgb.paste(rgba, mask=rgba.split()[-1])
+                    output = rgb
+                buffer = io.BytesIO()
+                output.save(buffer, pillow_format, **options)
+                _write_atomic(paths[ext], buffer.getvalue())
+
+    manifest = {'digest': digest, 'widths': widths, 'width': width, 'height': height}
+    _write_atomic(
+        os.path.join(media_root, manifest_name(source_name)), json.dumps(manifest).encode()
+    )
+    return manifest
+
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        # spawn, not fork: the web process may be multi-threaded
+        _executor = ProcessPoolExecutor(
+            max_workers=getattr(settings, 'IMAGE_DERIVATIVE_WORKERS', 2),
+            mp_context=multiprocessing.get_context('spawn'),
+        )
+    return _executor
+
+
+def submit_derivatives(name, force=False):
+    """
+    Hand one stored image to the process pool. Returns the future, or None
+    when the image already has variants or storage is not on local disk.
+    """
+    global _executor
+    if not force and default_storage.exists(manifest_name(name)):
+        return None
+    try:
+        path = default_storage.path(name)
+    except NotImplementedError:
+        logger.warning('Image derivatives need a local filesystem storage, skipping %s', name)
+        return None
+    try:
+        future = get_executor().submit(render_variants, path, str(settings.MEDIA_ROOT), name)
+    except BrokenProcessPool:
+        _executor = None
+        future = get_executor().submit(render_variants, path, str(settings.MEDIA_ROOT), name)
+    future.add_done_callback(functools.partial(_derivatives_done, name))
+    return future
+
+
+def _derivatives_done(name, future):
+    try:
+        manifest = future.result()
+    except Exception:
+        logger.exception('Generating image derivatives failed for %s', name)
+        return
+    cache.set(MANIFEST_CACHE_KEY.format(name), manifest, MANIFEST_CACHE_TIMEOUT)
+    _ready(name)
+
+
+_ready_lock = threading.Lock()
+_ready_names = []
+_ready_timer = None
+
+
+def _ready(name):
+    global _ready_timer
+    with _ready_lock:
+        _ready_names.append(name)
+        if _ready_timer is None:
+            # Not a daemon, so an exiting process still sends it
+            _ready_timer = threading.Timer(READY_BATCH_SECONDS, send_ready)
+            _ready_timer.start()
+
+
+def send_ready():
+    """Send one ``derivatives_ready`` for every image finished since the last one."""
+    global _ready_timer
+    with _ready_lock:
+        names = list(_ready_names)
+        _ready_names.clear()
+        if _ready_timer is not None:
+            _ready_timer.cancel()
+            _ready_timer = None
+    if names:
+        derivatives_ready.send(sender=None, names=names)
+
+
+def queue_derivatives(field_file):
+    """Generate variants for an uploaded image once the current transaction commits."""
+    if not field_file:
+        return
+    name = field_file.name
+    transaction.on_commit(lambda: submit_derivatives(name))
+
+
+def get_manifest(name):
+    key = MANIFEST_CACHE_KEY.format(name)
+    manifest = cache.get(key)
+    if manifest is None:
+        try:
+            with default_storage.open(manifest_name(name)) as fh:
+                manifest = json.load(fh)
+        except (OSError, ValueError):
+            manifest = {}
+        cache.set(key, manifest, MANIFEST_CACHE_TIMEOUT if manifest else PENDING_CACHE_TIMEOUT)
+    return manifest or None
+
+
+def srcset(image, ext='webp'):
+    """``srcset`` value for an ImageField file or storage name, or '' if not ready."""
+    name = getattr(image, 'name', image)
+    if not name:
+        return ''
+    manifest = get_manifest(name)
+    if not manifest:
+        return ''
+    digest = manifest['digest']
+    return ', '.join(
+        f'{default_storage.url(variant_name(digest, width, ext))} {width}w'
+        for width in manifest['widths']
+    )
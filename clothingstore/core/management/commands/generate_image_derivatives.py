@@ -0,0 +1,64 @@
+from concurrent.futures import wait
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from core import images
+from core.signals import IMAGE_FIELDS
+
+
+class Command(BaseCommand):
+    help = 'Generates resized WebP/JPEG variants for every uploaded image that lacks them'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Regenerate variants even when an image already has a manifest',
+        )
+        parser.add_argument(
+            '--sync',
+            action='store_true',
+            help='Resize in this process instead of the worker pool',
+        )
+
+    def handle(self, *args, **options):
+        names = set()
+        for model, field in IMAGE_FIELDS.items():
+            names.update(
+                name for name in model.objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True})
+                .values_list(field, flat=True).iterator()
+            )
+
+        futures = []
+        rendered = {}
+        failed = 0
+        for name in sorted(names):
+            if not default_storage.exists(name):
+                self.stdout.write(self.style.WARNING(f'Missing file: {name}'))
+                failed += 1
+                continue
+            if options['sync']:
+                if options['force'] or not default_storage.exists(images.manifest_name(name)):
+                    rendered[name] = images.render_variants(default_storage.path(name), str(settings.MEDIA_ROOT), name)
+                continue
+            future = images.submit_derivatives(name, force=options['force'])
+            if future is not None:
+                futures.append(future)
+
+        done, _ = wait(futures)
+        failed += sum(1 for future in done if future.exception() is not None)
+        if rendered:
+            # One signal for the whole run, once the new manifests are readable
+            cache.set_many(
+                {images.MANIFEST_CACHE_KEY.format(name): manifest for name, manifest in rendered.items()},
+                images.MANIFEST_CACHE_TIMEOUT,
+            )
+            images.derivatives_ready.send(sender=None, names=list(rendered))
+        # Announce the pool's images now rather than after the batching delay
+        images.send_ready()
+        self.stdout.write(
+            self.style.SUCCESS(f'Processed {len(names)} images ({failed} failed).')
+        )
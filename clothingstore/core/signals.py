@@ -0,0 +1,42 @@
+# core/signals.py
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+from accounts.models import UserProfile
+from products.caching import bump_page_generation
+from products.models import Category, ProductImage
+
+from .images import queue_derivatives
+from .models import Banner
+
+# model -> image field that gets responsive variants
+IMAGE_FIELDS = {
+    ProductImage: 'image',
+    Category: 'image',
+    Banner: 'image',
+    UserProfile: 'profile_picture',
+}
+
+
+def generate_image_derivatives(sender, instance, raw=False, **kwargs):
+    """Resize newly uploaded images in the background (see core.images)."""
+    if raw:
+        return
+    queue_derivatives(getattr(instance, IMAGE_FIELDS[sender]))
+
+
+for model in IMAGE_FIELDS:
+    post_save.connect(
+        generate_image_derivatives, sender=model, dispatch_uid=f'image_derivatives_{model.__name__}'
+    )
+
+
+def banner_changed(sender, instance, raw=False, **kwargs):
+    """Banners are part of the cached home page (see core.homepage)."""
+    if raw:
+        return
+    transaction.on_commit(bump_page_generation)
+
+
+post_save.connect(banner_changed, sender=Banner, dispatch_uid='banner_changed_save')
+post_delete.connect(banner_changed, sender=Banner, dispatch_uid='banner_changed_delete')
@@ -1,12 +1,12 @@
 from django import template
-from products.models import Category
+from products.navigation import active_categories
 
 register = template.Library()
 
 @register.simple_tag
 def get_categories():
-    """Get all active categories for navigation"""
-    return Category.objects.filter(is_active=True)[:6]
+    """Get all active categories for navigation (cached, see products.navigation)"""
+    return active_categories()[:6]
 
 @register.inclusion_tag('core/breadcrumbs.html')
 def breadcrumbs(current_page, category=None):
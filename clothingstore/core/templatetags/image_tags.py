@@ -0,0 +1,14 @@
+from django import template
+
+from core import images
+
+register = template.Library()
+
+@register.simple_tag
+def srcset(image, ext='webp'):
+    """
+    Responsive ``srcset`` for an uploaded image, e.g.
+    {% srcset product.primary_image_file 'webp' as webp_srcset %}
+    Empty until the resized variants have been generated.
+    """
+    return images.srcset(image, ext)
@@ -1,3 +1,101 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import shutil
+import tempfile
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from core.models import Banner
+from products.exports import ProductExport
+from products.models import ProductImage
+from products.testing import make_product
+
+from . import images
+from .homepage import get_home_data
+
+
+def png(name):
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new('RGB', (300, 200), (200, 40, 40)).save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+class DerivativesReadyTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.signals = []
+        images.derivatives_ready.connect(self.received)
+        self.addCleanup(images.derivatives_ready.disconnect, self.received)
+
+    def received(self, sender, names, **kwargs):
+        self.signals.append(sorted(names))
+
+    def test_sync_run_sends_one_signal(self):
+        with override_settings(MEDIA_ROOT=self.media_root):
+            product = make_product('shirt')
+            names = sorted(
+                ProductImage.objects.create(product=product, image=png(f'{n}.png')).image.name for n in 'ab'
+            )
+            call_command('generate_image_derivatives', '--sync', stdout=io.StringIO())
+            self.assertEqual(self.signals, [names])
+            self.assertIn('200w', images.srcset(names[0]))
+
+    def test_pool_results_are_sent_together(self):
+        images._ready('products/a.png')
+        images._ready('products/b.png')
+        images.send_ready()
+        images.send_ready()
+        self.assertEqual(self.signals, [['products/a.png', 'products/b.png']])
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.product = make_product('shirt')
+
+    def export(self, fmt):
+        return b''.join(ProductExport().stream(fmt)).decode()
+
+    def test_csv_and_jsonl_write_the_same_timestamps(self):
+        row = next(csv.DictReader(io.StringIO(self.export('csv'))))
+        record = json.loads(self.export('jsonl'))
+        for name in ('created_at', 'updated_at'):
+            self.assertEqual(row[name], record[name])
+            self.assertEqual(row[name], getattr(self.product, name).isoformat())
+        self.assertEqual(row['discount_price'], '')
+        self.assertIsNone(record['discount_price'])
+
+
+class HomeDataTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.featured = make_product('featured', is_featured=True)
+            make_product('plain')
+
+    def test_second_read_comes_from_the_cache(self):
+        data = get_home_data()
+        self.assertEqual([product.slug for product in data['featured_products']], ['featured'])
+        with self.assertNumQueries(0):
+            get_home_data()
+
+    def test_product_changes_show_up_on_the_next_read(self):
+        get_home_data()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.featured.is_featured = False
+            self.featured.save()
+        self.assertEqual(get_home_data()['featured_products'], [])
+
+    def test_banner_changes_show_up_on_the_next_read(self):
+        banner = Banner.objects.create(title='Summer', description='-', image='banners/summer.jpg')
+        self.assertEqual([banner.title for banner in get_home_data()['banners']], ['Summer'])
+        with self.captureOnCommitCallbacks(execute=True):
+            banner.delete()
+        self.assertEqual(get_home_data()['banners'], [])
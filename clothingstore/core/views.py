@@ -1,15 +1,15 @@
 from django.shortcuts import render
-from products.models import Product, Category
-from .models import Banner
+from products.caching import attach_card_versions, cache_anonymous_page
+from products.navigation import active_categories
+from .homepage import get_home_data
 
+@cache_anonymous_page
 def home(request):
-    featured_products = Product.objects.filter(is_featured=True, is_active=True)[:8]
-    categories = Category.objects.filter(is_active=True)[:6]
-    active_banners = Banner.objects.filter(is_active=True).order_by('order', '-created_at')
+    data = get_home_data()
     
     context = {
-        'featured_products': featured_products,
-        'categories': categories,
-        'banners': active_banners,
+        'featured_products': attach_card_versions(data['featured_products']),
+        'categories': active_categories()[:6],
+        'banners': data['banners'],
     }
-    return render(request, 'core/home.html', context)
\ No newline at end of file
+    return render(request, 'core/home.html', context)
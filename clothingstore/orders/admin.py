@@ -1,12 +1,20 @@
  # orders/admin.py
 from django.contrib import admin
-from .models import Order, OrderItem
+from . import inventory
+from .models import Order, OrderItem, StockReservation
 
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
     readonly_fields = ['product', 'quantity', 'price', 'size']
     extra = 0
 
+class StockReservationInline(admin.TabularInline):
+    model = StockReservation
+    fields = ['product', 'size', 'quantity', 'status', 'expires_at']
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     list_display = ['order_number', 'user', 'status', 'total_amount', 'payment_status', 'created_at']
@@ -14,7 +22,7 @@ class OrderAdmin(admin.ModelAdmin):
     search_fields = ['order_number', 'user__username', 'shipping_email']
     readonly_fields = ['order_number', 'created_at', 'updated_at', 'stripe_payment_intent_id']
     list_editable = ['status']  # Allow editing status directly from list view
-    inlines = [OrderItemInline]
+    inlines = [OrderItemInline, StockReservationInline]
     
     fieldsets = (
         ('Order Information', {
@@ -51,6 +59,11 @@ class OrderAdmin(admin.ModelAdmin):
     mark_as_delivered.short_description = "Mark selected orders as delivered"
     
     def mark_as_cancelled(self, request, queryset):
+        # Read the orders first: once updated they may no longer match a
+        # filtered changelist (e.g. status=pending)
+        orders = list(queryset)
         queryset.update(status='cancelled')
-        self.message_user(request, f'{queryset.count()} orders marked as cancelled.')
+        for order in orders:
+            inventory.release(order, include_committed=True)
+        self.message_user(request, f'{len(orders)} orders marked as cancelled.')
     mark_as_cancelled.short_description = "Mark selected orders as cancelled"
\ No newline at end of file
@@ -0,0 +1,57 @@
+# orders/exports.py
+from django.db.models import Prefetch
+
+from core.exports import Export
+
+from .models import Order, OrderItem
+
+ORDER_FIELDS = (
+    'order_number', 'created_at', 'status', 'payment_status', 'total_amount', 'tracking_number',
+    'shipping_name', 'shipping_email', 'shipping_phone', 'shipping_address', 'shipping_city',
+    'shipping_state', 'shipping_zip_code', 'shipping_country',
+)
+ITEM_FIELDS = ('product_slug', 'product_name', 'size', 'color', 'quantity', 'price', 'line_total')
+
+
+class OrderExport(Export):
+    """Orders with their items: one CSV row per item, one JSON record per order."""
+    name = 'orders'
+    header = ('username',) + ORDER_FIELDS + ITEM_FIELDS
+
+    def get_queryset(self):
+        return (
+            Order.objects.select_related('user')
+            .prefetch_related(
+                Prefetch(
+                    'items',
+                    queryset=OrderItem.objects.select_related('product').only(
+                        'order_id', 'quantity', 'price', 'size', 'color', 'product__slug', 'product__name'
+                    ).order_by('id'),
+                )
+            )
+            .order_by('created_at', 'id')
+        )
+
+    def _item(self, item):
+        return {
+            'product_slug': item.product.slug,
+            'product_name': item.product.name,
+            'size': item.size,
+            'color': item.color,
+            'quantity': item.quantity,
+            'price': item.price,
+            'line_total': item.get_total_price(),
+        }
+
+    def record(self, order):
+        record = {'username': order.user.username}
+        record.update((name, getattr(order, name)) for name in ORDER_FIELDS)
+        record['items'] = [self._item(item) for item in order.items.all()]
+        return record
+
+    def csv_rows(self, order):
+        base = [order.user.username, *(getattr(order, name) for name in ORDER_FIELDS)]
+        items = order.items.all()
+        if not items:
+            return [base + [''] * len(ITEM_FIELDS)]
+        return [base + [self._item(item)[name] for name in ITEM_FIELDS] for item in items]
@@ -0,0 +1,244 @@
+# orders/inventory.py
+"""
+Stock reservations for checkout.
+
+Checkout takes the ordered quantities off ``ProductSize.quantity`` (or
+``Product.stock`` for products without sizes) with one conditional UPDATE
+per line::
+
+    UPDATE ... SET quantity = quantity - n WHERE id = ... AND quantity >= n
+
+The database applies each one atomically, so concurrent checkouts can never
+take more than is there, and a checkout only ever waits on the rows it
+buys, never on a lock for the whole product or table. Rows are updated in
+a fixed order so two checkouts cannot deadlock on each other.
+
+What was taken is recorded as a held ``StockReservation`` that expires
+after ``STOCK_RESERVATION_TTL`` seconds. A verified payment commits the
+reservations; a failed payment, a cancelled order or expiry releases them
+and puts the stock back. Every reservation leaves the held state exactly
+once (the state change is itself a conditional UPDATE), so a late payment
+and the sweeper cannot both act on it.
+"""
+import logging
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from products.caching import catalog_changed, stock_changed
+from products.facets import products_changed
+from products import stock
+from products.models import Product, ProductSize
+
+from .models import Order, StockReservation
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RESERVATION_TTL = 15 * 60
+SWEEP_BATCH_SIZE = 500
+
+
+class InsufficientStock(Exception):
+    def __init__(self, product, size=''):
+        self.product = product
+        self.size = size
+        label = f'{product.name} ({size})' if size else product.name
+        super().__init__(f'{label} is out of stock')
+
+
+def reservation_ttl():
+    return timedelta(seconds=getattr(settings, 'STOCK_RESERVATION_TTL', DEFAULT_RESERVATION_TTL))
+
+
+def _take(product_id, product_size_id, quantity):
+    """
+    Take ``quantity`` off one stock row if that much is left. Returns True on
+    success. A size row's product total is left to the caller (see
+    ``_size_deltas``), so products are always locked after size rows.
+    """
+    # Plain QuerySet.update: ProductQuerySet.update would drop every cached
+    # page on each checkout (_stock_changed only does that when a product
+    # sells out or comes back), and ProductSizeQuerySet.update would recount
+    # the product total where a delta will do
+    if product_size_id is not None:
+        rows = ProductSize.objects.filter(pk=product_size_id, quantity__gte=quantity)
+        return models.QuerySet.update(rows, quantity=F('quantity') - quantity) == 1
+    rows = Product.objects.filter(pk=product_id, stock__gte=quantity)
+    if models.QuerySet.update(rows, stock=F('stock') - quantity) != 1:
+        return False
+    stock_changed()
+    return True
+
+
+def _give_back(product_id, product_size_id, quantity):
+    if product_size_id is not None:
+        models.QuerySet.update(
+            ProductSize.objects.filter(pk=product_size_id), quantity=F('quantity') + quantity
+        )
+        stock.add_stock({product_id: quantity})
+    else:
+        models.QuerySet.update(Product.objects.filter(pk=product_id), stock=F('stock') + quantity)
+        stock_changed()
+
+
+def _size_deltas(reservations, sign):
+    """Product.stock deltas for the per-size reservations among ``reservations``."""
+    deltas = {}
+    for reservation in reservations:
+        if reservation.product_size_id is not None:
+            deltas[reservation.product_id] = deltas.get(reservation.product_id, 0) + sign * reservation.quantity
+    return deltas
+
+
+def _stock_changed(reservations, sold_out):
+    """
+    Refresh the facet index and cached cards of products whose stock crossed
+    zero: ``sold_out`` after taking stock, otherwise after giving it back.
+    """
+    size_ids = [r.product_size_id for r in reservations if r.product_size_id is not None]
+    product_ids = [r.product_id for r in reservations if r.product_size_id is None]
+    if sold_out:
+        crossed = set(ProductSize.objects.filter(pk__in=size_ids, quantity=0).values_list('product_id', flat=True))
+        crossed.update(Product.objects.filter(pk__in=product_ids, stock=0).values_list('id', flat=True))
+    else:
+        # Rows now holding exactly what was given back were empty before
+        crossed = set()
+        for reservation in reservations:
+            if reservation.product_size_id is not None:
+                crossed.update(ProductSize.objects.filter(
+                    pk=reservation.product_size_id, quantity=reservation.quantity
+                ).values_list('product_id', flat=True))
+            elif Product.objects.filter(pk=reservation.product_id, stock=reservation.quantity).exists():
+                crossed.add(reservation.product_id)
+    if crossed:
+        products_changed(crossed)
+        catalog_changed(crossed)
+
+
+def reserve(order, lines, ttl=None):
+    """
+    Take stock for ``lines`` — ``(product, size code, quantity)`` tuples —
+    and hold it for ``order``. Raises InsufficientStock, leaving stock as it
+    was, if any line cannot be filled.
+    """
+    wanted = OrderedDict()
+    products = {}
+    for product, size, quantity in lines:
+        products[product.pk] = product
+        key = (product.pk, size or '')
+        wanted[key] = wanted.get(key, 0) + quantity
+
+    size_rows = {
+        (product_id, name): pk
+        for pk, product_id, name in ProductSize.objects.filter(
+            product_id__in=products, size__name__in={size for _, size in wanted if size}
+        ).values_list('id', 'product_id', 'size__name')
+    }
+    expires_at = timezone.now() + (ttl or reservation_ttl())
+    reservations = []
+    for (product_id, size), quantity in wanted.items():
+        # Products without a row for the size are counted as a whole; only
+        # per-size reservations carry the size
+        product_size_id = size_rows.get((product_id, size))
+        reservations.append(StockReservation(
+            order=order,
+            product_id=product_id,
+            product_size_id=product_size_id,
+            size=size if product_size_id is not None else '',
+            quantity=quantity,
+            expires_at=expires_at,
+        ))
+    # Same lock order in every checkout: size rows, then products without
+    # sizes, then the totals of products with sizes, each by id
+    reservations.sort(key=lambda r: (r.product_size_id is None, r.product_size_id or r.product_id))
+
+    with transaction.atomic():
+        for reservation in reservations:
+            if not _take(reservation.product_id, reservation.product_size_id, reservation.quantity):
+                raise InsufficientStock(products[reservation.product_id], reservation.size)
+        stock.add_stock(_size_deltas(reservations, -1))
+        StockReservation.objects.bulk_create(reservations)
+        _stock_changed(reservations, sold_out=True)
+    return reservations
+
+
+def _release(reservation, from_status=StockReservation.HELD):
+    """Put one reservation's stock back, unless something else already settled it."""
+    with transaction.atomic():
+        claimed = StockReservation.objects.filter(pk=reservation.pk, status=from_status).update(
+            status=StockReservation.RELEASED, updated_at=timezone.now()
+        )
+        if not claimed:
+            return False
+        # A per-size reservation whose size row was deleted has nothing to go back to
+        if reservation.product_size_id is not None or not reservation.size:
+            _give_back(reservation.product_id, reservation.product_size_id, reservation.quantity)
+        _stock_changed([reservation], sold_out=False)
+    return True
+
+
+def release(order, include_committed=False):
+    """
+    Release an order's held reservations (and, for a cancelled paid order,
+    its committed ones). Returns how many were released.
+    """
+    statuses = [StockReservation.HELD]
+    if include_committed:
+        statuses.append(StockReservation.COMMITTED)
+    released = 0
+    for reservation in order.reservations.filter(status__in=statuses):
+        released += _release(reservation, reservation.status)
+    return released
+
+
+def commit(order):
+    """
+    Make an order's reservations permanent once it is paid. Stock whose hold
+    expired before the payment came in is taken again if it is still there.
+    Returns False if some of it is gone, so the order needs a person.
+    """
+    with transaction.atomic():
+        StockReservation.objects.filter(order=order, status=StockReservation.HELD).update(
+            status=StockReservation.COMMITTED, updated_at=timezone.now()
+        )
+        expired = list(order.reservations.filter(status=StockReservation.RELEASED))
+        complete = True
+        for reservation in expired:
+            with transaction.atomic():
+                claimed = StockReservation.objects.filter(
+                    pk=reservation.pk, status=StockReservation.RELEASED
+                ).update(status=StockReservation.COMMITTED, updated_at=timezone.now())
+                if not claimed:
+                    continue
+                if _take(reservation.product_id, reservation.product_size_id, reservation.quantity):
+                    stock.add_stock(_size_deltas([reservation], -1))
+                else:
+                    transaction.set_rollback(True)
+                    complete = False
+        if expired:
+            _stock_changed(expired, sold_out=True)
+    if not complete:
+        logger.error('Order %s was paid after its stock reservation expired and the stock is gone', order.order_number)
+    return complete
+
+
+def release_expired(now=None, limit=SWEEP_BATCH_SIZE):
+    """
+    Release held reservations past their expiry and cancel their unpaid
+    orders. Returns the number of reservations released.
+    """
+    now = now or timezone.now()
+    expired = list(
+        StockReservation.objects.filter(status=StockReservation.HELD, expires_at__lte=now)
+        .order_by('expires_at')[:limit]
+    )
+    released = [reservation for reservation in expired if _release(reservation)]
+    if released:
+        Order.objects.filter(
+            pk__in={reservation.order_id for reservation in released}, payment_status='pending'
+        ).update(status='cancelled', payment_status='expired', updated_at=now)
+    return len(released)
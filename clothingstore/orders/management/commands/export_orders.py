@@ -0,0 +1,7 @@
+from core.exports import ExportCommand
+from orders.exports import OrderExport
+
+
+class Command(ExportCommand):
+    help = 'Streams orders and their items to a CSV or JSONL file'
+    export_class = OrderExport
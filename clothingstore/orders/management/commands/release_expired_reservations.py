@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from orders import inventory
+
+
+class Command(BaseCommand):
+    help = 'Returns the stock of unpaid checkouts whose reservation has expired'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--every',
+            type=int,
+            default=0,
+            metavar='SECONDS',
+            help='Keep running and sweep every SECONDS seconds',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            released = inventory.release_expired()
+            while released == inventory.SWEEP_BATCH_SIZE:
+                # A full batch; there may be more waiting
+                released = inventory.release_expired()
+            if released or options['verbosity'] > 1:
+                self.stdout.write(self.style.SUCCESS(f'Released {released} expired reservations.'))
+            if not options['every']:
+                break
+            time.sleep(options['every'])
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.7 on 2026-10-17 04:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0013_search_queries'),
+        ('orders', '0004_orderitem_color'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='razorpay_order_id',
+            field=models.CharField(blank=True, db_index=True, max_length=100),
+        ),
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('size', models.CharField(blank=True, max_length=10)),
+                ('quantity', models.PositiveIntegerField()),
+                ('status', models.CharField(choices=[('held', 'Held'), ('committed', 'Committed'), ('released', 'Released')], default='held', max_length=10)),
+                ('expires_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='orders.order')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_reservations', to='products.product')),
+                ('product_size', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reservations', to='products.productsize')),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('status', 'held')), fields=['expires_at'], name='reservation_held_expiry_idx')],
+            },
+        ),
+    ]
@@ -30,6 +30,7 @@ class Order(models.Model):
     
     # Payment Information
     stripe_payment_intent_id = models.CharField(max_length=200, blank=True)
+    razorpay_order_id = models.CharField(max_length=100, blank=True, db_index=True)
     payment_status = models.CharField(max_length=20, default='pending')
     
     created_at = models.DateTimeField(auto_now_add=True)
@@ -56,6 +57,47 @@ class OrderItem(models.Model):
         return self.quantity * self.price
 
 
+class StockReservation(models.Model):
+    """
+    Stock set aside for an order between checkout and payment. The quantity
+    has already been taken off ProductSize.quantity (or Product.stock for
+    products without sizes); see orders.inventory.
+    """
+    HELD = 'held'
+    COMMITTED = 'committed'
+    RELEASED = 'released'
+    STATUS_CHOICES = [
+        (HELD, 'Held'),
+        (COMMITTED, 'Committed'),
+        (RELEASED, 'Released'),
+    ]
+    
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='reservations')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_reservations')
+    product_size = models.ForeignKey(
+        'products.ProductSize', on_delete=models.SET_NULL, null=True, blank=True, related_name='reservations'
+    )
+    size = models.CharField(max_length=10, blank=True)
+    quantity = models.PositiveIntegerField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=HELD)
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        indexes = [
+            # The sweeper looks for held reservations past their expiry
+            models.Index(
+                fields=['expires_at'],
+                condition=models.Q(status='held'),
+                name='reservation_held_expiry_idx',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} {self.size} for {self.order_id} ({self.status})"
+
+
 
 
 class Coupon(models.Model):
@@ -1,3 +1,71 @@
-from django.test import TestCase
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.admin.sites import AdminSite
+from django.contrib.auth.models import User
+from django.test import RequestFactory, TestCase
+
+from products.models import ProductSize
+from products.testing import make_product, size
+
+from . import inventory
+from .admin import OrderAdmin
+from .models import Order, StockReservation
+
+
+def make_order(number):
+    user = User.objects.get_or_create(username='customer')[0]
+    return Order.objects.create(
+        user=user, order_number=number, total_amount=Decimal('100.00'), shipping_name='Test',
+        shipping_email='test@example.com', shipping_phone='0', shipping_address='-', shipping_city='-',
+        shipping_state='-', shipping_zip_code='0', shipping_country='-',
+    )
+
+
+class InventoryTests(TestCase):
+    def setUp(self):
+        self.product = make_product('shirt')
+        self.size = size('M')
+        self.product_size = ProductSize.objects.create(product=self.product, size=self.size, quantity=5)
+        self.plain = make_product('cap', '50.00', stock=2)
+
+    def stock(self):
+        self.product.refresh_from_db()
+        self.product_size.refresh_from_db()
+        return self.product_size.quantity, self.product.stock
+
+    def test_reserve_takes_stock_from_size_and_total(self):
+        inventory.reserve(make_order('A'), [(self.product, 'M', 2)])
+        self.assertEqual(self.stock(), (3, 3))
+
+    def test_reserve_without_enough_stock_takes_nothing(self):
+        with self.assertRaises(inventory.InsufficientStock):
+            inventory.reserve(make_order('A'), [(self.product, 'M', 2), (self.plain, '', 3)])
+        self.assertEqual(self.stock(), (5, 5))
+        self.plain.refresh_from_db()
+        self.assertEqual(self.plain.stock, 2)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_release_gives_stock_back_once(self):
+        order = make_order('A')
+        inventory.reserve(order, [(self.product, 'M', 2)])
+        self.assertEqual(inventory.release(order), 1)
+        self.assertEqual(inventory.release(order), 0)
+        self.assertEqual(self.stock(), (5, 5))
+
+    def test_commit_keeps_stock_taken(self):
+        order = make_order('A')
+        inventory.reserve(order, [(self.product, 'M', 2)])
+        self.assertTrue(inventory.commit(order))
+        self.assertEqual(inventory.release(order), 0)
+        self.assertEqual(self.stock(), (3, 3))
+
+    def test_admin_cancel_releases_orders_of_a_filtered_changelist(self):
+        order = make_order('A')
+        inventory.reserve(order, [(self.product, 'M', 2)])
+        admin = OrderAdmin(Order, AdminSite())
+        with mock.patch.object(admin, 'message_user') as message_user:
+            admin.mark_as_cancelled(RequestFactory().post('/'), Order.objects.filter(status='pending'))
+        self.assertEqual(message_user.call_args[0][1], '1 orders marked as cancelled.')
+        self.assertEqual(order.reservations.get().status, StockReservation.RELEASED)
+        self.assertEqual(self.stock(), (5, 5))
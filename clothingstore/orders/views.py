@@ -8,7 +8,11 @@ from django.http import JsonResponse, HttpResponseServerError
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 from django.conf import settings
+from django.db import transaction
 from cart.models import Cart
+from cart.pricing import drop_invalid_coupon
+from cart.storage import cart_storage, sync_cart
+from . import inventory
 from .models import Order, OrderItem
 
 import razorpay
@@ -30,43 +34,57 @@ def checkout(request):
     """
     Handle the checkout process and create a Razorpay order
     """
-    cart = get_object_or_404(Cart, user=request.user)
+    sync_cart(request.user)
+    cart = get_object_or_404(Cart.objects.select_related('applied_coupon__coupon'), user=request.user)
+    # Lines with their products and the totals, loaded once for the order
+    # and for the summary template alike
+    pricing = cart.pricing
     
-    if not cart.items.exists():
+    if not pricing.lines:
         messages.error(request, 'Your cart is empty.')
         return redirect('cart:detail')
     
     if request.method == 'POST':
         try:
-            # Create order
-            order = Order.objects.create(
-                user=request.user,
-                order_number=str(uuid.uuid4())[:8].upper(),
-                total_amount=cart.total_price,
-                shipping_name=request.POST.get('shipping_name'),
-                shipping_email=request.POST.get('shipping_email'),
-                shipping_phone=request.POST.get('shipping_phone'),
-                shipping_address=request.POST.get('shipping_address'),
-                shipping_city=request.POST.get('shipping_city'),
-                shipping_state=request.POST.get('shipping_state'),
-                shipping_zip_code=request.POST.get('shipping_zip_code'),
-                shipping_country=request.POST.get('shipping_country', 'IN'),
-                payment_status='pending',
-                status='pending'
-            )
-            
-            # Create order items
-            order_items = []
-            for cart_item in cart.items.all():
-                order_item = OrderItem.objects.create(
-                    order=order,
-                    product=cart_item.product,
-                    quantity=cart_item.quantity,
-                    price=cart_item.product.get_price,
-                    size=cart_item.size,
-                    color=getattr(cart_item, 'color', ''),
+            cart_items = pricing.lines
+            with transaction.atomic():
+                # The totals above already leave it out
+                drop_invalid_coupon(cart)
+                # Create order
+                order = Order.objects.create(
+                    user=request.user,
+                    order_number=str(uuid.uuid4())[:8].upper(),
+                    total_amount=pricing.total,
+                    shipping_name=request.POST.get('shipping_name'),
+                    shipping_email=request.POST.get('shipping_email'),
+                    shipping_phone=request.POST.get('shipping_phone'),
+                    shipping_address=request.POST.get('shipping_address'),
+                    shipping_city=request.POST.get('shipping_city'),
+                    shipping_state=request.POST.get('shipping_state'),
+                    shipping_zip_code=request.POST.get('shipping_zip_code'),
+                    shipping_country=request.POST.get('shipping_country', 'IN'),
+                    payment_status='pending',
+                    status='pending'
+                )
+                
+                # Create order items
+                order_items = []
+                for cart_item in cart_items:
+                    order_item = OrderItem.objects.create(
+                        order=order,
+                        product=cart_item.product,
+                        quantity=cart_item.quantity,
+                        price=cart_item.product.get_price,
+                        size=cart_item.size,
+                        color=getattr(cart_item, 'color', ''),
+                    )
+                    order_items.append(order_item)
+                
+                # Hold the stock until the payment is verified or the hold expires
+                inventory.reserve(
+                    order,
+                    [(item.product, item.size, item.quantity) for item in cart_items],
                 )
-                order_items.append(order_item)
             
             # Prepare Razorpay order data
             amount_paise = int(order.total_amount * 100)  # Convert to paise
@@ -83,7 +101,7 @@ def checkout(request):
 
                 # Update order with Razorpay details
                 order.razorpay_order_id = razorpay_order['id']
-                order.save()
+                order.save(update_fields=['razorpay_order_id', 'updated_at'])
 
                 context = {
                     'order': order,
@@ -100,9 +118,16 @@ def checkout(request):
 
             except Exception as e:
                 logger.error(f"Error creating Razorpay order: {str(e)}")
+                inventory.release(order)
+                order.status = 'cancelled'
+                order.payment_status = 'failed'
+                order.save(update_fields=['status', 'payment_status', 'updated_at'])
                 messages.error(request, 'Error setting up payment. Please try again.')
                 return redirect('cart:detail')
                 
+        except inventory.InsufficientStock as e:
+            messages.error(request, f'Sorry, {e}. Please update your cart.')
+            return redirect('cart:detail')
         except Exception as e:
             logger.error(f"Error during checkout: {str(e)}")
             messages.error(request, 'An error occurred during checkout. Please try again.')
@@ -177,6 +202,9 @@ def razorpay_verify(request):
             # Verify the payment signature
             client.utility.verify_payment_signature(params_dict)
             
+            # The stock held at checkout now belongs to this order
+            inventory.commit(order)
+            
             # Update order status
             order.payment_status = 'completed'
             order.status = 'processing'
@@ -192,6 +220,7 @@ def razorpay_verify(request):
             logger.info(f'Payment successful for order {order.order_number}')
             
             # Clear the user's cart
+            sync_cart(request.user)
             Cart.objects.filter(user=request.user).delete()
             
             # Return success response with redirect URL
@@ -209,6 +238,7 @@ def razorpay_verify(request):
             order.payment_status = 'failed'
             order.status = 'payment_failed'
             order.save()
+            inventory.release(order)
             
             return JsonResponse({
                 'status': 'error',
@@ -222,6 +252,7 @@ def razorpay_verify(request):
             order.payment_status = 'failed'
             order.status = 'payment_error'
             order.save()
+            inventory.release(order)
             
             return JsonResponse({
                 'status': 'error',
@@ -257,6 +288,7 @@ def order_success(request, order_number):
     
     # In test mode, simulate a successful payment if not already completed
     if settings.DEBUG and not order.payment_status == 'completed':
+        inventory.commit(order)
         order.payment_status = 'completed'
         order.status = 'processing'
         order.save()
@@ -285,6 +317,8 @@ def cancel_order(request, order_number):
     if order.status in ['pending', 'processing']:
         order.status = 'cancelled'
         order.save()
+        # Put the stock back, whether or not the order was paid
+        inventory.release(order, include_committed=True)
         messages.success(request, f'Order #{order.order_number} has been cancelled successfully.')
     else:
         messages.error(request, 'This order cannot be cancelled as it has already been shipped or delivered.')
@@ -295,26 +329,15 @@ def cancel_order(request, order_number):
 @require_POST  
 def reorder(request, order_number):
     """Allow users to reorder items from a previous order"""
-    from cart.models import Cart, CartItem
-    
     order = get_object_or_404(Order, order_number=order_number, user=request.user)
-    cart, created = Cart.objects.get_or_create(user=request.user)
     
-    # Add all order items to cart
-    items_added = 0
-    for order_item in order.items.all():
-        # Check if product is still available
-        if order_item.product.stock > 0:
-            cart_item, created = CartItem.objects.get_or_create(
-                cart=cart,
-                product=order_item.product,
-                size=order_item.size,
-                defaults={'quantity': order_item.quantity}
-            )
-            if not created:
-                cart_item.quantity += order_item.quantity
-                cart_item.save()
-            items_added += 1
+    # Items whose product is still in stock, added to the cart in one upsert
+    lines = [
+        (order_item.product_id, order_item.size, order_item.color, order_item.quantity)
+        for order_item in order.items.select_related('product')
+        if order_item.product.stock > 0
+    ]
+    items_added = cart_storage(request).add_many(lines)
     
     if items_added > 0:
         messages.success(request, f'{items_added} items from order #{order.order_number} have been added to your cart.')
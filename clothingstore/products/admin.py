@@ -6,7 +6,7 @@ from django.utils.safestring import mark_safe
 from django import forms
 from django.db import models
 from django.forms import TextInput
-from .models import Category, Product, ProductImage, Size, ProductSize
+from .models import Category, Color, Product, ProductImage, SearchQuery, Size, ProductSize
 from .forms import ProductAdminForm, CategoryAdminForm
 
 class ProductSizeInline(admin.TabularInline):
@@ -86,6 +86,24 @@ class SizeAdmin(admin.ModelAdmin):
             field.label_from_instance = lambda obj: f"{obj.display_name} ({obj.size_type})"
         return field
 
+@admin.register(Color)
+class ColorAdmin(admin.ModelAdmin):
+    list_display = ('name', 'display_name', 'is_active', 'order', 'product_count')
+    list_filter = ('is_active',)
+    search_fields = ('name', 'display_name')
+    list_editable = ('is_active', 'order')
+    ordering = ('order', 'name')
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            product_count=models.Count('products')
+        )
+    
+    def product_count(self, obj):
+        return obj.product_count
+    product_count.admin_order_field = 'product_count'
+    product_count.short_description = 'Used In'
+
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
     form = CategoryAdminForm
@@ -168,6 +186,15 @@ class ProductAdmin(admin.ModelAdmin):
     list_per_page = 20
     ordering = ['-created_at']
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('category').prefetch_related('productsizes__size')
+    
+    def get_readonly_fields(self, request, obj=None):
+        # Summed from the size quantities once a product has sizes
+        if obj is not None and obj.productsizes.exists():
+            return (*super().get_readonly_fields(request, obj), 'stock')
+        return super().get_readonly_fields(request, obj)
+    
     def available_sizes_list(self, obj):
         return ", ".join([f"{ps.size.name} ({ps.quantity})" for ps in obj.productsizes.all()])
     available_sizes_list.short_description = 'Available Sizes'
@@ -250,4 +277,12 @@ class ProductImageAdmin(admin.ModelAdmin):
                 obj.image.url
             )
         return "No image"
-    image_preview.short_description = "Preview"
\ No newline at end of file
+    image_preview.short_description = "Preview"
+
+
+@admin.register(SearchQuery)
+class SearchQueryAdmin(admin.ModelAdmin):
+    list_display = ('query', 'count', 'last_searched_at')
+    search_fields = ('query',)
+    ordering = ('-count',)
+    list_per_page = 50
@@ -0,0 +1,378 @@
+# products/autocomplete.py
+"""
+Search-as-you-type suggestions.
+
+Active product names, category names and popular search strings are kept in
+a sorted array of normalised keys per worker process. Every word of a name
+starts a key, so "shi" finds "Cotton Shirt" as well as "Shirt Dress", and a
+prefix lookup is a bisect plus a short scan; the ranked result for a prefix
+is memoised until the index changes. Suggestions are ranked by units sold
+(products, categories) or by how often the query was searched.
+
+Each process builds its index in a background thread, started by the first
+lookup, which also watches a shared generation number every few seconds and
+rebuilds when another process bumped it. Lookups never touch the database or
+the cache: they read whichever index was last swapped in, and return nothing
+until the first build is done. Product and category changes made in this
+process are applied in place and bump the generation, the same scheme as
+products/facets.py. Sales are added to the local scores as orders come in;
+the thread also rebuilds periodically to pick up sales recorded elsewhere.
+
+Searches are counted in the shared cache, one counter per query string, and
+the flush_search_counts command adds them to SearchQuery periodically, so a
+search costs a cache increment rather than a database write. Counting
+happens before the anonymous page cache is consulted, so cached result
+pages count too.
+"""
+import hashlib
+import heapq
+import logging
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+from functools import wraps
+
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.db.models import F, Sum
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import urlencode
+
+from .caching import bump_generation, current_generation
+
+AUTOCOMPLETE_GENERATION_KEY = 'products:autocomplete:generation'
+# Searches not yet written to SearchQuery: a counter per query, and a
+# numbered slot per query string first counted since the last flush
+SEARCH_COUNT_KEY = 'products:search:count:{}'
+SEARCH_SLOTS_KEY = 'products:search:slots'
+SEARCH_SLOT_KEY = 'products:search:slot:{}'
+SEARCH_FLUSHED_KEY = 'products:search:flushed'
+
+# Product fields an entry is built from; saves touching only others are ignored
+PRODUCT_FIELDS = {'name', 'slug', 'is_active', 'category', 'category_id'}
+
+MAX_SUGGESTIONS = 10
+# Searches needed before a query string is suggested to other shoppers
+MIN_QUERY_COUNT = 3
+MAX_POPULAR_QUERIES = 500
+MAX_QUERY_LENGTH = 100
+# Picks up sales and searches recorded by other processes
+REBUILD_INTERVAL = 60 * 10
+# How often the background thread compares the shared generation
+CHECK_INTERVAL = 5
+MEMO_SIZE = 2000
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+logger = logging.getLogger(__name__)
+
+
+def normalize(text):
+    """Lowercase, strip accents and punctuation: ``'Crème  T-Shirt'`` -> ``'creme t shirt'``."""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(_WORD_RE.findall(text.lower()))
+
+
+def _keys(label):
+    words = normalize(label).split()
+    return [' '.join(words[i:]) for i in range(len(words))]
+
+
+class AutocompleteIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.generation = None
+        self.built_at = 0.0
+        # entry id -> (type, label, url); ids are ('product', pk),
+        # ('category', pk) and ('query', text)
+        self.entries = {}
+        self.scores = {}
+        # Sorted (key, entry id) pairs
+        self.keys = []
+        self.product_categories = {}
+        self._memo = {}
+        self._refresher = None
+        self._wake = threading.Event()
+
+    def _load_products(self, product_ids=None):
+        from orders.models import OrderItem
+        from .models import Product
+
+        products = Product.objects.filter(is_active=True, category__is_active=True)
+        sales = OrderItem.objects.exclude(order__status='cancelled')
+        if product_ids is not None:
+            products = products.filter(id__in=product_ids)
+            sales = sales.filter(product_id__in=product_ids)
+        units = dict(
+            sales.values('product_id').annotate(units=Sum('quantity')).values_list('product_id', 'units')
+        )
+        return [
+            (product_id, name, reverse('products:detail', args=[slug]), category_id, units.get(product_id, 0))
+            for product_id, name, slug, category_id in products.values_list('id', 'name', 'slug', 'category_id')
+        ]
+
+    def _load_categories(self):
+        from .navigation import active_categories
+
+        return [(category.pk, category.name, category.get_absolute_url()) for category in active_categories()]
+
+    def _add(self, entry_id, kind, label, url, score):
+        self.entries[entry_id] = (kind, label, url)
+        self.scores[entry_id] = score
+        for key in _keys(label):
+            insort(self.keys, (key, entry_id))
+
+    def _remove(self, entry_id):
+        entry = self.entries.pop(entry_id, None)
+        if entry is None:
+            return
+        self.scores.pop(entry_id, None)
+        for key in _keys(entry[1]):
+            index = bisect_left(self.keys, (key, entry_id))
+            if index < len(self.keys) and self.keys[index] == (key, entry_id):
+                del self.keys[index]
+
+    def rebuild(self):
+        """Load a fresh index and swap it in; lookups use the old one until then."""
+        from .models import SearchQuery
+
+        generation = current_generation(AUTOCOMPLETE_GENERATION_KEY)
+        entries, scores, keys = {}, {}, []
+        product_categories = {}
+        category_units = {}
+        for product_id, name, url, category_id, units in self._load_products():
+            entry_id = ('product', product_id)
+            entries[entry_id] = ('product', name, url)
+            scores[entry_id] = units
+            keys.extend((key, entry_id) for key in _keys(name))
+            product_categories[product_id] = category_id
+            category_units[category_id] = category_units.get(category_id, 0) + units
+        for category_id, name, url in self._load_categories():
+            entry_id = ('category', category_id)
+            entries[entry_id] = ('category', name, url)
+            scores[entry_id] = category_units.get(category_id, 0)
+            keys.extend((key, entry_id) for key in _keys(name))
+        list_url = reverse('products:list')
+        popular = SearchQuery.objects.filter(count__gte=MIN_QUERY_COUNT).order_by('-count')
+        for query, count in popular.values_list('query', 'count')[:MAX_POPULAR_QUERIES]:
+            entry_id = ('query', query)
+            entries[entry_id] = ('query', query, f"{list_url}?{urlencode({'search': query})}")
+            scores[entry_id] = count
+            keys.append((query, entry_id))
+        keys.sort()
+
+        with self._lock:
+            # A change patched in meanwhile left a newer generation behind,
+            # so the next check rebuilds again
+            self.entries, self.scores, self.keys = entries, scores, keys
+            self.product_categories = product_categories
+            self._memo = {}
+            self.generation = generation
+            self.built_at = time.monotonic()
+
+    def refresh(self):
+        """Rebuild if never built, changed elsewhere or due to pick up sales."""
+        if (
+            self.generation is None
+            or time.monotonic() - self.built_at > REBUILD_INTERVAL
+            or self.generation != current_generation(AUTOCOMPLETE_GENERATION_KEY)
+        ):
+            self.rebuild()
+
+    def start(self):
+        """Start the background thread that builds the index and keeps it current."""
+        with self._lock:
+            if self._refresher is None:
+                self._refresher = threading.Thread(target=self._refresh_loop, name='autocomplete-refresh', daemon=True)
+                self._refresher.start()
+
+    def _refresh_loop(self):
+        while True:
+            self._wake.clear()
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception('Refreshing the autocomplete index failed')
+            finally:
+                # This thread's own connection; not held open between checks
+                connections.close_all()
+            self._wake.wait(CHECK_INTERVAL)
+
+    def _stale(self):
+        self.generation = None
+        self._wake.set()
+
+    def _changed(self):
+        """Bump the shared generation; False if this copy must rebuild instead of patching."""
+        seen = self.generation
+        new = bump_generation(AUTOCOMPLETE_GENERATION_KEY)
+        if seen is None or new != seen + 1:
+            # Never built, or another process changed things as well
+            self._stale()
+            return False
+        self.generation = new
+        self._memo = {}
+        return True
+
+    def refresh_products(self, product_ids):
+        """Re-read the given products and replace their entries."""
+        product_ids = list(product_ids)
+        rows = self._load_products(product_ids)
+        with self._lock:
+            if not self._changed():
+                return
+            for product_id in product_ids:
+                self._remove(('product', product_id))
+                self.product_categories.pop(product_id, None)
+            for product_id, name, url, category_id, units in rows:
+                self._add(('product', product_id), 'product', name, url, units)
+                self.product_categories[product_id] = category_id
+
+    def invalidate(self):
+        """Make every process, this one included, rebuild in the background."""
+        with self._lock:
+            bump_generation(AUTOCOMPLETE_GENERATION_KEY)
+            self._stale()
+
+    def record_sale(self, product_id, quantity):
+        """Add units sold to a product and its category in this process."""
+        with self._lock:
+            entry_id = ('product', product_id)
+            if entry_id not in self.scores:
+                return
+            self.scores[entry_id] += quantity
+            category_id = self.product_categories.get(product_id)
+            if ('category', category_id) in self.scores:
+                self.scores[('category', category_id)] += quantity
+            self._memo = {}
+
+    def _ranked(self, prefix):
+        ranked = self._memo.get(prefix)
+        if ranked is None:
+            keys = self.keys
+            index = bisect_left(keys, (prefix,))
+            matches = set()
+            while index < len(keys) and keys[index][0].startswith(prefix):
+                matches.add(keys[index][1])
+                index += 1
+            ranked = heapq.nsmallest(
+                MAX_SUGGESTIONS, matches,
+                key=lambda entry_id: (-self.scores[entry_id], self.entries[entry_id][1]),
+            )
+            if len(self._memo) >= MEMO_SIZE:
+                self._memo.clear()
+            self._memo[prefix] = ranked
+        return ranked
+
+    def suggest(self, query, limit=MAX_SUGGESTIONS):
+        """Return up to ``limit`` ``{'type', 'label', 'url'}`` dicts, best sellers first."""
+        if self._refresher is None:
+            self.start()
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        with self._lock:
+            ranked = self._ranked(prefix)[:limit]
+            return [
+                dict(zip(('type', 'label', 'url'), self.entries[entry_id]))
+                for entry_id in ranked
+            ]
+
+
+autocomplete_index = AutocompleteIndex()
+
+
+def suggest(query, limit=MAX_SUGGESTIONS):
+    return autocomplete_index.suggest(query, limit)
+
+
+def products_changed(product_ids):
+    product_ids = list(product_ids)
+    transaction.on_commit(lambda: autocomplete_index.refresh_products(product_ids))
+
+
+def autocomplete_invalidated():
+    transaction.on_commit(autocomplete_index.invalidate)
+
+
+def sale_recorded(product_id, quantity):
+    transaction.on_commit(lambda: autocomplete_index.record_sale(product_id, quantity))
+
+
+def _search_count_key(query):
+    return SEARCH_COUNT_KEY.format(hashlib.md5(query.encode()).hexdigest())
+
+
+def _take_slot():
+    # Slots are numbered from 1, so the flush can read them as a range
+    try:
+        return cache.incr(SEARCH_SLOTS_KEY)
+    except ValueError:
+        cache.add(SEARCH_SLOTS_KEY, 0, None)
+        return cache.incr(SEARCH_SLOTS_KEY)
+
+
+def record_search(query):
+    """Count a catalog search in the cache, for ``flush_search_counts``."""
+    query = normalize(query)[:MAX_QUERY_LENGTH]
+    if not query:
+        return
+    key = _search_count_key(query)
+    try:
+        cache.incr(key)
+    except ValueError:
+        if cache.add(key, 1, None):
+            # First count since the last flush: take a slot so the flush finds it
+            cache.set(SEARCH_SLOT_KEY.format(_take_slot()), query, None)
+        else:
+            cache.incr(key)
+
+
+def flush_search_counts():
+    """
+    Add the searches counted in the cache to SearchQuery and return how many
+    query strings were written. A search counted between the read and the
+    delete here is lost, which popularity can afford. Run by the
+    flush_search_counts command, one at a time.
+    """
+    from .models import SearchQuery
+
+    last = cache.get(SEARCH_SLOTS_KEY, 0)
+    first = cache.get(SEARCH_FLUSHED_KEY, 0)
+    if first > last:
+        # The cache lost the slot counter and started it again
+        first = 0
+    slot_keys = [SEARCH_SLOT_KEY.format(slot) for slot in range(first + 1, last + 1)]
+    queries = {_search_count_key(query): query for query in cache.get_many(slot_keys).values()}
+    counts = cache.get_many(list(queries))
+    cache.delete_many([*slot_keys, *counts])
+    cache.set(SEARCH_FLUSHED_KEY, last, None)
+
+    now = timezone.now()
+    with transaction.atomic():
+        for key, count in counts.items():
+            query = queries[key]
+            updated = SearchQuery.objects.filter(query=query).update(count=F('count') + count, last_searched_at=now)
+            if not updated:
+                SearchQuery.objects.create(query=query, count=count, last_searched_at=now)
+    return len(counts)
+
+
+def count_searches(view):
+    """Count the catalog search of a request before ``view`` (and its page cache) runs."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        query = request.GET.get('search') or request.GET.get('q')
+        if (
+            query and not request.GET.get('cursor') and request.GET.get('page', '1') == '1'
+            and not request.headers.get('HX-Request')
+        ):
+            # First page only, so paging through results counts as one search
+            record_search(query)
+        return view(request, *args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,346 @@
+# products/caching.py
+"""
+Caches for rendered catalog HTML.
+
+Product cards are cached as template fragments keyed on the product id and a
+version token for that product; whole catalog and product pages are cached
+for anonymous visitors under a shared generation token. The signals in
+products/signals.py replace those tokens whenever something a card or page
+shows changes, so stale entries are never looked up again and simply expire.
+
+The page generation doubles as the catalog version for conditional GETs:
+cached pages and the catalog API send an ETag derived from it and a
+Last-Modified of when it was last replaced, and answer ``If-None-Match`` /
+``If-Modified-Since`` with a 304 without rendering anything. Product writes
+that skip the signals go through the queryset hooks in products/models.py,
+which replace it as well.
+
+The tokens only reach every worker process through a cache they all share
+(Redis, see CACHES in settings.py); ``check_shared_cache`` complains when
+the cache is anything else.
+"""
+import datetime
+import hashlib
+import re
+import secrets
+import time
+import uuid
+from functools import wraps
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.views.decorators.http import condition
+
+CARD_VERSION_KEY = 'products:card:version:{}'
+# Changes that touch many cards at once (a category rename, a size being
+# switched off) replace this instead of every product's own token
+CARD_GENERATION_KEY = 'products:card:generation'
+PAGE_GENERATION_KEY = 'products:page:generation'
+# When the page generation was last replaced (a Unix timestamp)
+PAGE_CHANGED_AT_KEY = 'products:page:changed_at'
+# (token, Unix timestamp) replaced whenever a stock level moves; only the
+# API shows exact quantities, so pages do not depend on it
+STOCK_VERSION_KEY = 'products:stock:version'
+PAGE_KEY = 'products:page:{}'
+
+CARD_CACHE_TIMEOUT = 60 * 60 * 24
+PAGE_CACHE_TIMEOUT = 60 * 15
+
+# Query parameters that never change what an API response shows
+IGNORED_PARAMS = ('utm_source', 'utm_medium', 'utm_campaign', 'utm_term', 'utm_content', 'fbclid', 'gclid')
+# The only query parameters the cached pages read (the product list's
+# filters, sort and pager); any other parameter would just split the cache
+PAGE_PARAMS = ('category', 'search', 'q', 'price_range', 'sizes', 'colors', 'sort', 'cursor', 'page')
+
+# Backends every worker process shares, without a database query per read;
+# the database cache is not one (see CACHES in settings.py)
+SHARED_CACHE_BACKENDS = (
+    'django.core.cache.backends.redis.RedisCache',
+    'django.core.cache.backends.memcached.PyMemcacheCache',
+    'django.core.cache.backends.memcached.PyLibMCCache',
+)
+
+CSRF_PLACEHOLDER = '__CSRF_TOKEN__'
+_CSRF_INPUT_RE = re.compile(r'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+
+
+def _new_token():
+    return uuid.uuid4().hex[:12]
+
+
+def cache_is_shared():
+    """Whether every worker process reads and writes the same default cache, in memory."""
+    return settings.CACHES['default']['BACKEND'] in SHARED_CACHE_BACKENDS
+
+
+SHARED_CACHE_MESSAGE = (
+    'The default cache is not Redis or Memcached. A memory cache is local to each process, so a '
+    'catalog change made in one worker does not invalidate what the others cached and guest carts '
+    'are only seen by the worker that stored them; the database cache costs a query per read and '
+    'culls entries by key order, carts included. CART_WRITE_BEHIND is ignored.'
+)
+
+
+def check_shared_cache(app_configs, **kwargs):
+    if cache_is_shared():
+        return []
+    return [checks.Warning(SHARED_CACHE_MESSAGE, hint='Set REDIS_URL (see CACHES in settings.py).', id='products.W001')]
+
+
+def check_deploy_cache(app_configs, **kwargs):
+    """``check --deploy``: production needs the shared cache."""
+    if cache_is_shared():
+        return []
+    return [checks.Error(SHARED_CACHE_MESSAGE, hint='Set REDIS_URL (see CACHES in settings.py).', id='products.E001')]
+
+
+def _tokens(keys):
+    """Fetch version tokens, minting one for every key the cache has lost."""
+    found = cache.get_many(keys)
+    missing = {key: _new_token() for key in keys if key not in found}
+    if missing:
+        cache.set_many(missing, None)
+        found.update(missing)
+    return found
+
+
+def _start_generation(key):
+    # A random start, so a counter the cache lost never counts through
+    # values a process saw before and mistakes them for its own
+    cache.add(key, secrets.randbits(48), None)
+    return cache.get(key)
+
+
+def current_generation(key):
+    """
+    The generation counter at ``key``. Bumps add one, so a process can tell
+    whether its own bump was the only change since it last looked.
+    """
+    generation = cache.get(key)
+    return _start_generation(key) if generation is None else generation
+
+
+def bump_generation(key):
+    """Increment the generation counter at ``key`` and return the new value."""
+    try:
+        return cache.incr(key)
+    except ValueError:
+        _start_generation(key)
+        return cache.incr(key)
+
+
+# ---- Product card fragments ----
+
+def card_versions(product_ids):
+    """Return ``{product_id: version}`` for the ``{% cache %}`` key of each card."""
+    keys = {CARD_VERSION_KEY.format(product_id): product_id for product_id in product_ids}
+    tokens = _tokens([CARD_GENERATION_KEY, *keys])
+    generation = tokens[CARD_GENERATION_KEY]
+    return {product_id: f'{generation}.{tokens[key]}' for key, product_id in keys.items()}
+
+
+def attach_card_versions(products):
+    """Set ``card_version`` on every product of a page with a single cache round trip."""
+    products = list(products)
+    versions = card_versions([product.pk for product in products])
+    for product in products:
+        product.card_version = versions[product.pk]
+    return products
+
+
+def bump_card_versions(product_ids):
+    product_ids = list(product_ids)
+    if product_ids:
+        cache.set_many(
+            {CARD_VERSION_KEY.format(product_id): _new_token() for product_id in product_ids}, None
+        )
+
+
+def bump_card_generation():
+    cache.set(CARD_GENERATION_KEY, _new_token(), None)
+
+
+# ---- Anonymous full-page cache ----
+
+def catalog_version(include_stock=False):
+    """
+    ``(version token, Unix time it last changed)`` in one cache round trip.
+    The token is the page generation, which changes whenever anything shown
+    on a catalog page changes, plus the stock version if ``include_stock``.
+    Versions the cache has lost start again now.
+    """
+    keys = [PAGE_GENERATION_KEY, PAGE_CHANGED_AT_KEY]
+    if include_stock:
+        keys.append(STOCK_VERSION_KEY)
+    found = cache.get_many(keys)
+    if PAGE_GENERATION_KEY in found and PAGE_CHANGED_AT_KEY in found:
+        generation, changed_at = found[PAGE_GENERATION_KEY], found[PAGE_CHANGED_AT_KEY]
+    else:
+        generation, changed_at = bump_page_generation()
+    if include_stock:
+        stock_token, stock_changed_at = found.get(STOCK_VERSION_KEY) or bump_stock_version()
+        generation = f'{generation}.{stock_token}'
+        changed_at = max(changed_at, stock_changed_at)
+    return generation, changed_at
+
+
+def page_generation():
+    return catalog_version()[0]
+
+
+def bump_page_generation():
+    generation, changed_at = _new_token(), time.time()
+    cache.set_many({PAGE_GENERATION_KEY: generation, PAGE_CHANGED_AT_KEY: changed_at}, None)
+    return generation, changed_at
+
+
+def bump_stock_version():
+    version = (_new_token(), time.time())
+    cache.set(STOCK_VERSION_KEY, version, None)
+    return version
+
+
+def stock_changed():
+    """Once the current transaction commits, mark every stock level the API shows as changed."""
+    transaction.on_commit(bump_stock_version)
+
+
+def catalog_changed(product_ids=None):
+    """
+    Once the current transaction commits, drop the cached cards of the given
+    products (or of every product when None) and every cached page.
+    """
+    product_ids = list(product_ids) if product_ids is not None else None
+
+    def bump():
+        if product_ids is None:
+            bump_card_generation()
+        else:
+            bump_card_versions(product_ids)
+        bump_page_generation()
+
+    transaction.on_commit(bump)
+
+
+def normalized_query_string(request, allowed=None):
+    """
+    Sorted query string without empty values or tracking parameters, and
+    with only the ``allowed`` parameters when given.
+    """
+    params = []
+    for name in sorted(request.GET):
+        if name in IGNORED_PARAMS or (allowed is not None and name not in allowed):
+            continue
+        for value in request.GET.getlist(name):
+            if value != '':
+                params.append(f'{name}={value}')
+    return '&'.join(params)
+
+
+def _page_digest(request, generation, variant='', allowed=None):
+    """Hash of everything a catalog response depends on: the generation, the variant and the URL."""
+    raw = f'{generation}:{variant}:{request.path}?{normalized_query_string(request, allowed)}'
+    return hashlib.md5(raw.encode()).hexdigest()
+
+
+def _page_cacheable(request):
+    """
+    Only cookie-less anonymous visitors see the same page as everybody else;
+    a session or pending flash messages make the page personal.
+    """
+    return (
+        request.method in ('GET', 'HEAD')
+        and settings.SESSION_COOKIE_NAME not in request.COOKIES
+        and 'messages' not in request.COOKIES
+        and not request.user.is_authenticated
+    )
+
+
+def _cached_page(request, key):
+    cached = cache.get(key)
+    if cached is None:
+        return None
+    content, content_type = cached
+    if CSRF_PLACEHOLDER in content:
+        content = content.replace(CSRF_PLACEHOLDER, get_token(request))
+    return HttpResponse(content, content_type=content_type)
+
+
+def cache_anonymous_page(view):
+    """
+    Serve repeat anonymous requests for a view straight from the cache.
+
+    CSRF tokens in the cached HTML are swapped for the visitor's own token
+    on the way out, so forms on cached pages still post. Cacheable pages
+    carry an ETag and Last-Modified from the catalog version, and a client
+    (or CDN) revalidating an unchanged page gets a 304 before the cache is
+    even read.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not _page_cacheable(request):
+            return view(request, *args, **kwargs)
+        generation, changed_at = catalog_version()
+        variant = 'hx' if request.headers.get('HX-Request') else 'full'
+        digest = _page_digest(request, generation, variant, PAGE_PARAMS)
+        etag, last_modified = f'"{digest}"', int(changed_at)
+        key = PAGE_KEY.format(digest)
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = _cached_page(request, key)
+        if response is None:
+            response = view(request, *args, **kwargs)
+            if response.status_code != 200 or response.streaming or response.has_header('Cache-Control'):
+                return response
+            content = _CSRF_INPUT_RE.sub(rf'\g<1>{CSRF_PLACEHOLDER}\g<2>', response.content.decode(response.charset))
+            cache.set(key, (content, response['Content-Type']), PAGE_CACHE_TIMEOUT)
+        # On the 304 as well
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        return response
+    return wrapper
+
+
+def conditional_catalog(updated_at=None):
+    """
+    ``condition()`` for catalog API views: an ETag from the catalog and stock
+    versions, the URL and the negotiated media type, and a Last-Modified of
+    when either version last changed. ``updated_at(request, *args, **kwargs)`` may add
+    the ``updated_at`` of the row being shown, when the view reads it anyway.
+    """
+    def validators(request, *args, **kwargs):
+        if not hasattr(request, '_catalog_validators'):
+            generation, changed_at = catalog_version(include_stock=True)
+            last_modified = datetime.datetime.fromtimestamp(changed_at, tz=datetime.timezone.utc)
+            if updated_at is not None:
+                stamp = updated_at(request, *args, **kwargs)
+                if stamp is not None and stamp > last_modified:
+                    last_modified = stamp
+            variant = getattr(request, 'accepted_media_type', '')
+            request._catalog_validators = (_page_digest(request, generation, variant), last_modified)
+        return request._catalog_validators
+
+    conditional = condition(
+        etag_func=lambda request, *args, **kwargs: validators(request, *args, **kwargs)[0],
+        last_modified_func=lambda request, *args, **kwargs: validators(request, *args, **kwargs)[1],
+    )
+
+    def decorator(view):
+        conditional_view = conditional(view)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = conditional_view(request, *args, **kwargs)
+            if response.status_code not in (200, 304):
+                # An error is not a version of the catalog to revalidate
+                response.headers.pop('ETag', None)
+                response.headers.pop('Last-Modified', None)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,493 @@
+# products/catalog_import.py
+"""
+Bulk catalog import from supplier feeds.
+
+A feed is a CSV or JSON Lines file (optionally gzipped) with one product per
+row, keyed by slug. ``iter_feed`` streams it row by row and the
+``CatalogImporter`` upserts one batch of rows at a time: a handful of
+``bulk_create``/``bulk_update`` statements for the products, their category,
+per-size stock, colours and image references, instead of several INSERTs per
+product. Columns missing from a feed leave the stored values alone.
+
+Feed columns::
+
+    slug            required, or derived from name
+    name, description, category (name), price, discount_price
+    is_active, is_featured      true/false, yes/no, 1/0
+    stock                       ignored for products with sizes
+    sizes           "S:10|M:5" in CSV, {"S": 10, "M": 5} in JSONL
+    colors          "black|white" in CSV, a list in JSONL
+    images          storage names under MEDIA_ROOT, "|" separated in CSV
+
+Bulk statements bypass model signals, so the importer indexes each batch for
+search itself and the caller drops the catalog caches once at the end
+(``catalog_imported``).
+"""
+import csv
+import gzip
+import json
+from dataclasses import dataclass, field
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.text import slugify
+
+from . import autocomplete, search, stock
+from .caching import catalog_changed
+from .facets import facets_invalidated
+from .models import Category, Color, Product, ProductColor, ProductImage, ProductSize, Size
+from .navigation import categories_changed
+
+LIST_SEPARATOR = '|'
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 'on'}
+FALSE_VALUES = {'0', 'false', 'no', 'n', 'off', ''}
+
+# Product fields compared for the diff, in report order
+DIFF_FIELDS = (
+    'name', 'category_id', 'description', 'price', 'discount_price',
+    'stock', 'available_colors', 'is_active', 'is_featured',
+)
+
+
+class ImportRowError(ValueError):
+    pass
+
+
+def open_feed(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', newline='')
+    return open(path, encoding='utf-8', newline='')
+
+
+def feed_format(path):
+    name = path[:-3] if path.endswith('.gz') else path
+    if name.endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    if name.endswith('.csv'):
+        return 'csv'
+    raise ValueError(f'Cannot tell the format of {path}; use .csv or .jsonl')
+
+
+def iter_feed(fh, fmt):
+    """Yield ``(line number, raw row dict)`` without reading the whole feed."""
+    if fmt == 'csv':
+        reader = csv.DictReader(fh)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_number, line in enumerate(fh, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as exc:
+            row = exc
+        yield line_number, row
+
+
+# ---- Row parsing ----
+
+def _split(value):
+    if isinstance(value, (list, tuple)):
+        return [str(item).strip() for item in value if str(item).strip()]
+    return [item.strip() for item in str(value).split(LIST_SEPARATOR) if item.strip()]
+
+
+def _decimal(name, value):
+    try:
+        number = Decimal(str(value).strip())
+    except InvalidOperation:
+        raise ImportRowError(f'{name} is not a number: {value!r}')
+    if number < 0:
+        raise ImportRowError(f'{name} is negative: {value!r}')
+    return number.quantize(Decimal('0.01'))
+
+
+def _integer(name, value):
+    try:
+        number = int(str(value).strip())
+    except ValueError:
+        raise ImportRowError(f'{name} is not a whole number: {value!r}')
+    if number < 0:
+        raise ImportRowError(f'{name} is negative: {value!r}')
+    return number
+
+
+def _boolean(name, value):
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return False
+    raise ImportRowError(f'{name} is not a yes/no value: {value!r}')
+
+
+def _sizes(value):
+    if isinstance(value, dict):
+        pairs = value.items()
+    else:
+        pairs = []
+        for item in _split(value):
+            size, _, quantity = item.partition(':')
+            pairs.append((size, quantity or '0'))
+    return {str(size).strip(): _integer(f'quantity of size {size}', quantity) for size, quantity in pairs}
+
+
+def parse_row(raw):
+    """
+    Turn a raw feed row into the product values it sets. Empty cells count
+    as missing, except that an empty discount_price clears the discount.
+    """
+    if isinstance(raw, Exception):
+        raise ImportRowError(f'invalid JSON: {raw}')
+    if not isinstance(raw, dict):
+        raise ImportRowError('row is not an object')
+    values = {key.strip(): value for key, value in raw.items() if key and value is not None}
+    present = {key: value for key, value in values.items() if value != ''}
+    row = {}
+    for name in ('name', 'category'):
+        if name in present:
+            row[name] = str(present[name]).strip()
+    if 'description' in present:
+        row['description'] = str(present['description'])
+    row['slug'] = slugify(present.get('slug') or row.get('name') or '')
+    if not row['slug']:
+        raise ImportRowError('no slug or name')
+    if 'price' in present:
+        row['price'] = _decimal('price', present['price'])
+    if 'discount_price' in values:
+        discount = values['discount_price']
+        row['discount_price'] = _decimal('discount_price', discount) if discount != '' else None
+    for name in ('is_active', 'is_featured'):
+        if name in present:
+            row[name] = _boolean(name, present[name])
+    if 'stock' in present:
+        row['stock'] = _integer('stock', present['stock'])
+    if 'sizes' in present:
+        row['sizes'] = _sizes(present['sizes'])
+        row['stock'] = sum(row['sizes'].values())
+    if 'colors' in present:
+        colors = []
+        for color in _split(present['colors']):
+            color = color.lower()
+            if color not in colors:
+                colors.append(color)
+        row['available_colors'] = colors
+    if 'images' in present:
+        row['images'] = _split(present['images'])
+    return row
+
+
+# ---- Batches ----
+
+@dataclass
+class BatchResult:
+    created: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    categories_created: int = 0
+    sizes_written: int = 0
+    images_added: int = 0
+    errors: list = field(default_factory=list)
+    # Human readable diff lines, one per created or changed product
+    diff: list = field(default_factory=list)
+
+    def add(self, other):
+        for name in ('created', 'updated', 'unchanged', 'categories_created', 'sizes_written', 'images_added'):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+
+class CatalogImporter:
+    """Upserts batches of feed rows. Lookup tables are loaded once per import."""
+
+    def __init__(self, dry_run=False):
+        self.dry_run = dry_run
+        self.categories = dict(Category.objects.values_list('name', 'id'))
+        self.category_slugs = set(Category.objects.values_list('slug', flat=True))
+        self.sizes = dict(Size.objects.values_list('name', 'id'))
+        self.colors = dict(Color.objects.values_list('name', 'id'))
+        self.categories_created = False
+        # A dry run writes nothing, so later batches compare against what the
+        # earlier ones would have written: products, size rows and images by slug
+        self.planned = {}
+        self.planned_sizes = {}
+        self.planned_images = set()
+
+    def parse(self, numbered_rows, result):
+        """Parse and validate rows; the last row wins when a slug repeats."""
+        rows = {}
+        for line_number, raw in numbered_rows:
+            try:
+                row = parse_row(raw)
+                unknown = [size for size in row.get('sizes', {}) if size not in self.sizes]
+                if unknown:
+                    raise ImportRowError(f'unknown sizes: {", ".join(unknown)}')
+            except ImportRowError as exc:
+                result.errors.append((line_number, str(exc)))
+                continue
+            rows[row['slug']] = (line_number, row)
+        return rows
+
+    def import_batch(self, numbered_rows):
+        result = BatchResult()
+        rows = self.parse(numbered_rows, result)
+        if not rows:
+            return result
+        if self.dry_run:
+            self._plan(rows, result)
+            return result
+        with transaction.atomic():
+            self._apply(rows, result)
+        return result
+
+    def _category_ids(self, rows, result):
+        """Category ids by name, creating the missing ones unless this is a dry run."""
+        missing = sorted({
+            row['category'] for _, row in rows.values()
+            if row.get('category') and row['category'] not in self.categories
+        })
+        if missing:
+            result.categories_created += len(missing)
+            result.diff.extend(f'+ category {name}' for name in missing)
+            if self.dry_run:
+                # Reported once; products in it show category_id None
+                self.categories.update(dict.fromkeys(missing))
+            else:
+                new = []
+                for name in missing:
+                    slug = base = slugify(name) or 'category'
+                    suffix = 2
+                    while slug in self.category_slugs:
+                        slug = f'{base}-{suffix}'
+                        suffix += 1
+                    self.category_slugs.add(slug)
+                    new.append(Category(name=name, slug=slug))
+                Category.objects.bulk_create(new)
+                self.categories.update(Category.objects.filter(name__in=missing).values_list('name', 'id'))
+                self.categories_created = True
+        return self.categories
+
+    def _split_rows(self, rows, result):
+        """
+        Match rows to stored products. Returns ``(new, changed, existing)``:
+        unsaved products, ``(product, changed fields)`` pairs for stored ones
+        whose values differ, and every stored product of the batch by slug.
+        """
+        categories = self._category_ids(rows, result)
+        existing = Product.objects.in_bulk(list(rows), field_name='slug')
+        if self.dry_run:
+            existing.update((slug, self.planned[slug]) for slug in rows if slug in self.planned)
+        new, changed = [], []
+        for slug, (line_number, row) in rows.items():
+            values = {name: row[name] for name in DIFF_FIELDS if name in row}
+            if row.get('category'):
+                # None in a dry run for categories that do not exist yet
+                values['category_id'] = categories.get(row['category'])
+            product = existing.get(slug)
+            if product is None:
+                missing = [name for name in ('name', 'price', 'category') if name not in row]
+                if missing:
+                    result.errors.append((line_number, f'new product needs {", ".join(missing)}'))
+                    continue
+                values.setdefault('description', '')
+                new.append(Product(slug=slug, **values))
+                result.created += 1
+                result.diff.append(f'+ {slug}')
+                continue
+            fields = [name for name, value in values.items() if getattr(product, name) != value]
+            if fields:
+                result.diff.append(f'~ {slug}: ' + ', '.join(
+                    f'{name} {getattr(product, name)!r} -> {values[name]!r}' for name in fields
+                ))
+                for name in fields:
+                    setattr(product, name, values[name])
+                changed.append((product, fields))
+                result.updated += 1
+            else:
+                result.unchanged += 1
+        if self.dry_run:
+            self.planned.update((product.slug, product) for product in new)
+            self.planned.update((product.slug, product) for product, _ in changed)
+        return new, changed, existing
+
+    def _plan(self, rows, result):
+        """Count the size rows and images a batch would write, for a dry run."""
+        new, changed, existing = self._split_rows(rows, result)
+        saved = {product.pk: slug for slug, product in existing.items() if product.pk}
+        stored = {}
+        for product_id, size_id, quantity in ProductSize.objects.filter(
+            product_id__in=saved
+        ).values_list('product_id', 'size_id', 'quantity'):
+            stored.setdefault(saved[product_id], {})[size_id] = quantity
+        images = {
+            (saved[product_id], name)
+            for product_id, name in ProductImage.objects.filter(product_id__in=saved).values_list('product_id', 'image')
+        }
+        stored.update((slug, self.planned_sizes[slug]) for slug in rows if slug in self.planned_sizes)
+        images |= self.planned_images
+        for slug, (_, row) in rows.items():
+            if 'sizes' in row:
+                product_sizes = stored.get(slug, {})
+                wanted = {self.sizes[name]: quantity for name, quantity in row['sizes'].items()}
+                result.sizes_written += sum(
+                    1 for size_id, quantity in product_sizes.items() if size_id not in wanted and quantity
+                )
+                result.sizes_written += sum(
+                    1 for size_id, quantity in wanted.items() if product_sizes.get(size_id) != quantity
+                )
+                self.planned_sizes[slug] = wanted
+            result.images_added += sum(1 for name in row.get('images', []) if (slug, name) not in images)
+            self.planned_images.update((slug, name) for name in row.get('images', []))
+
+    def _apply(self, rows, result):
+        new, changed, existing = self._split_rows(rows, result)
+        now = timezone.now()
+        if new:
+            Product.objects.bulk_create(new, batch_size=500)
+            for product in new:
+                existing[product.slug] = product
+        if changed:
+            fields = {'updated_at'}
+            for product, product_fields in changed:
+                fields.update(product_fields)
+                product.updated_at = now
+            Product.objects.bulk_update([product for product, _ in changed], list(fields), batch_size=500)
+
+        products = {slug: existing[slug] for slug in rows if slug in existing}
+        product_ids = [product.pk for product in products.values()]
+        self._write_sizes(rows, products, result)
+        # A stock figure is only kept for products without sizes; the size
+        # writes above already recounted the rest
+        stock_only = [
+            products[slug].pk for slug, (_, row) in rows.items()
+            if slug in products and 'stock' in row and 'sizes' not in row
+        ]
+        if stock_only:
+            stock.recount(stock_only)
+        self._write_colors(rows, products)
+        self._write_images(rows, products, result, now)
+        search.index_products(product_ids)
+
+    def _write_sizes(self, rows, products, result):
+        sized = {slug: row['sizes'] for slug, (_, row) in rows.items() if 'sizes' in row and slug in products}
+        if not sized:
+            return
+        stored = {}
+        for row in ProductSize.objects.filter(product__in=[products[slug] for slug in sized]):
+            stored.setdefault(row.product_id, {})[row.size_id] = row
+        create, update = [], []
+        for slug, sizes in sized.items():
+            product_id = products[slug].pk
+            product_rows = stored.get(product_id, {})
+            wanted = {self.sizes[name]: quantity for name, quantity in sizes.items()}
+            for size_id, row in product_rows.items():
+                # Sizes the feed no longer lists are sold out, not deleted
+                if size_id not in wanted and row.quantity:
+                    row.quantity = 0
+                    update.append(row)
+            for size_id, quantity in wanted.items():
+                row = product_rows.get(size_id)
+                if row is None:
+                    create.append(ProductSize(product_id=product_id, size_id=size_id, quantity=quantity))
+                elif row.quantity != quantity:
+                    row.quantity = quantity
+                    update.append(row)
+        ProductSize.objects.bulk_create(create, batch_size=1000)
+        ProductSize.objects.bulk_update(update, ['quantity'], batch_size=1000)
+        result.sizes_written += len(create) + len(update)
+
+    def _write_colors(self, rows, products):
+        colored = {
+            products[slug].pk: row['available_colors']
+            for slug, (_, row) in rows.items() if 'available_colors' in row and slug in products
+        }
+        if not colored:
+            return
+        missing = {name for names in colored.values() for name in names if name not in self.colors}
+        if missing:
+            labels = dict(Product.COLOR_CHOICES)
+            order = {code: index for index, (code, _) in enumerate(Product.COLOR_CHOICES)}
+            Color.objects.bulk_create(
+                [
+                    Color(name=name, display_name=labels.get(name, name.title()), order=order.get(name, len(order)))
+                    for name in sorted(missing)
+                ],
+                ignore_conflicts=True,
+            )
+            self.colors.update(Color.objects.filter(name__in=missing).values_list('name', 'id'))
+        stored = {
+            (product_id, color_id): pk
+            for pk, product_id, color_id in ProductColor.objects.filter(
+                product_id__in=colored
+            ).values_list('id', 'product_id', 'color_id')
+        }
+        wanted = {
+            (product_id, self.colors[name]) for product_id, names in colored.items() for name in names
+        }
+        stale = [pk for pair, pk in stored.items() if pair not in wanted]
+        if stale:
+            ProductColor.objects.filter(id__in=stale).delete()
+        ProductColor.objects.bulk_create(
+            [ProductColor(product_id=product_id, color_id=color_id) for product_id, color_id in wanted - stored.keys()],
+            ignore_conflicts=True,
+            batch_size=1000,
+        )
+
+    def _write_images(self, rows, products, result, now):
+        imaged = {
+            products[slug].pk: row['images']
+            for slug, (_, row) in rows.items() if row.get('images') and slug in products
+        }
+        if not imaged:
+            return
+        stored = {}
+        for product_id, name, is_primary in ProductImage.objects.filter(
+            product_id__in=imaged
+        ).values_list('product_id', 'image', 'is_primary'):
+            stored.setdefault(product_id, {})[name] = is_primary
+        create = []
+        for product_id, names in imaged.items():
+            have = stored.get(product_id, {})
+            has_primary = any(have.values())
+            for name in names:
+                if name in have:
+                    continue
+                create.append(ProductImage(product_id=product_id, image=name, is_primary=not has_primary))
+                have[name] = not has_primary
+                has_primary = True
+        if not create:
+            return
+        ProductImage.objects.bulk_create(create, batch_size=1000)
+        result.images_added += len(create)
+
+        # Same choice as Product.refresh_image_cache, for the whole batch
+        touched = {image.product_id for image in create}
+        names = {}
+        for product_id, name in ProductImage.objects.filter(product_id__in=touched).order_by(
+            'product_id', '-is_primary', 'id'
+        ).values_list('product_id', 'image'):
+            names.setdefault(product_id, []).append(name)
+        updated = []
+        for product in products.values():
+            if product.pk in touched:
+                product_names = names.get(product.pk, [])
+                product.primary_image_file = product_names[0] if product_names else ''
+                product.secondary_image_file = product_names[1] if len(product_names) > 1 else ''
+                product.updated_at = now
+                updated.append(product)
+        Product.objects.bulk_update(
+            updated, ['primary_image_file', 'secondary_image_file', 'updated_at'], batch_size=500
+        )
+
+
+def catalog_imported(categories_created=False):
+    """Drop every catalog cache once an import has written its last batch."""
+    catalog_changed()
+    facets_invalidated()
+    autocomplete.autocomplete_invalidated()
+    if categories_created:
+        categories_changed()
@@ -0,0 +1,59 @@
+# products/exports.py
+"""
+Catalog export. The CSV columns and list formats are the ones
+import_catalog reads, so an export can be edited and imported again.
+"""
+from django.db.models import Prefetch
+
+from core.exports import Export
+
+from .catalog_import import LIST_SEPARATOR
+from .models import Product, ProductImage, ProductSize
+
+
+class ProductExport(Export):
+    name = 'products'
+    # A date range selects the products changed in it
+    date_field = 'updated_at'
+    header = (
+        'slug', 'name', 'category', 'description', 'price', 'discount_price', 'stock',
+        'sizes', 'colors', 'images', 'is_active', 'is_featured', 'created_at', 'updated_at',
+    )
+
+    def get_queryset(self):
+        return (
+            Product.objects.select_related('category')
+            .prefetch_related(
+                Prefetch(
+                    'productsizes',
+                    queryset=ProductSize.objects.select_related('size').order_by('size__order', 'size__name'),
+                ),
+                Prefetch('images', queryset=ProductImage.objects.order_by('-is_primary', 'id')),
+            )
+            .order_by('id')
+        )
+
+    def record(self, product):
+        return {
+            'slug': product.slug,
+            'name': product.name,
+            'category': product.category.name,
+            'description': product.description,
+            'price': product.price,
+            'discount_price': product.discount_price,
+            'stock': product.stock,
+            'sizes': {row.size.name: row.quantity for row in product.productsizes.all()},
+            'colors': product.available_colors,
+            'images': [image.image.name for image in product.images.all()],
+            'is_active': product.is_active,
+            'is_featured': product.is_featured,
+            'created_at': product.created_at,
+            'updated_at': product.updated_at,
+        }
+
+    def csv_rows(self, product):
+        record = self.record(product)
+        record['sizes'] = LIST_SEPARATOR.join(f'{name}:{quantity}' for name, quantity in record['sizes'].items())
+        record['colors'] = LIST_SEPARATOR.join(record['colors'] or [])
+        record['images'] = LIST_SEPARATOR.join(record['images'])
+        return [[record[column] for column in self.header]]
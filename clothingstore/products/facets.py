@@ -0,0 +1,214 @@
+# products/facets.py
+"""
+Facet counts for the catalog filter sidebar.
+
+Each facet value (a category slug, a price bucket, a size code, a colour) is
+kept as a bitmap over product ids, stored in a plain Python int. Counting how
+many products match a value under the other active filters is then a couple
+of ANDs and a popcount, no matter how many facet values there are.
+
+The index lives in process memory. Changes made in this process are applied
+incrementally; every change also bumps a shared version number in the cache
+so other worker processes rebuild their copy on next use.
+"""
+import threading
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Q
+
+from .caching import bump_generation, current_generation
+
+FACET_VERSION_KEY = 'products:facets:version'
+
+FACETS = ('category', 'price', 'size', 'color')
+
+# (value, lower bound, upper bound) on Product.effective_price, bounds
+# inclusive like the original filter
+PRICE_BUCKETS = (
+    ('0-25', None, Decimal('25')),
+    ('25-50', Decimal('25'), Decimal('50')),
+    ('50-100', Decimal('50'), Decimal('100')),
+    ('100+', Decimal('100'), None),
+)
+
+
+def price_bucket_filter(bucket):
+    """Q object for a price bucket value such as ``'25-50'``, or None if unknown."""
+    for value, low, high in PRICE_BUCKETS:
+        if value == bucket:
+            condition = Q()
+            if low is not None:
+                condition &= Q(effective_price__gte=low)
+            if high is not None:
+                condition &= Q(effective_price__lte=high)
+            return condition
+    return None
+
+
+def price_buckets_for(price):
+    return [
+        value for value, low, high in PRICE_BUCKETS
+        if (low is None or price >= low) and (high is None or price <= high)
+    ]
+
+
+def _bits(ids):
+    mask = 0
+    for product_id in ids:
+        mask |= 1 << product_id
+    return mask
+
+
+class FacetIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.version = None
+        self.active = 0
+        self.bitmaps = {facet: defaultdict(int) for facet in FACETS}
+        # product id -> {facet: values}, so a product's bits can be cleared
+        self.members = {}
+
+    def _load(self, product_ids=None):
+        from .models import Product, ProductColor, ProductSize
+
+        products = Product.objects.filter(is_active=True)
+        sizes = ProductSize.objects.filter(
+            quantity__gt=0, size__is_active=True, product__is_active=True
+        )
+        # Same in-stock rule as Product.objects.with_colors()
+        colors = ProductColor.objects.filter(
+            color__is_active=True, product__is_active=True, product__stock__gt=0
+        )
+        if product_ids is not None:
+            products = products.filter(id__in=product_ids)
+            sizes = sizes.filter(product_id__in=product_ids)
+            colors = colors.filter(product_id__in=product_ids)
+
+        rows = {}
+        for product_id, category_slug, price in products.values_list(
+            'id', 'category__slug', 'effective_price'
+        ):
+            rows[product_id] = {
+                'category': {category_slug},
+                'price': set(price_buckets_for(price)),
+                'size': set(),
+                'color': set(),
+            }
+        for product_id, size_name in sizes.values_list('product_id', 'size__name'):
+            if product_id in rows:
+                rows[product_id]['size'].add(size_name)
+        for product_id, color_name in colors.values_list('product_id', 'color__name'):
+            if product_id in rows:
+                rows[product_id]['color'].add(color_name)
+        return rows
+
+    def _add(self, product_id, values):
+        bit = 1 << product_id
+        self.active |= bit
+        for facet, facet_values in values.items():
+            for value in facet_values:
+                self.bitmaps[facet][value] |= bit
+        self.members[product_id] = values
+
+    def _remove(self, product_id):
+        values = self.members.pop(product_id, None)
+        if values is None:
+            return
+        bit = 1 << product_id
+        self.active &= ~bit
+        for facet, facet_values in values.items():
+            bitmaps = self.bitmaps[facet]
+            for value in facet_values:
+                bitmaps[value] &= ~bit
+                if not bitmaps[value]:
+                    del bitmaps[value]
+
+    def rebuild(self):
+        with self._lock:
+            version = current_generation(FACET_VERSION_KEY)
+            self.active = 0
+            self.bitmaps = {facet: defaultdict(int) for facet in FACETS}
+            self.members = {}
+            for product_id, values in self._load().items():
+                self._add(product_id, values)
+            self.version = version
+
+    def ensure_current(self):
+        if self.version is None or self.version != current_generation(FACET_VERSION_KEY):
+            self.rebuild()
+
+    def refresh_products(self, product_ids):
+        """Re-read the given products and patch their bits in place."""
+        product_ids = list(product_ids)
+        with self._lock:
+            seen_version = self.version
+            new_version = bump_generation(FACET_VERSION_KEY)
+            if seen_version is None or new_version != seen_version + 1:
+                # Never built, or another process changed things as well;
+                # the next read does a full rebuild that covers both
+                self.version = None
+                return
+            rows = self._load(product_ids)
+            for product_id in product_ids:
+                self._remove(product_id)
+                if product_id in rows:
+                    self._add(product_id, rows[product_id])
+            self.version = new_version
+
+    def invalidate(self):
+        """Force every process, including this one, to rebuild."""
+        with self._lock:
+            bump_generation(FACET_VERSION_KEY)
+            self.version = None
+
+    def counts(self, selections, base_ids=None):
+        """
+        Return ``{facet: {value: count}}`` for every facet.
+
+        ``selections`` maps facet names to the selected values. Counts for a
+        facet honour the selections of every *other* facet, so picking one
+        category still shows how many products the sibling categories have.
+        ``base_ids`` optionally restricts everything to a set of product ids,
+        e.g. the matches for a search query.
+        """
+        self.ensure_current()
+        with self._lock:
+            base = self.active
+            if base_ids is not None:
+                base &= _bits(base_ids)
+
+            masks = {}
+            for facet in FACETS:
+                selected = [value for value in selections.get(facet) or [] if value]
+                if selected:
+                    mask = 0
+                    for value in selected:
+                        mask |= self.bitmaps[facet].get(value, 0)
+                    masks[facet] = mask
+
+            result = {}
+            for facet in FACETS:
+                scope = base
+                for other, mask in masks.items():
+                    if other != facet:
+                        scope &= mask
+                result[facet] = {
+                    value: (bitmap & scope).bit_count()
+                    for value, bitmap in self.bitmaps[facet].items()
+                }
+            return result
+
+
+facet_index = FacetIndex()
+
+
+def products_changed(product_ids):
+    """Schedule an incremental facet refresh once the current transaction commits."""
+    product_ids = list(product_ids)
+    transaction.on_commit(lambda: facet_index.refresh_products(product_ids))
+
+
+def facets_invalidated():
+    transaction.on_commit(facet_index.invalidate)
@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from products import recommendations
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the "customers also bought" table from orders and wishlists'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--top-k',
+            type=int,
+            default=recommendations.DEFAULT_TOP_K,
+            help='Neighbours to keep per product',
+        )
+        parser.add_argument(
+            '--wishlist-weight',
+            type=float,
+            default=recommendations.WISHLIST_WEIGHT,
+            help=f'Weight of a wishlist entry relative to a purchase (1.0); default {recommendations.WISHLIST_WEIGHT}',
+        )
+        parser.add_argument(
+            '--every',
+            type=int,
+            default=0,
+            metavar='SECONDS',
+            help='Keep running and rebuild every SECONDS seconds',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            rows = recommendations.build_related_products(
+                top_k=options['top_k'],
+                wishlist_weight=options['wishlist_weight'],
+            )
+            engine = 'scipy' if recommendations.sparse is not None else 'python'
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'Stored {rows} related products in {time.monotonic() - started:.2f}s ({engine}).'
+                )
+            )
+            if not options['every']:
+                break
+            time.sleep(options['every'])
@@ -0,0 +1,7 @@
+from core.exports import ExportCommand
+from products.exports import ProductExport
+
+
+class Command(ExportCommand):
+    help = 'Streams the catalog, with sizes and stock, to a CSV or JSONL file'
+    export_class = ProductExport
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from products.autocomplete import flush_search_counts
+
+
+class Command(BaseCommand):
+    help = 'Adds the catalog searches counted in the cache to the search popularity table'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--every',
+            type=int,
+            default=0,
+            metavar='SECONDS',
+            help='Keep running and flush every SECONDS seconds',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            flushed = flush_search_counts()
+            if flushed or options['verbosity'] > 1:
+                self.stdout.write(self.style.SUCCESS(f'Counted searches for {flushed} queries.'))
+            if not options['every']:
+                break
+            time.sleep(options['every'])
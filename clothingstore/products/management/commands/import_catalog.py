@@ -0,0 +1,139 @@
+import json
+import os
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products.catalog_import import (
+    BatchResult, CatalogImporter, catalog_imported, feed_format, iter_feed, open_feed,
+)
+
+
+class Command(BaseCommand):
+    help = 'Streams a CSV or JSONL supplier feed into the catalog in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('feed', help='Path to a .csv or .jsonl feed, optionally .gz')
+        parser.add_argument(
+            '--format',
+            choices=('csv', 'jsonl'),
+            help='Feed format, when the file name does not tell',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Rows written per transaction',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report what would change without writing anything',
+        )
+        parser.add_argument(
+            '--checkpoint',
+            help='Progress file (default: <feed>.checkpoint)',
+        )
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            help='Skip the rows a previous, interrupted run already committed',
+        )
+
+    def handle(self, *args, **options):
+        path = options['feed']
+        if not os.path.exists(path):
+            raise CommandError(f'No such feed: {path}')
+        try:
+            fmt = options['format'] or feed_format(path)
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be at least 1')
+        dry_run = options['dry_run']
+        checkpoint_path = options['checkpoint'] or f'{path}.checkpoint'
+        fingerprint = self.fingerprint(path)
+
+        skip = 0
+        if options['resume']:
+            skip = self.read_checkpoint(checkpoint_path, fingerprint)
+            self.stdout.write(f'Resuming after row {skip}.')
+
+        importer = CatalogImporter(dry_run=dry_run)
+        show_diff = dry_run or options['verbosity'] > 1
+        totals = BatchResult()
+        errors = 0
+        done = skip
+        batch_number = 0
+        started = time.monotonic()
+        try:
+            with open_feed(path) as fh:
+                rows = islice(iter_feed(fh, fmt), skip, None)
+                while True:
+                    batch = list(islice(rows, batch_size))
+                    if not batch:
+                        break
+                    batch_number += 1
+                    batch_started = time.monotonic()
+                    result = importer.import_batch(batch)
+                    elapsed = time.monotonic() - batch_started
+                    done += len(batch)
+                    if not dry_run:
+                        # Only after the batch has committed
+                        self.write_checkpoint(checkpoint_path, fingerprint, done)
+
+                    if show_diff:
+                        for line in result.diff:
+                            self.stdout.write(line)
+                    for line_number, message in result.errors:
+                        self.stderr.write(f'Line {line_number}: {message}')
+                    errors += len(result.errors)
+                    totals.add(result)
+                    self.stdout.write(
+                        f'Batch {batch_number}: rows {done - len(batch) + 1}-{done} in {elapsed:.2f}s '
+                        f'({len(batch) / elapsed if elapsed else 0:.0f} rows/s): '
+                        f'{result.created} new, {result.updated} changed, {result.unchanged} unchanged, '
+                        f'{len(result.errors)} rejected'
+                    )
+        finally:
+            if not dry_run and batch_number:
+                catalog_imported(importer.categories_created)
+
+        if not dry_run and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        elapsed = time.monotonic() - started
+        rows = done - skip
+        summary = (
+            f'{"Would import" if dry_run else "Imported"} {rows} rows in {elapsed:.2f}s '
+            f'({rows / elapsed if elapsed else 0:.0f} rows/s): '
+            f'{totals.created} new, {totals.updated} changed, {totals.unchanged} unchanged products, '
+            f'{totals.categories_created} new categories, {totals.sizes_written} size rows, '
+            f'{totals.images_added} new images, {errors} rejected rows.'
+        )
+        self.stdout.write(self.style.WARNING(summary) if errors else self.style.SUCCESS(summary))
+        if totals.images_added and not dry_run:
+            self.stdout.write('Run generate_image_derivatives to resize the new images.')
+
+    def fingerprint(self, path):
+        stat = os.stat(path)
+        return {'feed': os.path.abspath(path), 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+    def read_checkpoint(self, checkpoint_path, fingerprint):
+        try:
+            with open(checkpoint_path) as fh:
+                checkpoint = json.load(fh)
+        except FileNotFoundError:
+            raise CommandError(f'No checkpoint at {checkpoint_path}')
+        except ValueError:
+            raise CommandError(f'Unreadable checkpoint at {checkpoint_path}')
+        if {key: checkpoint.get(key) for key in fingerprint} != fingerprint:
+            raise CommandError('The feed has changed since the checkpoint was written; import it from the start')
+        return checkpoint['rows']
+
+    def write_checkpoint(self, checkpoint_path, fingerprint, rows):
+        temp_path = f'{checkpoint_path}.tmp'
+        with open(temp_path, 'w') as fh:
+            json.dump({**fingerprint, 'rows': rows}, fh)
+        os.replace(temp_path, checkpoint_path)
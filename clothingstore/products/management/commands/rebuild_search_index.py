@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from products.models import Product
+from products.search import get_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the product full-text search index from the Product table'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--recreate',
+            action='store_true',
+            help='Drop and recreate the index table before repopulating it',
+        )
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        with transaction.atomic():
+            if options['recreate']:
+                with connection.cursor() as cursor:
+                    backend.drop(cursor)
+                    backend.create(cursor)
+            backend.rebuild()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Rebuilt {connection.vendor} search index for {Product.objects.count()} products.'
+            )
+        )
@@ -0,0 +1,71 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from products import stock
+from products.caching import catalog_changed
+from products.facets import products_changed
+
+
+class Command(BaseCommand):
+    help = 'Finds products whose stock differs from the sum of their size quantities and repairs them'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='List the drifted products without changing them',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Products repaired per UPDATE',
+        )
+        parser.add_argument(
+            '--every',
+            type=int,
+            default=0,
+            metavar='SECONDS',
+            help='Keep running and check every SECONDS seconds',
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+        while True:
+            found, repaired = self.reconcile(options)
+            if found or options['verbosity'] > 1:
+                if options['dry_run']:
+                    self.stdout.write(self.style.WARNING(f'{found} products have drifted.'))
+                else:
+                    self.stdout.write(self.style.SUCCESS(f'Repaired {repaired} of {found} drifted products.'))
+            if not options['every']:
+                break
+            time.sleep(options['every'])
+
+    def reconcile(self, options):
+        found = repaired = 0
+        last_id = 0
+        while True:
+            batch = list(
+                stock.drifted().filter(id__gt=last_id)
+                .values_list('id', 'name', 'stock', 'size_stock')[:options['batch_size']]
+            )
+            if not batch:
+                break
+            last_id = batch[-1][0]
+            found += len(batch)
+            if options['dry_run'] or options['verbosity'] > 1:
+                for product_id, name, recorded, counted in batch:
+                    self.stdout.write(f'{name} (#{product_id}): stock {recorded}, sizes add up to {counted}')
+            if options['dry_run']:
+                continue
+            product_ids = [row[0] for row in batch]
+            with transaction.atomic():
+                repaired += stock.recount(product_ids)
+                # Colour facets and cards show whether a product is in stock
+                products_changed(product_ids)
+                catalog_changed(product_ids)
+        return found, repaired
@@ -58,7 +58,6 @@ class Migration(migrations.Migration):
                 ('created_at', models.DateTimeField(auto_now_add=True)),
                 ('updated_at', models.DateTimeField(auto_now=True)),
                 ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='products', to='products.category')),
-                ('sizes', models.ManyToManyField(related_name='products', through='products.ProductSize', to='products.size')),
             ],
             options={
                 'ordering': ['-created_at'],
@@ -88,4 +87,10 @@ class Migration(migrations.Migration):
                 ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='images', to='products.product')),
             ],
         ),
+        # Added after ProductSize exists, so a fresh database can be migrated
+        migrations.AddField(
+            model_name='product',
+            name='sizes',
+            field=models.ManyToManyField(related_name='products', through='products.ProductSize', to='products.size'),
+        ),
     ]
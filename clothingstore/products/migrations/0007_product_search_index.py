@@ -0,0 +1,28 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    from products.search import get_backend
+
+    backend = get_backend(schema_editor.connection.vendor)
+    with schema_editor.connection.cursor() as cursor:
+        backend.create(cursor)
+    backend.rebuild()
+
+
+def drop_search_index(apps, schema_editor):
+    from products.search import get_backend
+
+    with schema_editor.connection.cursor() as cursor:
+        get_backend(schema_editor.connection.vendor).drop(cursor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0006_merge_20250822_1755'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
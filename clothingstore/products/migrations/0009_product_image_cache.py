@@ -0,0 +1,37 @@
+# Generated by Django 4.2.7 on 2026-10-17 04:29
+
+from django.db import migrations, models
+
+
+def backfill_image_cache(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    ProductImage = apps.get_model('products', 'ProductImage')
+    names = {}
+    for product_id, image in ProductImage.objects.order_by('product_id', '-is_primary', 'id').values_list('product_id', 'image'):
+        names.setdefault(product_id, []).append(image)
+    for product_id, images in names.items():
+        Product.objects.filter(pk=product_id).update(
+            primary_image_file=images[0],
+            secondary_image_file=images[1] if len(images) > 1 else '',
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0008_product_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='primary_image_file',
+            field=models.ImageField(blank=True, editable=False, upload_to='products/'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='secondary_image_file',
+            field=models.ImageField(blank=True, editable=False, upload_to='products/'),
+        ),
+        migrations.RunPython(backfill_image_cache, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,98 @@
+# Generated by Django 4.2.7 on 2026-10-17 04:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Product.COLOR_CHOICES at the time of this migration
+COLOR_LABELS = [
+    ('black', 'Black'), ('white', 'White'), ('red', 'Red'), ('blue', 'Blue'),
+    ('green', 'Green'), ('yellow', 'Yellow'), ('orange', 'Orange'),
+    ('purple', 'Purple'), ('pink', 'Pink'), ('brown', 'Brown'), ('gray', 'Gray'),
+    ('navy', 'Navy Blue'), ('maroon', 'Maroon'), ('olive', 'Olive'),
+    ('lime', 'Lime'), ('aqua', 'Aqua'), ('teal', 'Teal'), ('silver', 'Silver'),
+    ('gold', 'Gold'), ('beige', 'Beige'),
+]
+
+
+def backfill_product_colors(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    Color = apps.get_model('products', 'Color')
+    ProductColor = apps.get_model('products', 'ProductColor')
+
+    labels = dict(COLOR_LABELS)
+    order = {code: index for index, (code, _) in enumerate(COLOR_LABELS)}
+    colors = {
+        code: Color.objects.create(name=code, display_name=label, order=order[code])
+        for code, label in COLOR_LABELS
+    }
+    links = []
+    for product_id, values in Product.objects.values_list('id', 'available_colors').iterator():
+        seen = set()
+        for code in values or []:
+            code = str(code).strip().lower()
+            if not code or code in seen:
+                continue
+            seen.add(code)
+            if code not in colors:
+                colors[code] = Color.objects.create(
+                    name=code, display_name=labels.get(code, code.title()), order=len(order)
+                )
+            links.append(ProductColor(product_id=product_id, color_id=colors[code].id))
+    ProductColor.objects.bulk_create(links, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0009_product_image_cache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Color',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=30, unique=True)),
+                ('display_name', models.CharField(max_length=50)),
+                ('order', models.PositiveIntegerField(default=0)),
+                ('is_active', models.BooleanField(default=True)),
+            ],
+            options={
+                'ordering': ['order', 'name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductColor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='productsize',
+            index=models.Index(condition=models.Q(('quantity__gt', 0)), fields=['size', 'product'], name='productsize_in_stock_idx'),
+        ),
+        migrations.AddField(
+            model_name='productcolor',
+            name='color',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='product_colors', to='products.color'),
+        ),
+        migrations.AddField(
+            model_name='productcolor',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='productcolors', to='products.product'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='colors',
+            field=models.ManyToManyField(blank=True, related_name='products', through='products.ProductColor', to='products.color'),
+        ),
+        migrations.AddIndex(
+            model_name='productcolor',
+            index=models.Index(fields=['color', 'product'], name='productcolor_color_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='productcolor',
+            unique_together={('product', 'color')},
+        ),
+        migrations.RunPython(backfill_product_colors, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.7 on 2026-10-17 04:33
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce, NullIf
+
+
+def backfill_effective_price(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    decimal = models.DecimalField(max_digits=10, decimal_places=2)
+    Product.objects.update(
+        effective_price=Coalesce(
+            NullIf('discount_price', models.Value(0, output_field=decimal)), 'price',
+            output_field=decimal,
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0010_product_colors'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_price_id_idx',
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='effective_price',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10),
+        ),
+        migrations.RunPython(backfill_effective_price, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['effective_price', 'id'], name='product_active_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['category', 'effective_price', 'id'], name='product_category_price_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-17 04:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0011_product_effective_price'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelatedProduct',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='related_links', to='products.product')),
+                ('related', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='related_from', to='products.product')),
+            ],
+            options={
+                'ordering': ['product', 'rank'],
+                'indexes': [models.Index(fields=['product', 'rank'], name='relatedproduct_rank_idx')],
+                'unique_together': {('product', 'related')},
+            },
+        ),
+    ]
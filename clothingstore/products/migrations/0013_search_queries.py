@@ -0,0 +1,27 @@
+# Generated by Django 4.2.7 on 2026-10-17 04:43
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0012_related_products'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchQuery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('query', models.CharField(max_length=100, unique=True)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('last_searched_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name_plural': 'Search queries',
+                'ordering': ['-count'],
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-17 04:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0013_search_queries'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['stock', 'id'], name='product_active_stock_idx'),
+        ),
+    ]
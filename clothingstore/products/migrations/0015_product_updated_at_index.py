@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-17 05:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0014_product_stock_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['updated_at'], name='product_updated_at_idx'),
+        ),
+    ]
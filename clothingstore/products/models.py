@@ -1,8 +1,31 @@
-from django.db import models
+from django.db import models, transaction
 from django.urls import reverse
 from django.contrib.auth.models import User
 from django.utils.translation import gettext_lazy as _
 from django.conf import settings
+from django.utils import timezone
+from django.db.models.functions import Coalesce, NullIf
+
+from . import autocomplete, search, stock
+from .caching import card_versions, catalog_changed
+from .facets import facets_invalidated, products_changed
+from .navigation import categories_changed
+
+class CategoryQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        # No signals fire for queryset updates. Category names and states
+        # show on every page, in the navigation, the search documents, the
+        # suggestions and the facets, as after Category.save()
+        category_ids = list(self.values_list('pk', flat=True))
+        rows = super().update(**kwargs)
+        if category_ids:
+            catalog_changed()
+            categories_changed()
+            autocomplete.autocomplete_invalidated()
+            search.index_products(Product.objects.filter(category_id__in=category_ids).values_list('id', flat=True))
+            facets_invalidated()
+        return rows
+
 
 class Category(models.Model):
     name = models.CharField(max_length=100, unique=True)
@@ -12,6 +35,8 @@ class Category(models.Model):
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    objects = CategoryQuerySet.as_manager()
+    
     class Meta:
         verbose_name_plural = 'Categories'
         ordering = ['name']
@@ -72,6 +97,158 @@ class Size(models.Model):
     def __str__(self):
         return self.display_name
 
+class Color(models.Model):
+    """A product colour; ``name`` is the code stored in Product.available_colors."""
+    name = models.CharField(max_length=30, unique=True)
+    display_name = models.CharField(max_length=50)
+    order = models.PositiveIntegerField(default=0)
+    is_active = models.BooleanField(default=True)
+    
+    class Meta:
+        ordering = ['order', 'name']
+    
+    def __str__(self):
+        return self.display_name
+
+def effective_price_expression(values=None):
+    """
+    SQL for Product.get_price: the discount price when set and non-zero,
+    else the regular price. ``values`` may override either column with a
+    literal or an expression, as in the kwargs of ``QuerySet.update()``.
+    """
+    values = values or {}
+    decimal = models.DecimalField(max_digits=10, decimal_places=2)
+    operands = []
+    for name in ('discount_price', 'price'):
+        value = values.get(name, models.F(name))
+        if not hasattr(value, 'resolve_expression'):
+            value = models.Value(value, output_field=decimal)
+        operands.append(value)
+    discount_price, price = operands
+    return Coalesce(
+        NullIf(discount_price, models.Value(0, output_field=decimal)), price,
+        output_field=decimal,
+    )
+
+
+class ProductQuerySet(models.QuerySet):
+    def with_available_sizes(self):
+        """
+        Prefetch the in-stock sizes of every product in one query so
+        ``Product.available_sizes`` never has to query per product.
+        """
+        return self.prefetch_related(
+            models.Prefetch(
+                'productsizes',
+                queryset=ProductSize.objects.available().select_related('size'),
+                to_attr='_prefetched_available_sizes',
+            )
+        )
+
+    def with_sizes(self, names):
+        """Products with at least one of the given sizes (Size.name) in stock."""
+        return self.filter(
+            models.Exists(
+                ProductSize.objects.available().filter(
+                    product=models.OuterRef('pk'), size__name__in=names
+                )
+            )
+        )
+
+    def with_colors(self, names):
+        """
+        In-stock products offered in at least one of the given colours.
+        Stock is not tracked per colour, so a colour is available whenever
+        the product itself has stock.
+        """
+        return self.filter(stock__gt=0).filter(
+            models.Exists(
+                ProductColor.objects.filter(
+                    product=models.OuterRef('pk'), color__name__in=names, color__is_active=True
+                )
+            )
+        )
+
+    # Keep Product.effective_price in step when prices change in bulk
+
+    def update(self, **kwargs):
+        if ('price' in kwargs or 'discount_price' in kwargs) and 'effective_price' not in kwargs:
+            kwargs['effective_price'] = effective_price_expression(kwargs)
+        # No signals fire for queryset updates, so drop the cached HTML here
+        product_ids = list(self.values_list('pk', flat=True))
+        rows = super().update(**kwargs)
+        catalog_changed(product_ids)
+        # Category, price, stock and state all decide a product's facets
+        products_changed(product_ids)
+        if autocomplete.PRODUCT_FIELDS.intersection(kwargs):
+            autocomplete.products_changed(product_ids)
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for obj in objs:
+            obj.update_effective_price()
+        created = super().bulk_create(objs, *args, **kwargs)
+        # New products have no cached cards yet, only pages that miss them
+        catalog_changed([])
+        products_changed([obj.pk for obj in created if obj.pk is not None])
+        return created
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        objs = list(objs)
+        fields = list(fields)
+        if ('price' in fields or 'discount_price' in fields) and 'effective_price' not in fields:
+            for obj in objs:
+                obj.update_effective_price()
+            fields.append('effective_price')
+        rows = super().bulk_update(objs, fields, *args, **kwargs)
+        product_ids = [obj.pk for obj in objs]
+        catalog_changed(product_ids)
+        products_changed(product_ids)
+        return rows
+
+
+class ProductSizeQuerySet(models.QuerySet):
+    def available(self):
+        """In-stock rows for active sizes, in display order."""
+        return self.filter(quantity__gt=0, size__is_active=True).order_by('size__order', 'size__name')
+
+    # Bulk writes recount Product.stock for the products they touched (see
+    # products.stock); deletes are covered by the post_delete signal
+
+    def update(self, **kwargs):
+        if not STOCK_FIELDS.intersection(kwargs):
+            return super().update(**kwargs)
+        with transaction.atomic(using=self.db):
+            product_ids = set(self.values_list('product_id', flat=True))
+            rows = super().update(**kwargs)
+            moved_to = kwargs.get('product_id', kwargs.get('product'))
+            if moved_to is not None:
+                product_ids.add(getattr(moved_to, 'pk', moved_to))
+            stock.recount(product_ids)
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        with transaction.atomic(using=self.db):
+            created = super().bulk_create(objs, *args, **kwargs)
+            stock.recount({obj.product_id for obj in objs})
+        return created
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        if not STOCK_FIELDS.intersection(fields):
+            return super().bulk_update(objs, fields, *args, **kwargs)
+        objs = list(objs)
+        with transaction.atomic(using=self.db):
+            rows = super().bulk_update(objs, fields, *args, **kwargs)
+            stock.recount({obj.product_id for obj in objs})
+        return rows
+
+
+# ProductSize fields that Product.stock is summed from
+STOCK_FIELDS = {'quantity', 'product', 'product_id'}
+
+
 class Product(models.Model):
     SIZE_CHOICES = [
         ('S', 'Small'),
@@ -110,14 +287,26 @@ class Product(models.Model):
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
     discount_price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    # What the customer pays (get_price), stored so it can be sorted and
+    # filtered through an index; maintained by save() and the queryset
+    effective_price = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False)
+    # For products with sizes, the sum of their ProductSize quantities,
+    # maintained incrementally (see products.stock); set by hand otherwise
     stock = models.PositiveIntegerField(default=0, help_text="Total stock across all sizes and colors")
     sizes = models.ManyToManyField(Size, through='ProductSize', related_name='products')
+    colors = models.ManyToManyField(Color, through='ProductColor', related_name='products', blank=True)
     is_active = models.BooleanField(default=True)
     available_colors = models.JSONField(default=list, blank=True, help_text="List of available colors for this product")
     is_featured = models.BooleanField(default=False)
+    # Denormalized copies of the primary and hover images so listings can
+    # render images without touching ProductImage (see refresh_image_cache)
+    primary_image_file = models.ImageField(upload_to='products/', blank=True, editable=False)
+    secondary_image_file = models.ImageField(upload_to='products/', blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = ProductQuerySet.as_manager()
+    
     # Keep available_sizes for backward compatibility
     @property
     def available_sizes(self):
@@ -125,26 +314,107 @@ class Product(models.Model):
         Returns a list of size codes (e.g., ["S", "M", "L"]) that are
         available for this product based on related ProductSize entries
         with quantity > 0 and active sizes, ordered by Size.order.
+        
+        Uses the rows loaded by ``Product.objects.with_available_sizes()``
+        when present, and otherwise queries once per instance.
         """
-        try:
-            # Use select_related to minimize queries and ensure deterministic order
-            product_sizes = (
-                self.productsizes.select_related('size')
-                .filter(quantity__gt=0, size__is_active=True)
-                .order_by('size__order', 'size__name')
-            )
-            return [ps.size.name for ps in product_sizes]
-        except Exception:
-            # Fallback to empty list if relation not ready (e.g., during migrations)
-            return []
+        if '_available_sizes' not in self.__dict__:
+            prefetched = getattr(self, '_prefetched_available_sizes', None)
+            if prefetched is not None:
+                self._available_sizes = [ps.size.name for ps in prefetched]
+            else:
+                try:
+                    self._available_sizes = list(
+                        self.productsizes.available().values_list('size__name', flat=True)
+                    )
+                except Exception:
+                    # Fallback to empty list if relation not ready (e.g., during migrations)
+                    return []
+        return self._available_sizes
     
     @available_sizes.setter
     def available_sizes(self, value):
         # For backward compatibility, but won't actually save to database
-        pass
+        self._available_sizes = list(value or [])
+    
+    def sync_colors(self):
+        """
+        Mirror ``available_colors`` into ProductColor rows, which is what the
+        colour filter and facets query. Unknown colour codes get a Color row.
+        """
+        wanted = []
+        for code in self.available_colors or []:
+            code = str(code).strip().lower()
+            if code and code not in wanted:
+                wanted.append(code)
+        existing = dict(self.productcolors.values_list('color__name', 'id'))
+        stale = [pk for name, pk in existing.items() if name not in wanted]
+        if stale:
+            ProductColor.objects.filter(id__in=stale).delete()
+        missing = [code for code in wanted if code not in existing]
+        if missing:
+            colors = {color.name: color for color in Color.objects.filter(name__in=missing)}
+            labels = dict(self.COLOR_CHOICES)
+            order = {code: index for index, (code, _) in enumerate(self.COLOR_CHOICES)}
+            for code in missing:
+                if code not in colors:
+                    colors[code] = Color.objects.get_or_create(
+                        name=code,
+                        defaults={
+                            'display_name': labels.get(code, code.title()),
+                            'order': order.get(code, len(order)),
+                        },
+                    )[0]
+            ProductColor.objects.bulk_create(
+                [ProductColor(product=self, color=colors[code]) for code in missing],
+                ignore_conflicts=True,
+            )
+    
+    @property
+    def card_version(self):
+        """Cache key part for this product's card fragment, see products.caching."""
+        if '_card_version' not in self.__dict__:
+            self._card_version = card_versions([self.pk])[self.pk]
+        return self._card_version
+    
+    @card_version.setter
+    def card_version(self, value):
+        self._card_version = value
+    
+    def refresh_from_db(self, *args, **kwargs):
+        self.__dict__.pop('_available_sizes', None)
+        self.__dict__.pop('_prefetched_available_sizes', None)
+        self.__dict__.pop('_card_version', None)
+        super().refresh_from_db(*args, **kwargs)
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Keyset pagination orderings (see products.pagination.SORT_ORDERINGS)
+            models.Index(fields=['-created_at', 'id'], name='product_created_id_idx'),
+            models.Index(fields=['name', 'id'], name='product_name_id_idx'),
+            # Price sort and range filters over active products, with and
+            # without a category; partial so ``WHERE is_active`` matches the
+            # index condition on every backend
+            models.Index(
+                fields=['effective_price', 'id'],
+                condition=models.Q(is_active=True),
+                name='product_active_price_idx',
+            ),
+            models.Index(
+                fields=['category', 'effective_price', 'id'],
+                condition=models.Q(is_active=True),
+                name='product_category_price_idx',
+            ),
+            # The latest product write, part of the catalog ETags (products.caching)
+            models.Index(fields=['updated_at'], name='product_updated_at_idx'),
+            # Low-stock lists on the dashboards, lowest first
+            models.Index(
+                fields=['stock', 'id'],
+                condition=models.Q(is_active=True),
+                name='product_active_stock_idx',
+            ),
+        ]
     
     def __str__(self):
         return self.name
@@ -152,6 +422,35 @@ class Product(models.Model):
     def get_absolute_url(self):
         return reverse('products:detail', args=[self.slug])
     
+    def save(self, *args, **kwargs):
+        self.update_effective_price()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and ('price' in update_fields or 'discount_price' in update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'effective_price'}
+        # Columns other writers keep: with sizes, stock is their sum, kept by
+        # the size rows themselves, and the image copies are kept by
+        # refresh_image_cache. An instance loaded before one of those writes
+        # must not put back what it read, so they are left out (the images
+        # from full saves only) and read back instead
+        if not self._state.adding and self.pk:
+            fields = kwargs.get('update_fields')
+            kept = set()
+            if fields is None:
+                fields = [field.name for field in self._meta.concrete_fields if not field.primary_key]
+                kept |= {'primary_image_file', 'secondary_image_file'}
+            if 'stock' in fields and ProductSize.objects.filter(product_id=self.pk).exists():
+                kept.add('stock')
+            if kept:
+                kwargs['update_fields'] = set(fields) - kept
+                super().save(*args, **kwargs)
+                for name, value in Product.objects.filter(pk=self.pk).values(*kept).get().items():
+                    setattr(self, name, value)
+                return
+        super().save(*args, **kwargs)
+    
+    def update_effective_price(self):
+        self.effective_price = self.get_price
+    
     @property
     def get_price(self):
         return self.discount_price if self.discount_price else self.price
@@ -163,14 +462,27 @@ class Product(models.Model):
     # ---- Image helpers used across templates (orders list/detail, product cards) ----
     @property
     def primary_image(self):
-        """Return the primary ProductImage or the first available image, else None."""
-        try:
-            img = self.images.filter(is_primary=True).first()
-            if img:
-                return img
-            return self.images.first()
-        except Exception:
+        """
+        Return the primary ProductImage (or the first available image), else None.
+        Listings only need ``primary_image_url``, which costs no query; with
+        ``images`` prefetched, neither does this.
+        """
+        if not self.primary_image_file:
+            # No images at all (refresh_image_cache keeps the copy in step)
             return None
+        prefetched = getattr(self, '_prefetched_objects_cache', {}).get('images')
+        if prefetched is not None:
+            return min(prefetched, key=lambda image: (not image.is_primary, image.pk), default=None)
+        return self.images.order_by('-is_primary', 'id').first()
+
+    @property
+    def primary_image_url(self):
+        return self.primary_image_file.url if self.primary_image_file else ''
+
+    @property
+    def secondary_image_url(self):
+        """Image shown when hovering a product card, or '' if there is none."""
+        return self.secondary_image_file.url if self.secondary_image_file else ''
 
     @property
     def get_thumbnail_url(self):
@@ -178,16 +490,34 @@ class Product(models.Model):
         Safe accessor used in templates. Returns a valid URL to an image to prevent
         broken images in the UI. Order pages rely on this property.
         """
-        img = self.primary_image
-        if img and getattr(img, 'image', None):
+        if self.primary_image_file:
             try:
-                return img.image.url
+                return self.primary_image_file.url
             except Exception:
                 pass
         # Fallback placeholder (ensure this exists in static/img)
         placeholder = getattr(settings, 'STATIC_URL', '/static/') + 'img/placeholder-product.svg'
         return placeholder
 
+    def refresh_image_cache(self):
+        """
+        Recompute primary_image_file/secondary_image_file from ProductImage.
+        The primary image is the one flagged is_primary, else the first one
+        uploaded; the hover image is the first other image.
+        """
+        names = list(
+            self.images.order_by('-is_primary', 'id').values_list('image', flat=True)[:2]
+        )
+        primary = names[0] if names else ''
+        secondary = names[1] if len(names) > 1 else ''
+        Product.objects.filter(pk=self.pk).update(
+            primary_image_file=primary,
+            secondary_image_file=secondary,
+            updated_at=timezone.now(),
+        )
+        self.primary_image_file = primary
+        self.secondary_image_file = secondary
+
 class ProductSize(models.Model):
     """
     Through model for the many-to-many relationship between Product and Size
@@ -205,13 +535,71 @@ class ProductSize(models.Model):
     )
     quantity = models.PositiveIntegerField(default=0)
     
+    objects = ProductSizeQuerySet.as_manager()
+    
     class Meta:
         unique_together = ('product', 'size')
         verbose_name = 'Product Size'
         verbose_name_plural = 'Product Sizes'
+        indexes = [
+            # Size filter: in-stock rows looked up by size (see with_sizes)
+            models.Index(
+                fields=['size', 'product'],
+                condition=models.Q(quantity__gt=0),
+                name='productsize_in_stock_idx',
+            ),
+        ]
     
     def __str__(self):
         return f"{self.product.name} - {self.size.name} (Qty: {self.quantity})"
+    
+    def save(self, *args, **kwargs):
+        """Apply the change in quantity to Product.stock in the same transaction."""
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and not STOCK_FIELDS.intersection(update_fields):
+            return super().save(*args, **kwargs)
+        with transaction.atomic():
+            stored = None
+            if not self._state.adding:
+                stored = ProductSize.objects.select_for_update().filter(pk=self.pk).values_list(
+                    'product_id', 'quantity'
+                ).first()
+            super().save(*args, **kwargs)
+            if hasattr(self.quantity, 'resolve_expression'):
+                # An F() expression: the new value is only known to the database
+                stock.recount({self.product_id} | ({stored[0]} if stored else set()))
+            elif stored is not None:
+                old_product_id, old_quantity = stored
+                deltas = {old_product_id: -old_quantity}
+                deltas[self.product_id] = deltas.get(self.product_id, 0) + self.quantity
+                stock.add_stock(deltas)
+            elif ProductSize.objects.filter(product_id=self.product_id).exclude(pk=self.pk).exists():
+                stock.add_stock({self.product_id: self.quantity})
+            else:
+                stock.replace_stock(self.product_id, self.quantity)
+    
+    def delete(self, *args, **kwargs):
+        """Delete with the stored quantity, which is what product_size_deleted takes off Product.stock."""
+        with transaction.atomic():
+            stored = ProductSize.objects.select_for_update().filter(pk=self.pk).values_list('quantity', flat=True).first()
+            if stored is not None:
+                self.quantity = stored
+            return super().delete(*args, **kwargs)
+
+
+class ProductColor(models.Model):
+    """Normalized copy of Product.available_colors, kept by Product.sync_colors."""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='productcolors')
+    color = models.ForeignKey(Color, on_delete=models.CASCADE, related_name='product_colors')
+    
+    class Meta:
+        unique_together = ('product', 'color')
+        indexes = [
+            models.Index(fields=['color', 'product'], name='productcolor_color_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.product.name} - {self.color.name}"
 
 
 class ProductImage(models.Model):
@@ -221,4 +609,42 @@ class ProductImage(models.Model):
     is_primary = models.BooleanField(default=False)
     
     def __str__(self):
-        return f"Image for {self.product.name}"
\ No newline at end of file
+        return f"Image for {self.product.name}"
+
+
+class RelatedProduct(models.Model):
+    """
+    Precomputed "customers also bought" neighbours of a product, rebuilt by
+    the build_related_products command (see products.recommendations).
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='related_links')
+    related = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='related_from')
+    score = models.FloatField()
+    rank = models.PositiveSmallIntegerField()
+    
+    class Meta:
+        ordering = ['product', 'rank']
+        unique_together = ('product', 'related')
+        indexes = [
+            models.Index(fields=['product', 'rank'], name='relatedproduct_rank_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.product.name} -> {self.related.name} ({self.score:.3f})"
+
+
+class SearchQuery(models.Model):
+    """
+    How often a normalised search string was run from the catalog; the most
+    frequent ones are offered as autocomplete suggestions.
+    """
+    query = models.CharField(max_length=100, unique=True)
+    count = models.PositiveIntegerField(default=0)
+    last_searched_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        verbose_name_plural = 'Search queries'
+        ordering = ['-count']
+    
+    def __str__(self):
+        return f"{self.query} ({self.count})"
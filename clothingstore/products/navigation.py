@@ -0,0 +1,51 @@
+# products/navigation.py
+"""
+Process-wide cache of the active categories used by the site navigation,
+the catalog sidebar and the home page.
+
+Each worker process keeps its own copy and a generation number. The current
+generation lives in the shared cache; a category change increments it, and
+every process reloads on its next read once it sees a newer number. Reading
+the categories therefore costs one cache lookup and no database query.
+"""
+import threading
+
+from django.db import transaction
+
+from .caching import bump_generation, current_generation
+
+CATEGORY_GENERATION_KEY = 'products:categories:generation'
+
+
+class CategoryCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.generation = None
+        self.categories = ()
+
+    def get(self):
+        """Active categories in display order, as a tuple shared by all callers."""
+        generation = current_generation(CATEGORY_GENERATION_KEY)
+        if generation != self.generation:
+            with self._lock:
+                if generation != self.generation:
+                    from .models import Category
+
+                    self.categories = tuple(Category.objects.filter(is_active=True))
+                    self.generation = generation
+        return self.categories
+
+    def invalidate(self):
+        """Make every process, this one included, reload on its next read."""
+        bump_generation(CATEGORY_GENERATION_KEY)
+
+
+category_cache = CategoryCache()
+
+
+def active_categories():
+    return category_cache.get()
+
+
+def categories_changed():
+    transaction.on_commit(category_cache.invalidate)
@@ -0,0 +1,155 @@
+# products/pagination.py
+"""
+Keyset (cursor) pagination for the storefront catalog.
+
+Instead of ``OFFSET n`` each page continues from the sort key of the last row
+of the previous page, so every page is an index range scan and no COUNT(*) is
+needed. Cursors are signed so clients cannot forge arbitrary WHERE clauses.
+"""
+from django.core import signing
+from django.db.models import Q
+
+CURSOR_SALT = 'products.pagination.cursor'
+
+# Storefront sort options and the unique keyset ordering behind each one
+SORT_ORDERINGS = {
+    '-created_at': ('-created_at', 'id'),
+    'price': ('effective_price', 'id'),
+    '-price': ('-effective_price', '-id'),
+    'name': ('name', 'id'),
+    '-name': ('-name', '-id'),
+}
+
+
+class CursorPage:
+    """A page of results plus the cursors needed to move either way."""
+
+    def __init__(self, object_list, has_next, has_previous, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.has_next_page = has_next
+        self.has_previous_page = has_previous
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+    def has_next(self):
+        return self.has_next_page
+
+    def has_previous(self):
+        return self.has_previous_page
+
+    def has_other_pages(self):
+        return self.has_next_page or self.has_previous_page
+
+
+class KeysetPaginator:
+    def __init__(self, queryset, ordering, per_page):
+        self.queryset = queryset
+        self.ordering = tuple(ordering)
+        self.per_page = per_page
+        self.fields = [
+            (name.lstrip('-'), name.startswith('-')) for name in self.ordering
+        ]
+
+    def encode_cursor(self, obj, direction):
+        values = [self._serialize(getattr(obj, name)) for name, _ in self.fields]
+        payload = {'o': list(self.ordering), 'v': values, 'd': direction}
+        return signing.dumps(payload, salt=CURSOR_SALT, compress=True)
+
+    def decode_cursor(self, cursor):
+        """Return (values, direction), or None if the cursor is invalid or stale."""
+        try:
+            payload = signing.loads(cursor, salt=CURSOR_SALT)
+        except signing.BadSignature:
+            return None
+        if tuple(payload.get('o', ())) != self.ordering or payload.get('d') not in ('next', 'prev'):
+            return None
+        values = payload.get('v', [])
+        if len(values) != len(self.fields):
+            return None
+        model = self.queryset.model
+        try:
+            values = [
+                model._meta.get_field(name).to_python(value)
+                for (name, _), value in zip(self.fields, values)
+            ]
+        except Exception:
+            return None
+        return values, payload['d']
+
+    def get_page(self, cursor=None):
+        decoded = self.decode_cursor(cursor) if cursor else None
+        if decoded is None:
+            return self._page_after(None)
+        values, direction = decoded
+        if direction == 'prev':
+            return self._page_before(values)
+        return self._page_after(values)
+
+    def _page_after(self, values):
+        queryset = self.queryset.order_by(*self.ordering)
+        if values is not None:
+            queryset = queryset.filter(self._seek(values, reverse=False))
+        rows = list(queryset[:self.per_page + 1])
+        has_next = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        return self._build_page(rows, has_next=has_next, has_previous=values is not None)
+
+    def _page_before(self, values):
+        reversed_ordering = [self._flip(name) for name in self.ordering]
+        queryset = self.queryset.order_by(*reversed_ordering).filter(self._seek(values, reverse=True))
+        rows = list(queryset[:self.per_page + 1])
+        has_previous = len(rows) > self.per_page
+        rows = list(reversed(rows[:self.per_page]))
+        return self._build_page(rows, has_next=True, has_previous=has_previous)
+
+    def _build_page(self, rows, has_next, has_previous):
+        next_cursor = self.encode_cursor(rows[-1], 'next') if rows and has_next else None
+        previous_cursor = self.encode_cursor(rows[0], 'prev') if rows and has_previous else None
+        return CursorPage(rows, has_next, has_previous, next_cursor, previous_cursor)
+
+    def _seek(self, values, reverse):
+        """
+        Build the row-value comparison ``(a, b) > (x, y)`` as
+        ``a > x OR (a = x AND b > y)`` honouring per-column direction.
+        """
+        condition = Q()
+        equal_so_far = Q()
+        for (name, descending), value in zip(self.fields, values):
+            lookup = f'{name}__lt' if descending != reverse else f'{name}__gt'
+            condition |= equal_so_far & Q(**{lookup: value})
+            equal_so_far &= Q(**{name: value})
+        return condition
+
+    @staticmethod
+    def _flip(name):
+        return name[1:] if name.startswith('-') else f'-{name}'
+
+    @staticmethod
+    def _serialize(value):
+        if hasattr(value, 'isoformat'):
+            return value.isoformat()
+        if isinstance(value, (int, str)):
+            return value
+        return str(value)
+
+
+def cursor_url(request, cursor):
+    """Current query string with ``cursor`` swapped in and page numbers dropped."""
+    params = request.GET.copy()
+    params.pop('page', None)
+    params.pop('cursor', None)
+    if cursor:
+        params['cursor'] = cursor
+    return f'?{params.urlencode()}'
@@ -0,0 +1,167 @@
+# products/recommendations.py
+"""
+"Customers also bought" recommendations for the product page.
+
+Every customer is a row of a sparse customer x product matrix holding a
+weight for each product they ordered or wishlisted. Two products are similar
+when the same customers picked both: the cosine similarity of their columns.
+The top neighbours of every product are stored in RelatedProduct, so the
+product page only reads a handful of precomputed rows.
+
+The scoring is vectorised with SciPy sparse matrices and NumPy (see
+requirements.txt); without them it falls back to counting pairs in plain
+Python, which gives the same scores but is far slower on a real catalog.
+"""
+import heapq
+import math
+from collections import defaultdict
+
+from django.db import transaction
+
+from .caching import bump_page_generation
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # pragma: no cover - optional dependency
+    np = sparse = None
+
+DEFAULT_TOP_K = 12
+# Scores are rounded so float noise does not reorder ties between engines
+SCORE_DIGITS = 9
+PURCHASE_WEIGHT = 1.0
+WISHLIST_WEIGHT = 0.5
+
+
+def load_interactions(purchase_weight=PURCHASE_WEIGHT, wishlist_weight=WISHLIST_WEIGHT):
+    """
+    Return ``{(user_id, product_id): weight}``. Buying a product several
+    times counts once; a product both bought and wishlisted gets both weights.
+    """
+    from orders.models import OrderItem
+    from wishlist.models import Wishlist
+
+    weights = defaultdict(float)
+    purchases = (
+        OrderItem.objects.exclude(order__status='cancelled')
+        .values_list('order__user_id', 'product_id')
+        .distinct()
+    )
+    for user_id, product_id in purchases.iterator(chunk_size=5000):
+        weights[(user_id, product_id)] += purchase_weight
+    for user_id, product_id in Wishlist.objects.values_list('user_id', 'product_id').iterator(chunk_size=5000):
+        weights[(user_id, product_id)] += wishlist_weight
+    return weights
+
+
+def _top_neighbours_sparse(weights, top_k):
+    users = {}
+    products = {}
+    rows, cols, data = [], [], []
+    for (user_id, product_id), weight in weights.items():
+        rows.append(users.setdefault(user_id, len(users)))
+        cols.append(products.setdefault(product_id, len(products)))
+        data.append(weight)
+    product_ids = np.array(list(products), dtype=np.int64)
+
+    matrix = sparse.csr_matrix(
+        (np.array(data, dtype=np.float64), (rows, cols)), shape=(len(users), len(products))
+    )
+    co_occurrence = (matrix.T @ matrix).tocsr()
+    norms = np.sqrt(co_occurrence.diagonal())
+    inverse = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+    scaling = sparse.diags(inverse)
+    similarity = (scaling @ co_occurrence @ scaling).tocsr()
+    similarity.setdiag(0)
+    similarity.eliminate_zeros()
+
+    for index in range(similarity.shape[0]):
+        start, end = similarity.indptr[index], similarity.indptr[index + 1]
+        if start == end:
+            continue
+        scores = np.round(similarity.data[start:end], SCORE_DIGITS)
+        neighbours = similarity.indices[start:end]
+        # Best score first, ties by product id, so both engines agree
+        order = np.lexsort((product_ids[neighbours], -scores))[:top_k]
+        yield (
+            int(product_ids[index]),
+            [(int(product_ids[n]), float(s)) for n, s in zip(neighbours[order], scores[order])],
+        )
+
+
+def _top_neighbours_python(weights, top_k):
+    baskets = defaultdict(dict)
+    for (user_id, product_id), weight in weights.items():
+        baskets[user_id][product_id] = weight
+
+    squares = defaultdict(float)
+    co_occurrence = defaultdict(lambda: defaultdict(float))
+    for basket in baskets.values():
+        items = list(basket.items())
+        for product_id, weight in items:
+            squares[product_id] += weight * weight
+        for i, (first, first_weight) in enumerate(items):
+            for second, second_weight in items[i + 1:]:
+                co_occurrence[first][second] += first_weight * second_weight
+                co_occurrence[second][first] += first_weight * second_weight
+
+    for product_id, neighbours in co_occurrence.items():
+        norm = math.sqrt(squares[product_id])
+        scored = (
+            (other, round(value / (norm * math.sqrt(squares[other])), SCORE_DIGITS))
+            for other, value in neighbours.items()
+        )
+        yield product_id, heapq.nsmallest(top_k, scored, key=lambda pair: (-pair[1], pair[0]))
+
+
+def top_neighbours(weights, top_k=DEFAULT_TOP_K):
+    """Yield ``(product_id, [(related_id, score), ...])``, best first."""
+    if not weights:
+        return iter(())
+    if sparse is not None:
+        return _top_neighbours_sparse(weights, top_k)
+    return _top_neighbours_python(weights, top_k)
+
+
+def build_related_products(top_k=DEFAULT_TOP_K, purchase_weight=PURCHASE_WEIGHT, wishlist_weight=WISHLIST_WEIGHT):
+    """Recompute the whole RelatedProduct table. Returns the number of rows written."""
+    from .models import Product, RelatedProduct
+
+    weights = load_interactions(purchase_weight, wishlist_weight)
+    active = set(Product.objects.filter(is_active=True).values_list('id', flat=True))
+    rows = []
+    for product_id, neighbours in top_neighbours(weights, top_k):
+        if product_id not in active:
+            continue
+        rank = 0
+        for related_id, score in neighbours:
+            if related_id in active:
+                rows.append(RelatedProduct(product_id=product_id, related_id=related_id, score=score, rank=rank))
+                rank += 1
+
+    with transaction.atomic():
+        RelatedProduct.objects.all().delete()
+        RelatedProduct.objects.bulk_create(rows, batch_size=1000)
+    # Cached product pages show the old neighbours
+    bump_page_generation()
+    return len(rows)
+
+
+def related_products_for(product, limit=4):
+    """
+    Precomputed neighbours of ``product``, topped up with other products from
+    its category when there are fewer than ``limit`` of them.
+    """
+    from .models import Product
+
+    related = list(
+        Product.objects.filter(related_from__product=product, is_active=True)
+        .order_by('related_from__rank')[:limit]
+    )
+    if len(related) < limit:
+        exclude = [product.pk, *(item.pk for item in related)]
+        related += list(
+            Product.objects.filter(category_id=product.category_id, is_active=True)
+            .exclude(id__in=exclude)[:limit - len(related)]
+        )
+    return related
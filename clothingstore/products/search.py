@@ -0,0 +1,251 @@
+# products/search.py
+"""
+Full-text product search.
+
+The index lives outside the Product table so it can use whatever the database
+does best: an FTS5 virtual table on SQLite and a tsvector table with a GIN
+index on PostgreSQL. Both are keyed by product id and hold the product name,
+description and category name. Views only ever call ``search_products``.
+"""
+import re
+from abc import ABC, abstractmethod
+
+from django.db import connection
+from django.db.models import Q
+
+SQLITE_TABLE = 'products_product_fts'
+POSTGRES_TABLE = 'products_product_search'
+
+# Column weights: name matches count most, then category, then description
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+CATEGORY_WEIGHT = 5.0
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+_SOURCE_SQL = '''
+    SELECT p.id, p.name, p.description, c.name
+    FROM products_product p
+    INNER JOIN products_category c ON c.id = p.category_id
+'''
+
+
+def tokenize(query):
+    """Split a raw search string into safe lowercase terms."""
+    return [token.lower() for token in _TOKEN_RE.findall(query or '')]
+
+
+class BaseSearchBackend(ABC):
+    """Interface shared by the database specific backends."""
+
+    @abstractmethod
+    def create(self, cursor):
+        pass
+
+    @abstractmethod
+    def drop(self, cursor):
+        pass
+
+    @abstractmethod
+    def index_products(self, product_ids):
+        pass
+
+    @abstractmethod
+    def remove_products(self, product_ids):
+        pass
+
+    @abstractmethod
+    def rebuild(self):
+        pass
+
+    @abstractmethod
+    def filter(self, queryset, terms):
+        pass
+
+
+class SQLiteSearchBackend(BaseSearchBackend):
+    def create(self, cursor):
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {SQLITE_TABLE} USING fts5("
+            "name, description, category_name, "
+            "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+
+    def drop(self, cursor):
+        cursor.execute(f'DROP TABLE IF EXISTS {SQLITE_TABLE}')
+
+    def index_products(self, product_ids):
+        product_ids = list(product_ids)
+        if not product_ids:
+            return
+        placeholders = ', '.join(['%s'] * len(product_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SQLITE_TABLE} WHERE rowid IN ({placeholders})', product_ids)
+            cursor.execute(
+                f'INSERT INTO {SQLITE_TABLE} (rowid, name, description, category_name) '
+                f'{_SOURCE_SQL} WHERE p.id IN ({placeholders})',
+                product_ids,
+            )
+
+    def remove_products(self, product_ids):
+        product_ids = list(product_ids)
+        if not product_ids:
+            return
+        placeholders = ', '.join(['%s'] * len(product_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SQLITE_TABLE} WHERE rowid IN ({placeholders})', product_ids)
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SQLITE_TABLE}')
+            cursor.execute(
+                f'INSERT INTO {SQLITE_TABLE} (rowid, name, description, category_name) {_SOURCE_SQL}'
+            )
+            cursor.execute(f"INSERT INTO {SQLITE_TABLE} ({SQLITE_TABLE}) VALUES ('optimize')")
+
+    def filter(self, queryset, terms):
+        # Every term is a prefix match so partially typed words still hit
+        match = ' '.join(f'"{term}"*' for term in terms)
+        # bm25() is lower-is-better; negate it so higher rank means more relevant
+        rank = f'-bm25({SQLITE_TABLE}, {NAME_WEIGHT}, {DESCRIPTION_WEIGHT}, {CATEGORY_WEIGHT})'
+        return queryset.extra(
+            select={'search_rank': rank},
+            tables=[SQLITE_TABLE],
+            where=[
+                f'{SQLITE_TABLE}.rowid = products_product.id',
+                f'{SQLITE_TABLE} MATCH %s',
+            ],
+            params=[match],
+        )
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    config = 'english'
+
+    def _document_sql(self, name, description, category_name):
+        return (
+            f"setweight(to_tsvector('{self.config}', coalesce({name}, '')), 'A') || "
+            f"setweight(to_tsvector('{self.config}', coalesce({category_name}, '')), 'B') || "
+            f"setweight(to_tsvector('{self.config}', coalesce({description}, '')), 'D')"
+        )
+
+    def create(self, cursor):
+        cursor.execute(
+            f'CREATE TABLE IF NOT EXISTS {POSTGRES_TABLE} ('
+            'product_id bigint PRIMARY KEY REFERENCES products_product (id) '
+            'ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, '
+            'document tsvector NOT NULL)'
+        )
+        cursor.execute(
+            f'CREATE INDEX IF NOT EXISTS {POSTGRES_TABLE}_document_gin '
+            f'ON {POSTGRES_TABLE} USING GIN (document)'
+        )
+
+    def drop(self, cursor):
+        cursor.execute(f'DROP TABLE IF EXISTS {POSTGRES_TABLE}')
+
+    def _upsert_sql(self, where=''):
+        document = self._document_sql('p.name', 'p.description', 'c.name')
+        return (
+            f'INSERT INTO {POSTGRES_TABLE} (product_id, document) '
+            f'SELECT p.id, {document} FROM products_product p '
+            f'INNER JOIN products_category c ON c.id = p.category_id {where} '
+            'ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document'
+        )
+
+    def index_products(self, product_ids):
+        product_ids = list(product_ids)
+        if not product_ids:
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(self._upsert_sql('WHERE p.id = ANY(%s)'), [product_ids])
+
+    def remove_products(self, product_ids):
+        product_ids = list(product_ids)
+        if not product_ids:
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {POSTGRES_TABLE} WHERE product_id = ANY(%s)', [product_ids])
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'TRUNCATE {POSTGRES_TABLE}')
+            cursor.execute(self._upsert_sql())
+
+    def filter(self, queryset, terms):
+        tsquery = ' & '.join(f'{term}:*' for term in terms)
+        query_sql = f"to_tsquery('{self.config}', %s)"
+        return queryset.extra(
+            select={'search_rank': f'ts_rank({POSTGRES_TABLE}.document, {query_sql})'},
+            select_params=[tsquery],
+            tables=[POSTGRES_TABLE],
+            where=[
+                f'{POSTGRES_TABLE}.product_id = products_product.id',
+                f'{POSTGRES_TABLE}.document @@ {query_sql}',
+            ],
+            params=[tsquery],
+        )
+
+
+class FallbackSearchBackend(BaseSearchBackend):
+    """Plain LIKE matching for databases without a native full-text index."""
+
+    def create(self, cursor):
+        pass
+
+    def drop(self, cursor):
+        pass
+
+    def index_products(self, product_ids):
+        pass
+
+    def remove_products(self, product_ids):
+        pass
+
+    def rebuild(self):
+        pass
+
+    def filter(self, queryset, terms):
+        for term in terms:
+            queryset = queryset.filter(
+                Q(name__icontains=term) |
+                Q(description__icontains=term) |
+                Q(category__name__icontains=term)
+            )
+        return queryset.extra(select={'search_rank': '0'})
+
+
+_BACKENDS = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+def get_backend(vendor=None):
+    return _BACKENDS.get(vendor or connection.vendor, FallbackSearchBackend)()
+
+
+def search_products(queryset, query):
+    """
+    Restrict a Product queryset to matches for ``query``.
+
+    The result is annotated with ``search_rank`` (higher is more relevant) so
+    callers can order by relevance with ``order_by('-search_rank')``. An empty
+    query returns the queryset unchanged.
+    """
+    terms = tokenize(query)
+    if not terms:
+        return queryset
+    return get_backend().filter(queryset, terms)
+
+
+def index_products(product_ids):
+    get_backend().index_products(product_ids)
+
+
+def remove_products(product_ids):
+    get_backend().remove_products(product_ids)
+
+
+def rebuild_index():
+    get_backend().rebuild()
@@ -0,0 +1,114 @@
+# products/signals.py
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from core.images import derivatives_ready
+
+from . import autocomplete, search, stock
+from .caching import bump_card_generation, bump_page_generation, catalog_changed
+from .facets import facets_invalidated, products_changed
+from .navigation import categories_changed
+from .models import Category, Color, Product, ProductImage, ProductSize, Size
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Keep colours, the search index row and facet bits for a product in step with it."""
+    if raw:
+        return
+    if update_fields is None or 'available_colors' in update_fields:
+        instance.sync_colors()
+    search.index_products([instance.pk])
+    products_changed([instance.pk])
+    catalog_changed([instance.pk])
+    if update_fields is None or autocomplete.PRODUCT_FIELDS.intersection(update_fields):
+        autocomplete.products_changed([instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    search.remove_products([instance.pk])
+    products_changed([instance.pk])
+    catalog_changed([instance.pk])
+    autocomplete.products_changed([instance.pk])
+
+
+@receiver(post_save, sender=Category)
+def reindex_category_products(sender, instance, created=False, raw=False, **kwargs):
+    """The category name is part of every product document in that category."""
+    if raw:
+        return
+    # Category names show on cards and in the navigation of every page
+    catalog_changed()
+    categories_changed()
+    autocomplete.autocomplete_invalidated()
+    if created:
+        return
+    search.index_products(instance.products.values_list('id', flat=True))
+    facets_invalidated()
+
+
+@receiver(post_save, sender=ProductSize)
+@receiver(post_delete, sender=ProductSize)
+def product_size_changed(sender, instance, raw=False, **kwargs):
+    """Stock per size decides which size facets a product shows up under."""
+    if raw:
+        return
+    products_changed([instance.product_id])
+    catalog_changed([instance.product_id])
+
+
+@receiver(post_delete, sender=ProductSize)
+def product_size_deleted(sender, instance, **kwargs):
+    """
+    Deleted size rows leave Product.stock. Sent inside the delete's
+    transaction for every row, whether deleted one by one, through
+    ProductSize.objects or by a cascade.
+    """
+    stock.add_stock({instance.product_id: -instance.quantity})
+
+
+@receiver(post_save, sender=Size)
+@receiver(post_delete, sender=Size)
+@receiver(post_save, sender=Color)
+@receiver(post_delete, sender=Color)
+def size_or_color_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    facets_invalidated()
+    catalog_changed()
+
+
+@receiver(post_delete, sender=Category)
+def category_deleted(sender, instance, **kwargs):
+    catalog_changed()
+    categories_changed()
+    autocomplete.autocomplete_invalidated()
+
+
+@receiver(post_save, sender='orders.OrderItem')
+def order_item_saved(sender, instance, created=False, raw=False, **kwargs):
+    """Autocomplete ranks suggestions by units sold."""
+    if raw or not created:
+        return
+    autocomplete.sale_recorded(instance.product_id, instance.quantity)
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def product_image_changed(sender, instance, raw=False, **kwargs):
+    """Keep Product.primary_image_file/secondary_image_file in step with its images."""
+    if raw:
+        return
+    Product(pk=instance.product_id).refresh_image_cache()
+
+
+@receiver(derivatives_ready)
+def product_image_resized(sender, names, **kwargs):
+    """
+    Cached cards and pages were rendered without a srcset for these images.
+    Runs on the image pool's callback thread, so it stays off the database.
+    """
+    if any(name.startswith('products/') for name in names):
+        bump_card_generation()
+        bump_page_generation()
@@ -0,0 +1,104 @@
+# products/stock.py
+"""
+``Product.stock`` as a maintained aggregate.
+
+For a product with ProductSize rows, ``stock`` is the sum of their
+quantities. Rather than summing on every read, each change to a size row
+applies its difference to the product in the same transaction:
+
+* ``ProductSize.save()`` adds ``new - old`` (the first row of a product
+  replaces the hand-entered figure instead),
+* deleting size rows, also through cascades, subtracts their quantities
+  (``product_size_deleted`` in products/signals.py),
+* bulk writes through ``ProductSize.objects`` (``update``, ``bulk_create``,
+  ``bulk_update``) recount the products they touched with one UPDATE,
+* checkout reservations (orders/inventory.py) pass their deltas to
+  ``add_stock`` directly.
+
+``Product.save()`` never writes ``stock`` for a product with sizes, so a
+product form or admin page loaded before a checkout cannot put back the
+total it was showing. Products without sizes keep a stock figure that is
+set by hand. Anything that writes size quantities around these paths (raw
+SQL, fixtures) leaves drift behind; the reconcile_stock command finds and
+repairs it in bulk.
+
+Every change marks the stock version (products.caching.stock_changed), so
+API responses showing quantities are revalidated.
+"""
+from django.db import models
+from django.db.models import Exists, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce, Greatest
+
+from .caching import stock_changed
+
+
+def size_total():
+    """Subquery expression: the summed size quantities of the outer product."""
+    from .models import ProductSize
+
+    totals = (
+        ProductSize.objects.filter(product=OuterRef('pk'))
+        .order_by()
+        .values('product')
+        .annotate(total=Sum('quantity'))
+        .values('total')
+    )
+    return Coalesce(Subquery(totals, output_field=models.PositiveIntegerField()), 0)
+
+
+def _sized_products(product_ids=None):
+    from .models import Product, ProductSize
+
+    products = Product.objects.filter(Exists(ProductSize.objects.filter(product=OuterRef('pk'))))
+    if product_ids is not None:
+        products = products.filter(pk__in=product_ids)
+    return products
+
+
+def add_stock(deltas):
+    """
+    Apply ``{product_id: delta}`` to Product.stock, one UPDATE per distinct
+    delta. Callers lock products in id order, so this does too.
+    """
+    from .models import Product
+
+    by_delta = {}
+    for product_id in sorted(deltas):
+        if deltas[product_id]:
+            by_delta.setdefault(deltas[product_id], []).append(product_id)
+    if by_delta:
+        stock_changed()
+    for delta, product_ids in by_delta.items():
+        # Plain QuerySet.update: the size row change that caused this has
+        # already refreshed caches where it needed to. Never below zero,
+        # even if the column had drifted; reconcile_stock puts it right
+        models.QuerySet.update(
+            Product.objects.filter(pk__in=product_ids),
+            stock=Greatest(F('stock') + delta, 0),
+        )
+
+
+def replace_stock(product_id, quantity):
+    """The first size row of a product: its quantity becomes the whole stock."""
+    from .models import Product
+
+    models.QuerySet.update(Product.objects.filter(pk=product_id), stock=quantity)
+    stock_changed()
+
+
+def recount(product_ids=None):
+    """Set stock to the size total of the given (default: all) sized products."""
+    rows = models.QuerySet.update(_sized_products(product_ids), stock=size_total())
+    if rows:
+        stock_changed()
+    return rows
+
+
+def drifted(product_ids=None):
+    """Sized products whose stock differs from their size total, annotated with ``size_stock``."""
+    return (
+        _sized_products(product_ids)
+        .annotate(size_stock=size_total())
+        .exclude(stock=F('size_stock'))
+        .order_by('id')
+    )
@@ -0,0 +1,192 @@
+# products/stock_sync.py
+"""
+Bulk stock updates from the warehouse.
+
+A batch is a list of records, each naming a product by ``slug`` or ``id``,
+optionally a ``size`` (Size.name), and either an absolute ``quantity`` or a
+``delta``::
+
+    {"slug": "linen-shirt", "size": "M", "quantity": 12}
+    {"id": 42, "delta": -3}
+
+The whole batch is resolved with one query, then applied in one
+transaction: the stock rows involved are locked, the records are applied
+in order in memory (so several records for one row compose), and the
+results are written with one ``bulk_update`` per table. Size rows a
+product does not have yet are created. Product totals follow the size rows
+as usual (see products.stock).
+
+Records that cannot be applied (unknown product or size, a delta taking
+stock below zero, a product-level record for a product with sizes or
+gaining its first ones in the batch) are reported and skipped; the rest of the batch still goes through.
+"""
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .caching import catalog_changed
+from .facets import products_changed
+from .models import Product, ProductSize, Size
+
+MAX_RECORDS = 10000
+
+
+class StockRecordError(ValueError):
+    pass
+
+
+def _integer(record, name):
+    value = record[name]
+    if isinstance(value, bool):
+        raise StockRecordError(f'{name} is not a whole number: {value!r}')
+    try:
+        number = int(str(value).strip())
+    except ValueError:
+        raise StockRecordError(f'{name} is not a whole number: {value!r}')
+    if name == 'quantity' and number < 0:
+        raise StockRecordError(f'quantity is negative: {value!r}')
+    return number
+
+
+def parse_record(record):
+    """Return ``(product key, size, quantity, delta)`` for one record, or raise StockRecordError."""
+    if not isinstance(record, dict):
+        raise StockRecordError('Not an object')
+    if record.get('slug'):
+        key = ('slug', str(record['slug']).strip())
+    elif record.get('id') not in (None, ''):
+        key = ('id', _integer(record, 'id'))
+    else:
+        raise StockRecordError('slug or id is required')
+    if ('quantity' in record) == ('delta' in record):
+        raise StockRecordError('Give either quantity or delta')
+    quantity = _integer(record, 'quantity') if 'quantity' in record else None
+    delta = _integer(record, 'delta') if 'delta' in record else None
+    return key, str(record.get('size') or '').strip(), quantity, delta
+
+
+class StockSync:
+    def __init__(self, records):
+        self.records = list(records)
+        self.results = [None] * len(self.records)
+        # ProductSize id -> product id
+        self.size_products = {}
+
+    def error(self, index, message):
+        self.results[index] = {'error': message}
+
+    def _resolve(self, parsed):
+        """Map each parsed record to a product, and to its size row where there is one, in one query."""
+        slugs = {value for (kind, value), *_ in parsed.values() if kind == 'slug'}
+        ids = {value for (kind, value), *_ in parsed.values() if kind == 'id'}
+        products, sizes = {}, {}
+        rows = Product.objects.filter(Q(slug__in=slugs) | Q(pk__in=ids)).values_list(
+            'id', 'slug', 'productsizes__id', 'productsizes__size__name'
+        )
+        for product_id, slug, product_size_id, size in rows:
+            products[('id', product_id)] = products[('slug', slug)] = product_id
+            sizes.setdefault(product_id, {})
+            if product_size_id is not None:
+                sizes[product_id][size] = product_size_id
+                self.size_products[product_size_id] = product_id
+        return products, sizes
+
+    def run(self):
+        parsed = {}
+        for index, record in enumerate(self.records):
+            try:
+                parsed[index] = parse_record(record)
+            except StockRecordError as exc:
+                self.error(index, str(exc))
+        products, sizes = self._resolve(parsed)
+
+        # index -> ('size', ProductSize id) | ('new', (product id, size)) | ('product', product id)
+        targets = {}
+        new_sizes = set()
+        for index, (key, size, quantity, delta) in parsed.items():
+            product_id = products.get(key)
+            if product_id is None:
+                self.error(index, f'No product with {key[0]} {key[1]!r}')
+            elif size:
+                product_size_id = sizes[product_id].get(size)
+                if product_size_id is not None:
+                    targets[index] = ('size', product_size_id)
+                else:
+                    targets[index] = ('new', (product_id, size))
+                    new_sizes.add(size)
+            elif sizes[product_id]:
+                self.error(index, 'The product has sizes; give a size')
+            else:
+                targets[index] = ('product', product_id)
+        size_ids = dict(Size.objects.filter(name__in=new_sizes).values_list('name', 'id')) if new_sizes else {}
+        for index, (kind, target) in list(targets.items()):
+            if kind == 'new' and target[1] not in size_ids:
+                self.error(index, f'No size {target[1]!r}')
+                del targets[index]
+        # A product's first size rows replace its hand-set stock figure, so
+        # product-level records for it cannot apply alongside them
+        gaining_sizes = {target[0] for kind, target in targets.values() if kind == 'new'}
+        for index, (kind, target) in list(targets.items()):
+            if kind == 'product' and target in gaining_sizes:
+                self.error(index, 'The product gets sizes in this batch; give a size')
+                del targets[index]
+
+        with transaction.atomic():
+            # Lock in the same order as checkout: size rows, then products
+            levels = {('size', pk): quantity for pk, quantity in ProductSize.objects.select_for_update().filter(
+                pk__in={target for kind, target in targets.values() if kind == 'size'}
+            ).order_by('pk').values_list('pk', 'quantity')}
+            levels.update({('product', pk): stock for pk, stock in Product.objects.select_for_update().filter(
+                pk__in={target for kind, target in targets.values() if kind == 'product'}
+            ).order_by('pk').values_list('pk', 'stock')})
+
+            changed = set()
+            for index in sorted(targets):
+                _, _, quantity, delta = parsed[index]
+                key = targets[index]
+                if key[0] != 'new' and key not in levels:
+                    self.error(index, 'The stock row was deleted meanwhile')
+                    continue
+                current = levels.get(key, 0)
+                level = quantity if quantity is not None else current + delta
+                if level < 0:
+                    self.error(index, f'Only {current} in stock')
+                    continue
+                levels[key] = level
+                changed.add(key)
+                self.results[index] = {'quantity': level}
+            self._write(levels, changed, size_ids)
+        return self.results
+
+    def _write(self, levels, changed, size_ids):
+        updated_sizes, created_sizes, updated_products = [], [], []
+        for kind, target in changed:
+            level = levels[(kind, target)]
+            if kind == 'size':
+                updated_sizes.append(ProductSize(pk=target, product_id=self.size_products[target], quantity=level))
+            elif kind == 'new':
+                product_id, size = target
+                created_sizes.append(ProductSize(product_id=product_id, size_id=size_ids[size], quantity=level))
+            else:
+                updated_products.append(Product(pk=target, stock=level, updated_at=timezone.now()))
+        if updated_products:
+            Product.objects.bulk_update(updated_products, ['stock', 'updated_at'], batch_size=1000)
+        # Through ProductSize.objects, so the product totals are recounted;
+        # after the products, so no product write can overwrite a recount
+        if updated_sizes:
+            ProductSize.objects.bulk_update(updated_sizes, ['quantity'], batch_size=1000)
+        if created_sizes:
+            ProductSize.objects.bulk_create(created_sizes, batch_size=1000)
+
+        product_ids = {row.product_id for row in updated_sizes + created_sizes}
+        product_ids.update(row.pk for row in updated_products)
+        if product_ids:
+            # Bulk writes send no signals; sold out and back in stock show
+            # on cards and in the size and colour facets
+            products_changed(product_ids)
+            catalog_changed(product_ids)
+
+
+def apply_stock_updates(records):
+    """Apply a batch of stock records; returns one ``{'quantity'}`` or ``{'error'}`` dict per record."""
+    return StockSync(records).run()
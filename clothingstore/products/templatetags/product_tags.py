@@ -0,0 +1,11 @@
+from django import template
+
+register = template.Library()
+
+@register.filter
+def facet_count(counts, value):
+    """Look up a facet count, e.g. {{ facets.price|facet_count:"25-50" }}"""
+    try:
+        return counts.get(value, 0)
+    except AttributeError:
+        return 0
@@ -0,0 +1,18 @@
+# products/testing.py
+"""Catalog rows for the apps' tests."""
+from decimal import Decimal
+
+from .models import Category, Product, Size
+
+
+def make_product(slug, price='100.00', **kwargs):
+    """An active product in the Tops category unless ``kwargs`` say otherwise."""
+    kwargs.setdefault('name', slug.title())
+    kwargs.setdefault('description', '-')
+    if 'category' not in kwargs:
+        kwargs['category'] = Category.objects.get_or_create(name='Tops', slug='tops')[0]
+    return Product.objects.create(slug=slug, price=Decimal(price), **kwargs)
+
+
+def size(name):
+    return Size.objects.get_or_create(name=name, defaults={'display_name': name})[0]
@@ -1,3 +1,600 @@
+from decimal import Decimal
+from unittest import mock, skipIf
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from orders.models import Order, OrderItem
+from wishlist.models import Wishlist
+
+from . import recommendations, search
+from .autocomplete import AUTOCOMPLETE_GENERATION_KEY, AutocompleteIndex, flush_search_counts, record_search
+from .caching import bump_generation, current_generation
+from .facets import FACET_VERSION_KEY, FacetIndex
+from .navigation import CategoryCache, active_categories
+from .catalog_import import CatalogImporter
+from .models import Category, Product, ProductImage, ProductSize, RelatedProduct, SearchQuery, Size
+from .stock_sync import apply_stock_updates
+from .testing import make_product, size
+
+
+class StockSyncTests(TestCase):
+    def setUp(self):
+        self.sized = make_product('shirt')
+        self.small = ProductSize.objects.create(product=self.sized, size=size('S'), quantity=4)
+        self.plain = make_product('cap', stock=3)
+
+    def levels(self, product):
+        product.refresh_from_db()
+        return product.stock, dict(product.productsizes.values_list('size__name', 'quantity'))
+
+    def test_records_for_one_row_compose(self):
+        results = apply_stock_updates([
+            {'slug': 'shirt', 'size': 'S', 'delta': 2},
+            {'id': self.sized.pk, 'size': 'S', 'delta': -1},
+            {'slug': 'cap', 'quantity': 7},
+        ])
+        self.assertEqual(results, [{'quantity': 6}, {'quantity': 5}, {'quantity': 7}])
+        self.assertEqual(self.levels(self.sized), (5, {'S': 5}))
+        self.assertEqual(self.levels(self.plain), (7, {}))
+
+    def test_invalid_records_are_skipped(self):
+        results = apply_stock_updates([
+            {'slug': 'shirt', 'size': 'S', 'delta': -9},
+            {'slug': 'shirt', 'quantity': 1},
+            {'slug': 'missing', 'quantity': 1},
+            {'slug': 'shirt', 'size': 'S', 'quantity': 1, 'delta': 1},
+            {'slug': 'cap', 'delta': 1},
+        ])
+        self.assertEqual([set(result) for result in results], [{'error'}] * 4 + [{'quantity'}])
+        self.assertEqual(self.levels(self.sized), (4, {'S': 4}))
+        self.assertEqual(self.levels(self.plain), (4, {}))
+
+    def test_new_size_rows_update_the_total(self):
+        results = apply_stock_updates([{'slug': 'shirt', 'size': 'M', 'quantity': 2}])
+        self.assertEqual(results, [{'quantity': 2}])
+        self.assertEqual(self.levels(self.sized), (6, {'S': 4, 'M': 2}))
+
+    def test_product_record_for_a_product_gaining_sizes_is_rejected(self):
+        results = apply_stock_updates([
+            {'id': self.plain.pk, 'delta': 5},
+            {'slug': 'cap', 'size': 'S', 'quantity': 2},
+        ])
+        self.assertIn('error', results[0])
+        self.assertEqual(results[1], {'quantity': 2})
+        self.assertEqual(self.levels(self.plain), (2, {'S': 2}))
+
+
+class StockAggregateTests(TestCase):
+    def setUp(self):
+        self.product = make_product('shirt', stock=10)
+
+    def stock(self):
+        self.product.refresh_from_db()
+        return self.product.stock
+
+    def test_size_rows_maintain_the_total(self):
+        small = ProductSize.objects.create(product=self.product, size=size('S'), quantity=4)
+        self.assertEqual(self.stock(), 4)
+        ProductSize.objects.create(product=self.product, size=size('M'), quantity=3)
+        self.assertEqual(self.stock(), 7)
+        small.quantity = 1
+        small.save()
+        self.assertEqual(self.stock(), 4)
+        ProductSize.objects.filter(product=self.product).update(quantity=2)
+        self.assertEqual(self.stock(), 4)
+        small.delete()
+        self.assertEqual(self.stock(), 2)
+
+    def test_stale_full_save_keeps_the_total(self):
+        small = ProductSize.objects.create(product=self.product, size=size('S'), quantity=4)
+        stale = Product.objects.get(pk=self.product.pk)
+        small.quantity = 9
+        small.save()
+        stale.name = 'Linen shirt'
+        stale.save()
+        self.assertEqual(stale.stock, 9)
+        self.assertEqual(self.stock(), 9)
+        self.assertEqual(self.product.name, 'Linen shirt')
+
+    def test_products_without_sizes_save_their_stock(self):
+        self.product.stock = 3
+        self.product.save()
+        self.assertEqual(self.stock(), 3)
+
+
+class ProductImageCacheTests(TestCase):
+    def setUp(self):
+        self.product = make_product('shirt')
+
+    def test_primary_image_is_the_stored_row(self):
+        self.assertIsNone(self.product.primary_image)
+        ProductImage.objects.create(product=self.product, image='products/a.jpg')
+        primary = ProductImage.objects.create(product=self.product, image='products/b.jpg', is_primary=True)
+        product = Product.objects.get(pk=self.product.pk)
+        self.assertEqual(product.primary_image.pk, primary.pk)
+        self.assertEqual(product.secondary_image_file.name, 'products/a.jpg')
+
+    def test_prefetched_images_pick_the_primary_without_a_query(self):
+        ProductImage.objects.create(product=self.product, image='products/a.jpg')
+        primary = ProductImage.objects.create(product=self.product, image='products/b.jpg', is_primary=True)
+        product = Product.objects.prefetch_related('images').get(pk=self.product.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(product.primary_image.pk, primary.pk)
+
+    def test_detail_page_reads_the_images_once(self):
+        cache.clear()
+        for name in ('a', 'b', 'c'):
+            ProductImage.objects.create(product=self.product, image=f'products/{name}.jpg', is_primary=name == 'b')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.product.get_absolute_url())
+        self.assertEqual(response.context['main_image'].image.name, 'products/b.jpg')
+        self.assertEqual([image.image.name for image in response.context['other_images']], ['products/a.jpg', 'products/c.jpg'])
+        image_queries = [query for query in queries if 'products_productimage' in query['sql']]
+        self.assertEqual(len(image_queries), 1)
+
+    def test_stale_full_save_keeps_the_image_copies(self):
+        stale = Product.objects.get(pk=self.product.pk)
+        ProductImage.objects.create(product=self.product, image='products/a.jpg')
+        stale.name = 'Linen shirt'
+        stale.save()
+        self.assertEqual(stale.primary_image_file.name, 'products/a.jpg')
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.name, self.product.primary_image_file.name), ('Linen shirt', 'products/a.jpg'))
+
+
+class ProductListTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        for n in range(13):
+            make_product(f'shirt-{n}')
+        self.url = reverse('products:list')
+
+    def test_load_more_renders_the_grid_cards(self):
+        next_url = self.client.get(self.url).context['next_url']
+        more = self.client.get(self.url + next_url, HTTP_HX_REQUEST='true')
+        self.assertTemplateUsed(more, 'products/partials/product_page.html')
+        self.assertTemplateUsed(more, 'products/partials/list_card.html')
+        self.assertTemplateNotUsed(more, 'products/partials/product_card.html')
+        self.assertIn('Shirt-0', more.content.decode())
+
+    def test_page_numbers_render_the_whole_page(self):
+        response = self.client.get(self.url, {'page': '2'}, HTTP_HX_REQUEST='true')
+        self.assertTemplateUsed(response, 'products/list.html')
+
+    def test_parameters_the_view_ignores_share_the_cached_page(self):
+        first = self.client.get(self.url, {'sort': 'price', 'ref': 'mail'})
+        again = self.client.get(self.url, {'sort': 'price', 'session': 'x1'})
+        self.assertEqual(first['ETag'], again['ETag'])
+        self.assertIsNone(again.context)
+        self.assertNotEqual(self.client.get(self.url, {'sort': '-price'})['ETag'], first['ETag'])
+
+
+class CatalogImportDryRunTests(TestCase):
+    BATCHES = [
+        [
+            (1, {'slug': 'shirt', 'name': 'Shirt', 'price': '10', 'category': 'Tops', 'sizes': {'S': 2}}),
+            (2, {'slug': 'cap', 'name': 'Cap', 'price': '5', 'category': 'Tops', 'images': ['products/cap.jpg']}),
+        ],
+        [
+            (3, {'slug': 'shirt', 'price': '12', 'sizes': {'S': 2, 'M': 1}}),
+            (4, {'slug': 'cap', 'images': ['products/cap.jpg', 'products/cap-2.jpg']}),
+        ],
+    ]
+
+    def setUp(self):
+        size('S'), size('M')
+
+    def totals(self, dry_run):
+        importer = CatalogImporter(dry_run=dry_run)
+        results = [importer.import_batch(batch) for batch in self.BATCHES]
+        return [
+            (result.created, result.updated, result.unchanged, result.sizes_written, result.images_added)
+            for result in results
+        ]
+
+    def test_dry_run_reports_what_the_import_writes(self):
+        planned = self.totals(dry_run=True)
+        self.assertFalse(Product.objects.exists())
+        self.assertEqual(planned, [(2, 0, 0, 1, 1), (0, 1, 1, 1, 1)])
+        self.assertEqual(self.totals(dry_run=False), planned)
+
+
+class CatalogValidatorTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.product = make_product('shirt')
+        self.url = reverse('api:catalog-product-detail', args=['shirt'])
+
+    def etag(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+
+    def assertRevalidates(self, etag, unchanged):
+        status = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code
+        self.assertEqual(status, 304 if unchanged else 200)
+
+    def test_unchanged_catalog_answers_304(self):
+        self.assertRevalidates(self.etag(), unchanged=True)
+
+    def test_category_queryset_update_changes_the_etag(self):
+        etag = self.etag()
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.filter(slug='tops').update(name='Shirts')
+        self.assertRevalidates(etag, unchanged=False)
+
+    def test_product_bulk_update_changes_the_etag(self):
+        etag = self.etag()
+        self.product.name = 'Shirt Deluxe'
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.bulk_update([self.product], ['name'])
+        self.assertRevalidates(etag, unchanged=False)
+
+    def test_product_bulk_create_changes_the_etag(self):
+        etag = self.etag()
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.bulk_create([
+                Product(name='Cap', slug='cap', description='Cap', price=Decimal('5.00'), category=self.product.category)
+            ])
+        self.assertRevalidates(etag, unchanged=False)
+
+
+class GenerationTests(TestCase):
+    KEY = 'products:tests:generation'
+
+    def setUp(self):
+        cache.clear()
+
+    def test_bumps_count_up_by_one(self):
+        seen = current_generation(self.KEY)
+        self.assertEqual(bump_generation(self.KEY), seen + 1)
+        self.assertEqual(current_generation(self.KEY), seen + 1)
+
+    def test_a_lost_counter_does_not_repeat_generations_seen_before(self):
+        seen = {current_generation(self.KEY), bump_generation(self.KEY)}
+        cache.delete(self.KEY)
+        self.assertNotIn(current_generation(self.KEY), seen)
+        cache.delete(self.KEY)
+        self.assertNotIn(bump_generation(self.KEY), seen)
+
+
+@mock.patch.object(AutocompleteIndex, 'start')
+class AutocompleteTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.product = make_product('shirt-dress')
+        self.index = AutocompleteIndex()
+
+    def labels(self, query):
+        return [suggestion['label'] for suggestion in self.index.suggest(query)]
+
+    def test_lookups_wait_for_the_background_build(self, start):
+        self.assertEqual(self.labels('dre'), [])
+        start.assert_called_once_with()
+        self.index.refresh()
+        self.assertEqual(self.labels('dre'), ['Shirt-Dress'])
+
+    def test_lookups_touch_neither_the_database_nor_the_cache(self, start):
+        self.index.refresh()
+        with self.assertNumQueries(0), mock.patch('products.autocomplete.current_generation') as generation:
+            self.assertEqual(self.labels('shi'), ['Shirt-Dress'])
+        generation.assert_not_called()
+
+    def test_refresh_rebuilds_after_a_change_elsewhere(self, start):
+        self.index.refresh()
+        Product.objects.filter(pk=self.product.pk).update(name='Linen Dress')
+        bump_generation(AUTOCOMPLETE_GENERATION_KEY)
+        self.index.refresh()
+        self.assertEqual(self.labels('lin'), ['Linen Dress'])
+        self.assertEqual(self.labels('shi'), [])
+
+
+class SearchCountTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        make_product('shirt')
+
+    def counts(self):
+        return dict(SearchQuery.objects.values_list('query', 'count'))
+
+    def test_searches_are_written_when_flushed(self):
+        url = reverse('products:list')
+        for _ in range(2):
+            # The second request is answered from the anonymous page cache
+            self.assertEqual(self.client.get(url, {'q': 'Shirt'}).status_code, 200)
+        self.client.get(url, {'q': 'shirt', 'page': '2'})
+        self.assertEqual(self.counts(), {})
+        self.assertEqual(flush_search_counts(), 1)
+        self.assertEqual(self.counts(), {'shirt': 2})
+
+    def test_counts_since_the_last_flush_are_added(self):
+        record_search('Linen  shirt')
+        flush_search_counts()
+        record_search('linen shirt')
+        record_search('cap')
+        self.assertEqual(flush_search_counts(), 2)
+        self.assertEqual(flush_search_counts(), 0)
+        self.assertEqual(self.counts(), {'linen shirt': 2, 'cap': 1})
+
+
+class RecommendationTests(TestCase):
+    # Two customers bought the shirt and the jeans; one also wishlisted the cap
+    WEIGHTS = {(1, 10): 1.0, (1, 20): 1.0, (2, 10): 1.0, (2, 20): 1.0, (2, 30): 0.5}
+    NEIGHBOURS = {
+        10: [(20, 1.0), (30, 0.707106781)],
+        20: [(10, 1.0), (30, 0.707106781)],
+        30: [(10, 0.707106781), (20, 0.707106781)],
+    }
+
+    def test_cosine_scores_best_first(self):
+        self.assertEqual(dict(recommendations._top_neighbours_python(self.WEIGHTS, 5)), self.NEIGHBOURS)
+        self.assertEqual(dict(recommendations._top_neighbours_python(self.WEIGHTS, 1))[30], [(10, 0.707106781)])
+
+    @skipIf(recommendations.sparse is None, 'SciPy is not installed')
+    def test_engines_agree(self):
+        self.assertEqual(dict(recommendations._top_neighbours_sparse(self.WEIGHTS, 5)), self.NEIGHBOURS)
+
+    def test_build_stores_active_neighbours_and_tops_up_from_the_category(self):
+        shirt, jeans, cap, hidden = (make_product(slug) for slug in ('shirt', 'jeans', 'cap', 'hidden'))
+        Product.objects.filter(pk=hidden.pk).update(is_active=False)
+        for number, username in enumerate(('ann', 'bob')):
+            user = User.objects.create_user(username)
+            order = Order.objects.create(
+                user=user, order_number=f'REC-{number}', total_amount=Decimal('200.00'), shipping_name='-',
+                shipping_email='test@example.com', shipping_phone='0', shipping_address='-', shipping_city='-',
+                shipping_state='-', shipping_zip_code='0', shipping_country='-',
+            )
+            for product in (shirt, jeans, hidden):
+                OrderItem.objects.create(order=order, product=product, quantity=1, price=Decimal('100.00'))
+        Wishlist.objects.create(user=user, product=cap)
+        make_product('belt')
+
+        self.assertEqual(recommendations.build_related_products(), 6)
+        links = RelatedProduct.objects.filter(product=shirt).values_list('related__slug', 'rank')
+        self.assertEqual(list(links), [('jeans', 0), ('cap', 1)])
+        self.assertFalse(RelatedProduct.objects.filter(related=hidden).exists())
+        self.assertEqual(
+            [product.slug for product in recommendations.related_products_for(shirt, limit=3)], ['jeans', 'cap', 'belt']
+        )
+
+
+class SearchBackendTests(TestCase):
+    def setUp(self):
+        self.shirt = make_product('linen-shirt', name='Linen Shirt', description='Breathable summer shirt')
+        self.cap = make_product('cap', name='Cap', description='Lined with linen')
+        self.dress = make_product('dress', name='Dress', description='Crème cotton')
+
+    def matches(self, query, queryset=None):
+        results = search.search_products(queryset or Product.objects.all(), query)
+        return list(results.order_by('-search_rank', 'id').values_list('slug', flat=True))
+
+    def test_name_matches_rank_first(self):
+        self.assertEqual(self.matches('linen'), ['linen-shirt', 'cap'])
+
+    def test_terms_are_prefixes_and_all_must_match(self):
+        self.assertEqual(self.matches('lin shi'), ['linen-shirt'])
+        self.assertEqual(self.matches('creme'), ['dress'])
+
+    def test_index_follows_product_and_category_changes(self):
+        self.cap.name = 'Sun hat'
+        self.cap.description = '-'
+        self.cap.save()
+        self.assertEqual(self.matches('linen'), ['linen-shirt'])
+        self.assertEqual(self.matches('hat'), ['cap'])
+        category = self.cap.category
+        category.name = 'Headwear'
+        category.save()
+        self.assertCountEqual(self.matches('headwear'), ['linen-shirt', 'cap', 'dress'])
+        self.cap.delete()
+        self.assertEqual(self.matches('hat'), [])
+
+    def test_fallback_backend_needs_every_term(self):
+        results = search.FallbackSearchBackend().filter(Product.objects.all(), ['linen', 'shirt'])
+        self.assertEqual([product.slug for product in results], ['linen-shirt'])
+
+    def test_an_empty_query_leaves_the_queryset_alone(self):
+        queryset = Product.objects.filter(is_active=True)
+        self.assertIs(search.search_products(queryset, ' -- '), queryset)
+
+
+class FacetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.bottoms = Category.objects.create(name='Bottoms', slug='bottoms')
+        self.shirt = make_product('shirt', available_colors=['black'])
+        for name in ('S', 'M'):
+            ProductSize.objects.create(product=self.shirt, size=size(name), quantity=2)
+        self.cap = make_product('cap', '30.00', stock=3, available_colors=['white'])
+        self.jeans = make_product('jeans', '60.00', category=self.bottoms, available_colors=['black'])
+        ProductSize.objects.create(product=self.jeans, size=size('M'), quantity=1)
+        self.index = FacetIndex()
+
+    def counts(self, base_ids=None, **selections):
+        counts = self.index.counts(selections, base_ids)
+        return {facet: {value: count for value, count in values.items() if count} for facet, values in counts.items()}
+
+    def test_counts_every_value(self):
+        self.assertEqual(self.counts(), {
+            'category': {'tops': 2, 'bottoms': 1},
+            'price': {'25-50': 1, '50-100': 2, '100+': 1},
+            'size': {'S': 1, 'M': 2},
+            'color': {'black': 2, 'white': 1},
+        })
+
+    def test_a_facet_ignores_its_own_selection(self):
+        counts = self.counts(category=['tops'], size=['M'])
+        self.assertEqual(counts['category'], {'tops': 1, 'bottoms': 1})
+        self.assertEqual(counts['size'], {'S': 1, 'M': 1})
+        self.assertEqual(counts['color'], {'black': 1})
+
+    def test_base_ids_restrict_the_counts(self):
+        self.assertEqual(self.counts(base_ids=[self.cap.pk])['category'], {'tops': 1})
+
+    def test_own_changes_are_patched_in_place(self):
+        self.index.counts({})
+        version = self.index.version
+        Product.objects.filter(pk=self.cap.pk).update(category=self.bottoms, price='120.00')
+        with mock.patch.object(self.index, 'rebuild') as rebuild:
+            self.index.refresh_products([self.cap.pk])
+            counts = self.counts()
+        rebuild.assert_not_called()
+        self.assertEqual(self.index.version, version + 1)
+        self.assertEqual(counts['category'], {'tops': 1, 'bottoms': 2})
+        self.assertEqual(counts['price'], {'50-100': 2, '100+': 2})
+
+    def test_a_change_elsewhere_rebuilds(self):
+        self.index.counts({})
+        ProductSize.objects.filter(product=self.shirt, size__name='S').update(quantity=0)
+        bump_generation(FACET_VERSION_KEY)
+        self.assertEqual(self.counts()['size'], {'M': 2})
+
+    def test_bulk_product_writes_refresh_the_facets(self):
+        with mock.patch('products.facets.facet_index.refresh_products') as refresh:
+            with self.captureOnCommitCallbacks(execute=True):
+                Product.objects.filter(pk=self.cap.pk).update(price='10.00')
+            refresh.assert_called_once_with([self.cap.pk])
+            self.jeans.price = Decimal('20.00')
+            with self.captureOnCommitCallbacks(execute=True):
+                Product.objects.bulk_update([self.jeans], ['price'])
+            refresh.assert_called_with([self.jeans.pk])
+
+
+class AvailableSizesTests(TestCase):
+    def setUp(self):
+        self.retired = size('XXS')
+        Size.objects.filter(pk=self.retired.pk).update(is_active=False)
+        for n in range(3):
+            product = make_product(f'shirt-{n}')
+            for name, quantity in (('M', 1), ('S', 2), ('L', 0), ('XXS', 5)):
+                ProductSize.objects.create(product=product, size=size(name), quantity=quantity)
+        self.expected = list(Size.objects.filter(name__in=['S', 'M']).order_by('order', 'name').values_list('name', flat=True))
+
+    def test_one_query_loads_the_sizes_of_every_product(self):
+        with self.assertNumQueries(2):
+            sizes = [product.available_sizes for product in Product.objects.with_available_sizes()]
+        self.assertEqual(sizes, [self.expected] * 3)
+
+    def test_without_the_prefetch_each_product_queries_the_same_sizes(self):
+        product = Product.objects.get(slug='shirt-0')
+        with self.assertNumQueries(1):
+            self.assertEqual(product.available_sizes, self.expected)
+            self.assertEqual(product.available_sizes, self.expected)
+
+    def test_the_list_page_reads_sizes_in_one_query(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('products:list'))
+        size_queries = [query for query in queries if query['sql'].startswith('SELECT "products_productsize"."id"')]
+        self.assertEqual(len(size_queries), 1)
+
+
+class SizeColorFilterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.shirt = make_product('shirt', available_colors=['black'])
+        ProductSize.objects.create(product=self.shirt, size=size('S'), quantity=2)
+        ProductSize.objects.create(product=self.shirt, size=size('M'), quantity=0)
+        self.cap = make_product('cap', available_colors=['Black'])
+        self.jeans = make_product('jeans', available_colors=['blue'])
+        ProductSize.objects.create(product=self.jeans, size=size('M'), quantity=1)
+
+    def slugs(self, products):
+        return sorted(product.slug for product in products)
+
+    def test_size_filter_only_matches_sizes_in_stock(self):
+        self.assertEqual(self.slugs(Product.objects.with_sizes(['M'])), ['jeans'])
+        self.assertEqual(self.slugs(Product.objects.with_sizes(['S', 'M'])), ['jeans', 'shirt'])
+
+    def test_inactive_sizes_do_not_match(self):
+        Size.objects.filter(name='S').update(is_active=False)
+        self.assertEqual(self.slugs(Product.objects.with_sizes(['S'])), [])
+
+    def test_colour_filter_skips_products_out_of_stock(self):
+        self.assertEqual(self.slugs(Product.objects.with_colors(['black'])), ['shirt'])
+
+    def test_colour_filter_follows_available_colors(self):
+        self.jeans.available_colors = ['black']
+        self.jeans.save()
+        self.assertEqual(self.slugs(Product.objects.with_colors(['black'])), ['jeans', 'shirt'])
+        self.assertEqual(self.slugs(Product.objects.with_colors(['blue'])), [])
+
+    def test_list_view_combines_size_and_colour(self):
+        response = self.client.get(reverse('products:list'), {'sizes': 'M,S', 'colors': 'Blue'})
+        self.assertEqual(self.slugs(response.context['products']), ['jeans'])
+
+
+class EffectivePriceTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.sale = make_product('sale', price='100.00', discount_price=Decimal('30.00'))
+        self.plain = make_product('plain', price='50.00')
+
+    def effective_price(self, product):
+        return Product.objects.values_list('effective_price', flat=True).get(pk=product.pk)
+
+    def test_save_stores_the_discounted_price(self):
+        self.assertEqual(self.effective_price(self.sale), Decimal('30.00'))
+        self.assertEqual(self.effective_price(self.plain), Decimal('50.00'))
+
+    def test_queryset_update_recomputes_it(self):
+        Product.objects.filter(pk=self.sale.pk).update(discount_price=None)
+        Product.objects.filter(pk=self.plain.pk).update(price=Decimal('40.00'), discount_price=Decimal('0'))
+        self.assertEqual(self.effective_price(self.sale), Decimal('100.00'))
+        self.assertEqual(self.effective_price(self.plain), Decimal('40.00'))
+
+    def test_bulk_writes_recompute_it(self):
+        self.plain.discount_price = Decimal('20.00')
+        Product.objects.bulk_update([self.plain], ['discount_price'])
+        created, = Product.objects.bulk_create([
+            Product(name='New', slug='new', description='-', category=self.sale.category,
+                    price=Decimal('80.00'), discount_price=Decimal('60.00')),
+        ])
+        self.assertEqual(self.effective_price(self.plain), Decimal('20.00'))
+        self.assertEqual(self.effective_price(created), Decimal('60.00'))
+
+    def test_price_sort_uses_the_discounted_price(self):
+        url = reverse('products:list')
+        ascending = [product.slug for product in self.client.get(url, {'sort': 'price'}).context['products']]
+        descending = [product.slug for product in self.client.get(url, {'sort': '-price'}).context['products']]
+        self.assertEqual(ascending, ['sale', 'plain'])
+        self.assertEqual(descending, ['plain', 'sale'])
+
+
+class CategoryCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        Category.objects.create(name='Tops', slug='tops')
+        Category.objects.create(name='Hats', slug='hats', is_active=False)
+
+    def names(self):
+        return [category.name for category in active_categories()]
+
+    def test_cached_reads_skip_the_database(self):
+        self.assertEqual(self.names(), ['Tops'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names(), ['Tops'])
+
+    def test_category_saves_reload_after_commit(self):
+        self.names()
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name='Dresses', slug='dresses')
+            self.assertEqual(self.names(), ['Tops'])
+        self.assertEqual(self.names(), ['Dresses', 'Tops'])
+
+    def test_queryset_updates_reload_after_commit(self):
+        self.names()
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.update(is_active=True)
+        self.assertEqual(self.names(), ['Hats', 'Tops'])
 
-# Create your tests here.
+    def test_other_processes_reload_on_their_next_read(self):
+        here, elsewhere = CategoryCache(), CategoryCache()
+        elsewhere.get()
+        here.invalidate()
+        Category.objects.create(name='Dresses', slug='dresses')
+        self.assertEqual([category.name for category in elsewhere.get()], ['Dresses', 'Tops'])
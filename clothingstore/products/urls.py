@@ -5,5 +5,6 @@ app_name = 'products'
 
 urlpatterns = [
     path('', views.product_list, name='list'),
+    path('autocomplete/', views.autocomplete, name='autocomplete'),
     path('<slug:slug>/', views.product_detail, name='detail'),
 ]
\ No newline at end of file
@@ -1,104 +1,133 @@
+from django.http import JsonResponse
 from django.shortcuts import render, get_object_or_404
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import require_GET
 from django.core.paginator import Paginator
-from django.db.models import Q
+from django.db.models import Prefetch
 from decimal import Decimal
-from .models import Product, Category
+from .models import Product, Color, ProductImage
+from .autocomplete import MAX_SUGGESTIONS, count_searches, suggest
+from .caching import attach_card_versions, cache_anonymous_page
+from .facets import facet_index, price_bucket_filter
+from .navigation import active_categories
+from .pagination import KeysetPaginator, SORT_ORDERINGS, cursor_url
+from .recommendations import related_products_for
+from .search import search_products
 
+@count_searches
+@cache_anonymous_page
 def product_list(request):
-    products = Product.objects.filter(is_active=True).select_related('category').prefetch_related('images')
-    categories = Category.objects.filter(is_active=True)
+    products = Product.objects.filter(is_active=True).select_related('category').with_available_sizes()
+    categories = active_categories()
     
     # Filter by category
     category_param = request.GET.get('category')
-    if category_param:
-        if ',' in category_param:
+    category_slugs = [slug for slug in (category_param or '').split(',') if slug]
+    if category_slugs:
+        if len(category_slugs) > 1:
             # Multiple categories
-            category_slugs = category_param.split(',')
             products = products.filter(category__slug__in=category_slugs)
         else:
             # Single category
-            products = products.filter(category__slug=category_param)
+            products = products.filter(category__slug=category_slugs[0])
     
     # Search functionality
     query = request.GET.get('search') or request.GET.get('q')
     if query:
-        products = products.filter(
-            Q(name__icontains=query) | 
-            Q(description__icontains=query) |
-            Q(category__name__icontains=query)
-        )
+        products = search_products(products, query)
     
     # Price range filter
     price_range = request.GET.get('price_range')
-    if price_range:
-        if price_range == '0-25':
-            products = products.filter(price__lte=25)
-        elif price_range == '25-50':
-            products = products.filter(price__gte=25, price__lte=50)
-        elif price_range == '50-100':
-            products = products.filter(price__gte=50, price__lte=100)
-        elif price_range == '100+':
-            products = products.filter(price__gte=100)
+    price_condition = price_bucket_filter(price_range) if price_range else None
+    if price_condition is not None:
+        products = products.filter(price_condition)
     
-    # Size filter
+    # Size and colour filters: any of the selected values, in stock
     sizes_param = request.GET.get('sizes')
-    if sizes_param:
-        sizes = sizes_param.split(',')
-        # Filter products that have any of the selected sizes
-        size_queries = Q()
-        for size in sizes:
-            size_queries |= Q(available_sizes__contains=size)
-        products = products.filter(size_queries)
+    sizes = [size for size in (sizes_param or '').split(',') if size]
+    if sizes:
+        products = products.with_sizes(sizes)
+    colors_param = request.GET.get('colors')
+    colors = [color.lower() for color in (colors_param or '').split(',') if color]
+    if colors:
+        products = products.with_colors(colors)
     
     # Sorting
     sort_param = request.GET.get('sort')
-    if sort_param:
-        if sort_param == 'name':
-            products = products.order_by('name')
-        elif sort_param == '-name':
-            products = products.order_by('-name')
-        elif sort_param == 'price':
-            products = products.order_by('price')
-        elif sort_param == '-price':
-            products = products.order_by('-price')
-        elif sort_param == '-created_at':
-            products = products.order_by('-created_at')
-        else:
-            products = products.order_by('-created_at', 'name')
+    if sort_param in SORT_ORDERINGS:
+        ordering = SORT_ORDERINGS[sort_param]
+    elif query:
+        # Most relevant matches first when searching without an explicit sort
+        ordering = None
+        products = products.order_by('-search_rank', '-created_at')
     else:
-        products = products.order_by('-created_at', 'name')
+        ordering = SORT_ORDERINGS['-created_at']
+    if ordering:
+        products = products.order_by(*ordering)
     
-    # Pagination
-    paginator = Paginator(products, 12)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Pagination: keyset cursors for every stable sort, page numbers only for
+    # relevance ordering or old ?page= links (those need a COUNT for the total)
+    cursor_pagination = ordering is not None and 'page' not in request.GET
+    if cursor_pagination:
+        paginator = KeysetPaginator(products, ordering, 12)
+        page_obj = paginator.get_page(request.GET.get('cursor'))
+    else:
+        paginator = Paginator(products, 12)
+        page_obj = paginator.get_page(request.GET.get('page'))
+    # Cache keys for the product card fragments, one cache round trip per page
+    attach_card_versions(page_obj)
     
     # Size choices for filter
     size_choices = Product.SIZE_CHOICES
     
+    # Sidebar counts; each facet honours the filters picked in the others
+    search_ids = None
+    if query:
+        search_ids = search_products(Product.objects.filter(is_active=True), query).values_list('id', flat=True)
+    facets = facet_index.counts(
+        {
+            'category': category_slugs,
+            'price': [price_range] if price_condition is not None else [],
+            'size': sizes,
+            'color': colors,
+        },
+        base_ids=search_ids,
+    )
+    
     context = {
         'products': page_obj,
         'page_obj': page_obj,
         'is_paginated': page_obj.has_other_pages(),
+        'cursor_pagination': cursor_pagination,
+        'next_url': cursor_url(request, page_obj.next_cursor) if cursor_pagination and page_obj.has_next() else None,
+        'previous_url': cursor_url(request, page_obj.previous_cursor) if cursor_pagination and page_obj.has_previous() else None,
         'categories': categories,
         'current_category': category_param,
         'query': query,
         'size_choices': size_choices,
         'current_sort': sort_param,
         'current_price_range': price_range,
-        'current_sizes': sizes_param.split(',') if sizes_param else [],
+        'current_sizes': sizes,
+        'color_choices': Color.objects.filter(is_active=True, product_colors__isnull=False).distinct(),
+        'current_colors': colors,
+        'facets': facets,
     }
+    if cursor_pagination and request.headers.get('HX-Request'):
+        # Load more: just the next batch of cards and the updated pager
+        return render(request, 'products/partials/product_page.html', context)
     return render(request, 'products/list.html', context)
 
+@cache_anonymous_page
 def product_detail(request, slug):
-    product = get_object_or_404(Product, slug=slug, is_active=True)
-    related_products = Product.objects.filter(category=product.category, is_active=True).exclude(id=product.id)[:4]
-    
-    # Get the first image as the main image
-    main_image = product.images.filter(is_primary=True).first()
+    # The gallery, primary image first, in one query for the whole page
+    images = Prefetch('images', queryset=ProductImage.objects.order_by('-is_primary', 'id'))
+    product = get_object_or_404(
+        Product.objects.with_available_sizes().prefetch_related(images), slug=slug, is_active=True
+    )
+    related_products = related_products_for(product, limit=4)
     
-    # Get all other images
-    other_images = product.images.exclude(id=main_image.id if main_image else None)
+    main_image = product.primary_image
+    other_images = [image for image in product.images.all() if image != main_image]
     
     context = {
         'product': product,
@@ -106,4 +135,15 @@ def product_detail(request, slug):
         'other_images': other_images,
         'related_products': related_products,
     }
-    return render(request, 'products/detail.html', context)
\ No newline at end of file
+    return render(request, 'products/detail.html', context)
+
+@require_GET
+@cache_control(public=True, max_age=60)
+def autocomplete(request):
+    """Typeahead suggestions for the search box, served from memory."""
+    query = request.GET.get('q', '')
+    try:
+        limit = min(max(int(request.GET.get('limit', 8)), 1), MAX_SUGGESTIONS)
+    except ValueError:
+        limit = 8
+    return JsonResponse({'query': query, 'suggestions': suggest(query, limit)})